@@ -0,0 +1,552 @@
+""" benchmark.py measures md-publisher publish performance offline.
+
+Local stand-in servers mimic the ScienceBase catalog (item, search, upload, item link and delete endpoints)
+and the mdTranslator, with configurable injected latency. md-publisher is served in-process and driven
+with the bundled fixtures through POST /project, POST /product, POST /mdjson, GET /mdjson/<id> and DELETE.
+Latency percentiles, throughput and remote calls per request are reported per endpoint. Runs use fixed
+fixtures and request counts, so results saved with --output can be compared across commits with --compare.
+
+    python benchmark.py --requests 50 --concurrency 8 --sb-latency 50 --translator-latency 200 --output before.json
+    python benchmark.py --requests 50 --concurrency 8 --sb-latency 50 --translator-latency 200 --compare before.json
+
+The ScienceBase stand-in listens on localhost:8090, the sciencebasepy 'dev' environment.
+
+--merge-items runs a micro-benchmark of merge_items instead, on synthetic items with the given numbers of
+tags, identifiers and facets:
+
+    python benchmark.py --merge-items 100 1000 10000
+"""
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from werkzeug.serving import make_server
+import argparse
+import ast
+import collections
+import copy
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import requests
+
+SB_PORT = 8090
+COMMUNITY_ID = 'b0000000000000000000c0de'
+ITEM_LINK_TYPES = [
+    {'id': '4f4e475de4b07f02db47dee1', 'name': 'productOf'},
+    {'id': '4f4e475de4b07f02db47dee2', 'name': 'subprojectOf'},
+    {'id': '4f4e475de4b07f02db47dee3', 'name': 'alternate'},
+    {'id': '4f4e475de4b07f02db47dee4', 'name': 'related'}
+]
+# Items referenced by the associated resources in test.json
+ASSOCIATED_ITEMS = ['50f47cf8e4b0f1f5e1b68acf', '57c7111ae4b0f2f0cebed08f']
+
+class CallCounter(object):
+    """Thread-safe counts of the remote calls made to the stand-in servers"""
+
+    def __init__(self):
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def count(self, call):
+        with self._lock:
+            self._counts[call] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return collections.Counter(self._counts)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Base request handler for the stand-in servers, adding injected latency and call counting"""
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one segment, so keep-alive connections are not held up by delayed ACKs
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_call(self, call, fn):
+        self.server.calls.count(call)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        try:
+            fn()
+        except Exception as e:
+            self.send(500, {'error': str(e)})
+
+class ScienceBase(object):
+    """In-memory ScienceBase catalog"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.items = {}
+        self.files = {}
+        self.links = []
+        self.lock = threading.Lock()
+        self.put({'id': COMMUNITY_ID, 'title': 'LC Map Community', 'parentId': None})
+        for item_id in ASSOCIATED_ITEMS:
+            self.put({'id': item_id, 'title': 'Product', 'parentId': COMMUNITY_ID,
+                      'identifiers': [{'type': 'gov.sciencbase.catalog', 'scheme': 'gov.sciencbase.catalog', 'key': item_id}]})
+
+    def put(self, item):
+        now = time.time()
+        item['provenance'] = {'lastUpdated': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + '.%03dZ' % (now % 1 * 1000)}
+        self.items[item['id']] = item
+
+    def ancestors(self, item_id):
+        ret = []
+        parent_id = self.items[item_id].get('parentId')
+        while parent_id and parent_id in self.items and parent_id not in ret:
+            ret.append(parent_id)
+            parent_id = self.items[parent_id].get('parentId')
+        return ret
+
+    def view(self, item_id, fields=None):
+        item = dict(self.items[item_id])
+        item['ancestors'] = self.ancestors(item_id)
+        if fields:
+            item = dict((k, v) for k, v in item.items() if k in fields.split(',') + ['id', 'title'])
+        return item
+
+    def search(self, params):
+        with self.lock:
+            ids = list(self.items)
+            if params.get('ancestors'):
+                ids = [i for i in ids if params['ancestors'] in self.ancestors(i)]
+            if params.get('lq'):
+                m = re.match(r'^id:\(?(.*?)\)?$', params['lq'])
+                wanted = m.group(1).split(' OR ') if m else []
+                ids = [i for i in ids if i in wanted]
+            if params.get('itemIdentifier'):
+                m = re.match(r"^\{type:'(.*)',key:'(.*)'\}$", params['itemIdentifier'])
+                ids = [i for i in ids if m and any(
+                    m.group(1) in [x.get('type'), x.get('scheme')] and x.get('key') == m.group(2)
+                    for x in self.items[i].get('identifiers', []))]
+            if params.get('sort') == 'lastUpdated':
+                ids.sort(key=lambda i: self.items[i]['provenance']['lastUpdated'], reverse=params.get('order') == 'desc')
+            filter = params.get('filter', '')
+            if filter.startswith('ancestorsExcludingLinks='):
+                ids = [i for i in ids if filter.split('=', 1)[1] in self.ancestors(i)]
+            elif filter.startswith('parentIdExcludingLinks='):
+                ids = [i for i in ids if self.items[i].get('parentId') == filter.split('=', 1)[1]]
+            offset = int(params.get('offset', 0))
+            size = int(params.get('max', 20))
+            ret = {'total': len(ids), 'items': [self.view(i, params.get('fields', 'parentId')) for i in ids[offset:offset + size]]}
+        if offset + size < len(ids):
+            next_params = dict(params, offset=offset + size)
+            ret['nextlink'] = {'url': self.base_url + 'items?' + '&'.join('%s=%s' % kv for kv in next_params.items())}
+        return ret
+
+    def upsert(self, fields, files):
+        item = json.loads(fields['item'])
+        with self.lock:
+            item_id = fields.get('id') or item.get('id') or uuid.uuid4().hex[:24]
+            item['id'] = item_id
+            item_files = [f for f in item.get('files', []) if f['name'] not in files]
+            for name, (content_type, content) in files.items():
+                self.files[(item_id, name)] = content
+                item_files.append({'name': name, 'contentType': content_type, 'size': len(content),
+                                   'url': '%sfile/get/%s?name=%s' % (self.base_url, item_id, name)})
+            item['files'] = item_files
+            item.pop('ancestors', None)
+            self.put(item)
+            return self.view(item_id)
+
+    def update(self, item):
+        with self.lock:
+            item = dict(item, files=item.get('files', []))
+            item.pop('ancestors', None)
+            self.put(item)
+            return self.view(item['id'])
+
+    def delete(self, item_ids):
+        with self.lock:
+            for item_id in item_ids:
+                self.items.pop(item_id, None)
+
+class ScienceBaseHandler(StandInHandler):
+    """Handles the ScienceBase catalog and vocab endpoints used by md-publisher"""
+
+    def do_GET(self):
+        sb = self.server.sb
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        path = url.path
+        if path.startswith('/vocab/'):
+            self.handle_call('GET vocab', lambda: self.send(200, {'list': ITEM_LINK_TYPES}))
+        elif path.startswith('/catalog/item/'):
+            item_id = path.rsplit('/', 1)[1]
+            def get_item():
+                with sb.lock:
+                    found = item_id in sb.items
+                    item = sb.view(item_id, params.get('fields')) if found else None
+                if found:
+                    self.send(200, item)
+                else:
+                    self.send(404, b'Not found', 'text/plain')
+            self.handle_call('GET item', get_item)
+        elif path.rstrip('/') == '/catalog/items':
+            self.handle_call('GET items', lambda: self.send(200, sb.search(params)))
+        elif path.startswith('/catalog/itemLink/'):
+            item_id = path.rsplit('/', 1)[1]
+            self.handle_call('GET itemLink', lambda: self.send(200, [l for l in sb.links if item_id in [l['itemId'], l['relatedItemId']]]))
+        elif path.startswith('/catalog/file/get/'):
+            key = (path.rsplit('/', 1)[1], params.get('name'))
+            self.handle_call('GET file', lambda: self.send(200, sb.files[key], 'application/octet-stream') if key in sb.files else self.send(404, b'', 'text/plain'))
+        else:
+            self.send(404, b'', 'text/plain')
+
+    def do_POST(self):
+        sb = self.server.sb
+        path = urlparse(self.path).path
+        body = self.read_body()
+        if path.startswith('/catalog/file/uploadAndUpsertItem'):
+            self.handle_call('POST uploadAndUpsertItem', lambda: self.send(200, sb.upsert(*parse_multipart(self.headers['Content-Type'], body))))
+        elif path.startswith('/catalog/itemLink'):
+            def create_link():
+                link = json.loads(body)
+                link['id'] = uuid.uuid4().hex[:24]
+                with sb.lock:
+                    sb.links.append(link)
+                self.send(200, link)
+            self.handle_call('POST itemLink', create_link)
+        else:
+            self.send(404, b'', 'text/plain')
+
+    def do_PUT(self):
+        sb = self.server.sb
+        path = urlparse(self.path).path
+        body = self.read_body()
+        if path.startswith('/catalog/item/'):
+            self.handle_call('PUT item', lambda: self.send(200, sb.update(json.loads(body))))
+        else:
+            self.send(404, b'', 'text/plain')
+
+    def do_DELETE(self):
+        sb = self.server.sb
+        path = urlparse(self.path).path
+        body = self.read_body()
+        if path.rstrip('/') == '/catalog/items':
+            self.handle_call('DELETE items', lambda: (sb.delete([i['id'] for i in json.loads(body)]), self.send(200, {})))
+        elif path.startswith('/catalog/item/'):
+            self.handle_call('DELETE item', lambda: (sb.delete([path.rsplit('/', 1)[1]]), self.send(200, {})))
+        else:
+            self.send(404, b'', 'text/plain')
+
+class TranslatorHandler(StandInHandler):
+    """Handles mdTranslator requests, with responses shaped like the mdTranslator's"""
+
+    def do_POST(self):
+        options = dict((k, v[0]) for k, v in parse_qs(self.read_body().decode('utf-8'), keep_blank_values=True).items())
+        self.handle_call('POST %s' % options.get('writer'), lambda: self.send(200, translate(options)))
+
+def translate(options):
+    """Stand-in translation: sbJSON from sbjson.py, a small mdJSON record or a small ISO document"""
+    import sbjson
+    source = json.loads(options['file'])
+    writer = options['writer']
+    if writer == 'sbJson':
+        try:
+            data = json.dumps(sbjson.translate(source))
+        except sbjson.UnsupportedMdJson:
+            data = json.dumps({'title': source['metadata']['resourceInfo']['citation']['title']})
+    elif writer == 'mdJson':
+        data = json.dumps({'schema': {'name': 'mdJson', 'version': '2.0.0'},
+                           'metadata': {'resourceInfo': {'citation': {'title': source.get('title')}}}})
+    else:
+        data = '<?xml version="1.0" encoding="UTF-8"?><metadata><title>%s</title></metadata>' % source['metadata']['resourceInfo']['citation']['title']
+    return {'success': True, 'data': data}
+
+def parse_multipart(content_type, body):
+    """Parse a multipart/form-data body
+    :return: Tuple of dict of form fields, and dict of file name to (content type, content)
+    """
+    message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    fields, files = {}, {}
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        filename = part.get_filename()
+        content = part.get_payload(decode=True)
+        if filename:
+            files[filename] = (part.get_content_type(), content)
+        else:
+            fields[name] = content.decode('utf-8')
+    return fields, files
+
+class StandInServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections when many requests arrive at once, and the
+    # client's retry a second later would be counted as remote latency
+    request_queue_size = 128
+
+def start_server(port, handler, latency, calls, **attrs):
+    """Start a stand-in server in a daemon thread"""
+    server = StandInServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.calls = calls
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def load_fixture(fname):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), fname)) as f:
+        ret = json.load(f)
+    return ret['data']['mdjson'] if 'data' in ret else ret
+
+def make_record(md_json, i, resource_type):
+    """Make a distinct copy of a fixture record, so each request publishes a different item
+    :param md_json: Fixture mdJSON
+    :param i: Record number
+    :param resource_type: 'project' or 'product'
+    :return: mdJSON
+    """
+    ret = copy.deepcopy(md_json)
+    metadata = ret['metadata']
+    metadata['resourceInfo']['resourceType'] = [{'type': resource_type}]
+    metadata_info = metadata.setdefault('metadataInfo', {})
+    metadata_info['metadataIdentifier'] = {'identifier': 'benchmark-%s-%d' % (resource_type, i), 'namespace': 'urn:uuid'}
+    metadata_info.pop('parentMetadata', None)
+    citation = metadata['resourceInfo']['citation']
+    citation['identifier'] = [dict(identifier, identifier='%s-%d' % (identifier['identifier'], i))
+                              for identifier in citation.get('identifier', [])
+                              if identifier.get('namespace') != 'gov.sciencebase.catalog']
+    return ret
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+def run_phase(name, requests_to_send, concurrency, calls):
+    """Send requests concurrently and measure them
+    :param name: Endpoint name
+    :param requests_to_send: List of functions, each sending one request and returning the response
+    :param concurrency: Number of requests in flight
+    :param calls: CallCounter of the stand-in servers
+    :return: Tuple of endpoint results and responses
+    """
+    def timed(send):
+        start = time.perf_counter()
+        response = send()
+        return time.perf_counter() - start, response
+
+    before = calls.snapshot()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, requests_to_send))
+    elapsed = time.perf_counter() - start
+    remote_calls = calls.snapshot()
+    remote_calls.subtract(before)
+
+    latencies = [r[0] * 1000 for r in results]
+    statuses = collections.Counter(str(r[1].status_code) for r in results)
+    ret = {
+        'requests': len(results),
+        'statuses': dict(statuses),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(results) / elapsed, 2) if elapsed else None,
+        'latency_ms': dict(('p%d' % p, round(percentile(latencies, p), 1)) for p in [50, 90, 95, 99]),
+        'remote_calls_per_request': dict((call, round(n / float(len(results)), 2)) for call, n in sorted(remote_calls.items()) if n)
+    }
+    ret['latency_ms']['mean'] = round(sum(latencies) / len(latencies), 1)
+    ret['latency_ms']['max'] = round(max(latencies), 1)
+    print_phase(name, ret)
+    return ret, [r[1] for r in results]
+
+def print_phase(name, result):
+    latency = result['latency_ms']
+    print('%-28s %4d req %8.2f req/s  p50 %8.1f  p90 %8.1f  p99 %8.1f ms  %s' % (
+        name, result['requests'], result['throughput'] or 0, latency['p50'], latency['p90'], latency['p99'],
+        ' '.join('%s:%d' % kv for kv in sorted(result['statuses'].items()))))
+    print('    remote calls/request: %s' % ', '.join('%s %.2f' % kv for kv in result['remote_calls_per_request'].items()))
+
+def compare(results, baseline):
+    """Print the change of each endpoint's latency and throughput from a baseline run"""
+    print('\nCompared with %s (%s):' % (baseline.get('commit'), baseline.get('label') or ''))
+    for name, result in results['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        changes = []
+        for key, value, base_value in [
+                ('p50', result['latency_ms']['p50'], base['latency_ms']['p50']),
+                ('p90', result['latency_ms']['p90'], base['latency_ms']['p90']),
+                ('req/s', result['throughput'], base['throughput'])]:
+            if base_value:
+                changes.append('%s %+.1f%%' % (key, (value - base_value) * 100.0 / base_value))
+        base_calls = sum(base['remote_calls_per_request'].values())
+        calls = sum(result['remote_calls_per_request'].values())
+        changes.append('remote calls/request %.2f -> %.2f' % (base_calls, calls))
+        print('%-28s %s' % (name, '  '.join(changes)))
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except Exception:
+        return None
+
+def make_merge_items(size):
+    """Make a synthetic original and new item for merge_items, each with size tags and identifiers and
+    size / 10 facets, half of them shared between the two items
+    :param size: Number of tags and identifiers
+    :return: Tuple of original and new ScienceBase Item JSON
+    """
+    def item(offset):
+        return {
+            'id': 'c0000000000000000000c0de', 'parentId': COMMUNITY_ID, 'title': 'Synthetic', 'files': [],
+            'tags': [{'type': 'Keyword', 'scheme': 'synthetic', 'name': 'tag %d' % (i + offset)} for i in range(size)],
+            'identifiers': [{'type': 'lcc:synthetic', 'scheme': 'lcc:synthetic', 'key': 'id-%d' % (i + offset)} for i in range(size)],
+            'facets': [{'className': 'gov.sciencebase.catalog.item.facet.Facet%d' % (i + offset // 10)} for i in range(max(size // 10, 1))]
+        }
+    return item(0), item(size // 2)
+
+def run_merge_benchmark(sizes):
+    """Time merge_items on synthetic items
+    :param sizes: Numbers of tags and identifiers per item
+    """
+    import md_publisher
+    md_publisher.app.logger.setLevel('WARNING')
+    print('merge_items on synthetic items (tags and identifiers per item, half shared)\n')
+    for size in sizes:
+        original, new = make_merge_items(size)
+        runs = max(1, min(200, 200000 // size))
+        inputs = [(copy.deepcopy(original), copy.deepcopy(new)) for i in range(runs)]
+        start = time.perf_counter()
+        with md_publisher.app.app_context():
+            for original_item, new_item in inputs:
+                merged = md_publisher.merge_items(original_item, new_item)
+        seconds = (time.perf_counter() - start) / runs
+        print('%8d entries  %10.3f ms per merge  %6d tags  %6d identifiers' % (size, seconds * 1000, len(merged['tags']), len(merged['identifiers'])))
+
+def main():
+    argparser = argparse.ArgumentParser(description='Offline md-publisher benchmark')
+    argparser.add_argument('--requests', type=int, default=20, help='Requests per endpoint')
+    argparser.add_argument('--concurrency', type=int, default=4, help='Requests in flight')
+    argparser.add_argument('--sb-latency', type=float, default=50, help='Milliseconds added to each ScienceBase response')
+    argparser.add_argument('--translator-latency', type=float, default=200, help='Milliseconds added to each mdTranslator response')
+    argparser.add_argument('--relationships', type=int, default=2, help='Related products published with each project')
+    argparser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Override an md-publisher config value')
+    argparser.add_argument('--label', help='Label saved with the results')
+    argparser.add_argument('--output', help='Save the results as JSON')
+    argparser.add_argument('--compare', help='Compare with results saved by an earlier run')
+    argparser.add_argument('--merge-items', type=int, nargs='+', metavar='SIZE', help='Only benchmark merge_items, on items of these sizes')
+    args = argparser.parse_args()
+    if args.merge_items:
+        run_merge_benchmark(args.merge_items)
+        return
+
+    calls = CallCounter()
+    sb_url = 'http://localhost:%d/catalog/' % SB_PORT
+    sb_server = start_server(SB_PORT, ScienceBaseHandler, args.sb_latency / 1000.0, calls, sb=ScienceBase(sb_url))
+    translator_server = start_server(0, TranslatorHandler, args.translator_latency / 1000.0, calls)
+
+    import md_publisher
+    app = md_publisher.app
+    cache_dir = tempfile.mkdtemp(prefix='md_publisher_benchmark')
+    app.config.update({
+        'SCIENCEBASE_ENV': 'dev',
+        'MDTRANSLATOR_URL': 'http://127.0.0.1:%d/translator/api/v2/translator' % translator_server.server_port,
+        'LC_MAP_ID': COMMUNITY_ID,
+        'TRANSLATION_CACHE_PATH': os.path.join(cache_dir, 'translations.db'),
+        'LOGGING_LEVEL': 'WARNING'
+    })
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        app.config[key] = value
+    app.logger.setLevel('WARNING')
+    logging.getLogger('werkzeug').setLevel('WARNING')
+    publisher_server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=publisher_server.serve_forever, daemon=True).start()
+    publisher_url = 'http://127.0.0.1:%d' % publisher_server.server_port
+
+    project = load_fixture('test.json')
+    product = load_fixture('md_metadata.json')
+    n = args.requests
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    def project_request(i):
+        return {'data': {'parentid': COMMUNITY_ID, 'mdjson': make_record(project, i, 'project'),
+                         'relationships': [make_record(product, n * (j + 1) + i, 'product') for j in range(args.relationships)]}}
+
+    def post(path, body):
+        return lambda: session.post(publisher_url + path, json=body)
+
+    def put(path, body):
+        return lambda: session.put(publisher_url + path, json=body)
+
+    def ids(responses):
+        ret = []
+        for response in responses:
+            body = response.json() if response.status_code == 200 else {}
+            body = body['message'][0] if 'message' in body else body
+            body = body[0] if isinstance(body, list) else body
+            ret.append(body.get('id'))
+        return ret
+
+    print('md-publisher %s at %s, %d requests per endpoint, concurrency %d, ScienceBase latency %.0f ms, mdTranslator latency %.0f ms\n' % (
+        md_publisher.VERSION, get_commit(), n, args.concurrency, args.sb_latency, args.translator_latency))
+    endpoints = collections.OrderedDict()
+    endpoints['POST /project'], responses = run_phase('POST /project', [post('/project', project_request(i)) for i in range(n)], args.concurrency, calls)
+    project_ids = ids(responses)
+    endpoints['POST /project (unchanged)'], responses = run_phase('POST /project (unchanged)', [post('/project', {'data': dict(project_request(i)['data'], force_update=False)}) for i in range(n)], args.concurrency, calls)
+    product_records = [make_record(product, i, 'product') for i in range(n)]
+    endpoints['POST /product'], responses = run_phase('POST /product', [post('/product', {'data': {'parentid': COMMUNITY_ID, 'mdjson': md}}) for md in product_records], args.concurrency, calls)
+    product_ids = ids(responses)
+    endpoints['PUT /product/<id> (republish)'], responses = run_phase('PUT /product/<id> (republish)', [put('/product/' + str(i), {'data': {'mdjson': md}}) for i, md in zip(product_ids, product_records)], args.concurrency, calls)
+    endpoints['POST /mdjson'], responses = run_phase('POST /mdjson', [post('/mdjson', {'data': md}) for md in product_records], args.concurrency, calls)
+    endpoints['GET /mdjson/<id>'], responses = run_phase('GET /mdjson/<id>', [(lambda i: lambda: session.get(publisher_url + '/mdjson/' + str(i)))(i) for i in product_ids], args.concurrency, calls)
+    endpoints['DELETE /product/<id>'], responses = run_phase('DELETE /product/<id>', [(lambda i: lambda: session.delete(publisher_url + '/product/' + str(i)))(i) for i in product_ids], args.concurrency, calls)
+    endpoints['DELETE /project/<id>'], responses = run_phase('DELETE /project/<id>', [(lambda i: lambda: session.delete(publisher_url + '/project/' + str(i)))(i) for i in project_ids], args.concurrency, calls)
+
+    results = {
+        'commit': get_commit(),
+        'label': args.label,
+        'version': md_publisher.VERSION,
+        'params': {'requests': n, 'concurrency': args.concurrency, 'sb_latency_ms': args.sb_latency,
+                   'translator_latency_ms': args.translator_latency, 'relationships': args.relationships, 'set': args.set},
+        'endpoints': endpoints
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    publisher_server.shutdown()
+    sb_server.shutdown()
+    translator_server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+""" bulk_import.py publishes mdJSON records to ScienceBase in-process, without a running md-publisher service.
+
+Records are read from JSON files (one record, or an array of records), NDJSON files (.ndjson, .jsonl, one
+record per line), directories of those files, or NDJSON on standard input ('-'). Each record is in the format
+posted to /project or /product (add item_id to update a specific item), or is a bare mdJSON document. Records
+are published with the same create_or_update_item logic as the service, on a pool of worker threads.
+
+Every finished record is appended to a checkpoint log. Running the same import again skips the records the
+log shows were published, so an interrupted import resumes where it stopped; records that failed are tried
+again. A throughput report is printed at the end.
+
+    SB_ACCESS_TOKEN=... python bulk_import.py exports/ --parent-id 5a1b... --workers 8
+    zcat dump.ndjson.gz | python bulk_import.py - --checkpoint dump.checkpoint
+"""
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+import argparse
+import ast
+import hashlib
+import os
+import sys
+import time
+import jsoncodec
+import md_publisher
+
+RECORD_FILE_EXTENSIONS = ('.json', '.ndjson', '.jsonl')
+NDJSON_FILE_EXTENSIONS = ('.ndjson', '.jsonl')
+
+def iter_records(paths):
+    """Read records from files, directories and standard input
+    :param paths: Paths of files or directories, or '-' for NDJSON on standard input
+    :return: Generator of (source, record) tuples, where source names the file and line or index of the record,
+    and record is the parsed JSON, or the ValueError raised parsing it
+    """
+    for path in paths:
+        if path == '-':
+            yield from iter_ndjson('<stdin>', sys.stdin.buffer)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fname in sorted(files):
+                    if fname.lower().endswith(RECORD_FILE_EXTENSIONS):
+                        yield from iter_file_records(os.path.join(root, fname))
+        else:
+            yield from iter_file_records(path)
+
+def iter_file_records(path):
+    """Read the records in a JSON or NDJSON file
+    :param path: File path
+    :return: Generator of (source, record) tuples
+    """
+    with open(path, 'rb') as f:
+        if path.lower().endswith(NDJSON_FILE_EXTENSIONS):
+            yield from iter_ndjson(path, f)
+            return
+        try:
+            data = jsoncodec.loads(f.read())
+        except ValueError as e:
+            yield path, e
+            return
+    if isinstance(data, list):
+        for index, record in enumerate(data):
+            yield '%s[%d]' % (path, index), record
+    else:
+        yield path, data
+
+def iter_ndjson(name, f):
+    """Read the records in an NDJSON stream
+    :param name: Name of the stream, for the record sources
+    :param f: Binary file object
+    :return: Generator of (source, record) tuples
+    """
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield '%s:%d' % (name, number), jsoncodec.loads(line)
+            except ValueError as e:
+                yield '%s:%d' % (name, number), e
+
+def get_publish_data(record, defaults):
+    """Get the data to publish for a record, in the format posted to /project or /product
+    :param record: Record, with or without the 'data' wrapper, or a bare mdJSON document
+    :param defaults: Publishing options (e.g. parentid) for records that do not set them
+    :return: Data to publish
+    """
+    md = record['data'] if isinstance(record, dict) and 'data' in record else record
+    if isinstance(md, dict) and 'mdjson' not in md and 'metadata' in md:
+        md = {'mdjson': md}
+    if isinstance(md, dict):
+        md = dict(defaults, **md)
+    return md
+
+def get_record_hash(md):
+    """Get the hash identifying a record in the checkpoint log
+    :param md: Data to publish
+    :return: Hex SHA-256 of the canonical JSON of the record, without any ScienceBase tokens
+    """
+    md = {key: value for key, value in md.items() if key not in ('access_token', 'refresh_token')}
+    return hashlib.sha256(jsoncodec.canonical_dumps(md).encode('utf-8')).hexdigest()
+
+def load_checkpoint(path):
+    """Load the hashes of the records a checkpoint log shows were published
+    :param path: Checkpoint log path
+    :return: Set of record hashes
+    """
+    ret = set()
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = jsoncodec.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if entry.get('status') == 200:
+                    ret.add(entry['hash'])
+    return ret
+
+def publish(md, token):
+    """Publish one record in its own request context, as the service would for a POST to /project
+    :param md: Data to publish
+    :param token: ScienceBase tokens, used if the record has none of its own
+    :return: Tuple of HTTP status code, resulting JSON and seconds taken
+    """
+    start = time.time()
+    token = md_publisher.get_token(md) or token
+    with md_publisher.app.test_request_context('/project', method='POST', data=jsoncodec.dumpb(token),
+                                               content_type='application/json'):
+        status_code, result = md_publisher.publish_record(md)
+    return status_code, result, time.time() - start
+
+def get_item_ids(result):
+    """Get the IDs of the items published for a record
+    :param result: Resulting JSON
+    :return: List of item IDs
+    """
+    items = result if isinstance(result, list) else [result]
+    return [item['id'] for item in items if isinstance(item, dict) and item.get('id')]
+
+def get_error_messages(result):
+    """Get the error messages of a failed record
+    :param result: Resulting JSON
+    :return: List of messages
+    """
+    if isinstance(result, dict) and isinstance(result.get('error'), dict):
+        return result['error'].get('messages', [])
+    return [jsoncodec.dumps(result)[:500]]
+
+def run_import(records, checkpoint_path, workers, token, defaults, redo=False):
+    """Publish records on a worker pool, appending each finished record to the checkpoint log
+    :param records: Iterable of (source, record) tuples
+    :param checkpoint_path: Checkpoint log path
+    :param workers: Number of records published concurrently
+    :param token: ScienceBase tokens
+    :param defaults: Publishing options for records that do not set them
+    :param redo: Publish records again even if the checkpoint log shows they were published
+    :return: Report JSON
+    """
+    completed = set() if redo else load_checkpoint(checkpoint_path)
+    report = {'total': 0, 'succeeded': 0, 'failed': 0, 'skipped': 0, 'interrupted': False}
+    seconds = []
+    start = time.time()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import')
+    checkpoint = open(checkpoint_path, 'ab')
+    pending = {}
+
+    def record_result(source, record_hash, status_code, result, elapsed):
+        entry = {'hash': record_hash, 'source': source, 'status': status_code, 'items': get_item_ids(result),
+                 'seconds': round(elapsed, 3), 'time': time.time()}
+        if status_code == 200:
+            report['succeeded'] += 1
+            completed.add(record_hash)
+        else:
+            report['failed'] += 1
+            entry['messages'] = get_error_messages(result)
+        checkpoint.write(jsoncodec.dumpb(entry) + b'\n')
+        checkpoint.flush()
+        if record_hash is not None:
+            seconds.append(elapsed)
+        print('%s %d %s' % (source, status_code, ' '.join(entry['items']) or '; '.join(entry.get('messages', []))), flush=True)
+
+    def collect(return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            source, record_hash = pending.pop(future)
+            if future.cancelled():
+                continue
+            status_code, result, elapsed = future.result()
+            record_result(source, record_hash, status_code, result, elapsed)
+
+    try:
+        for source, record in records:
+            report['total'] += 1
+            if isinstance(record, ValueError):
+                record_result(source, None, 400, {"error": {"messages": ["Invalid JSON: %s" % record]}}, 0)
+                continue
+            md = get_publish_data(record, defaults)
+            if not isinstance(md, dict):
+                record_result(source, None, 400, {"error": {"messages": ["Each record must be a JSON object"]}}, 0)
+                continue
+            record_hash = get_record_hash(md)
+            if record_hash in completed:
+                report['skipped'] += 1
+                continue
+            # Read ahead only as far as the workers can use, so large streams are not held in memory
+            while len(pending) >= workers * 2:
+                collect(FIRST_COMPLETED)
+            # Mark the record as in progress, so a duplicate later in the input is not published concurrently
+            completed.add(record_hash)
+            pending[executor.submit(publish, md, token)] = (source, record_hash)
+        while pending:
+            collect(FIRST_COMPLETED)
+    except KeyboardInterrupt:
+        # Finish the records in progress and log them, so the next run resumes after them
+        report['interrupted'] = True
+        for future in pending:
+            future.cancel()
+        collect(ALL_COMPLETED)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        checkpoint.close()
+    report['seconds'] = round(time.time() - start, 3)
+    published = report['succeeded'] + report['failed']
+    report['records_per_second'] = round(published / report['seconds'], 3) if report['seconds'] else 0
+    if seconds:
+        seconds.sort()
+        report['record_seconds'] = {'p50': round(seconds[len(seconds) // 2], 3), 'p95': round(seconds[int(len(seconds) * 0.95)], 3),
+                                    'max': round(seconds[-1], 3)}
+    return report
+
+def print_report(report):
+    """Print the throughput report of an import"""
+    print('\n%d records: %d published, %d failed, %d skipped as already published%s' % (
+        report['total'], report['succeeded'], report['failed'], report['skipped'], ' (interrupted)' if report['interrupted'] else ''))
+    print('%.1f s, %.2f records/s' % (report['seconds'], report['records_per_second']))
+    if 'record_seconds' in report:
+        print('Seconds per record: p50 %(p50).2f, p95 %(p95).2f, max %(max).2f' % report['record_seconds'])
+
+def main():
+    argparser = argparse.ArgumentParser(description='Publish mdJSON records to ScienceBase in-process')
+    argparser.add_argument('paths', nargs='+', metavar='PATH', help="JSON or NDJSON file, directory of them, or '-' for NDJSON on standard input")
+    argparser.add_argument('--workers', type=int, default=md_publisher.app.config['BATCH_WORKERS'], help='Records published concurrently')
+    argparser.add_argument('--checkpoint', default='bulk_import.checkpoint', help='Checkpoint log, appended to and used to resume')
+    argparser.add_argument('--redo', action='store_true', help='Publish records again even if the checkpoint log shows they were published')
+    argparser.add_argument('--parent-id', help='parentid of records that do not set one')
+    argparser.add_argument('--community-id', help='community_id of records that do not set one')
+    argparser.add_argument('--force', action=argparse.BooleanOptionalAction,
+                           help='force_update of records that do not set one: --force updates items even if their mdJSON is unchanged, '
+                                '--no-force skips them (default: the FORCE_UPDATE config value)')
+    argparser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='Override an md-publisher config value')
+    args = argparser.parse_args()
+
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        md_publisher.app.config[key] = value
+    # Tokens are read from the environment rather than the command line, where other users could see them
+    token = md_publisher.get_token({'access_token': os.environ.get('SB_ACCESS_TOKEN'), 'refresh_token': os.environ.get('SB_REFRESH_TOKEN')})
+    token = {key: value for key, value in token.items() if value}
+    defaults = {}
+    if args.parent_id:
+        defaults['parentid'] = args.parent_id
+    if args.community_id:
+        defaults['community_id'] = args.community_id
+    if args.force is not None:
+        defaults['force_update'] = args.force
+
+    report = run_import(iter_records(args.paths), args.checkpoint, args.workers, token, defaults, args.redo)
+    print_report(report)
+    sys.exit(130 if report['interrupted'] else 1 if report['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
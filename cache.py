@@ -0,0 +1,301 @@
+""" cache.py provides the in-process and shared on-disk caches used by md-publisher """
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LRUCache(object):
+    """Thread-safe, size bounded, least recently used in-process cache"""
+
+    def __init__(self, max_entries):
+        """
+        :param max_entries: Maximum number of entries to hold. 0 disables the cache.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get a cached value, marking it as recently used
+        :param key: Cache key
+        :param default: Value to return if the key is not cached
+        :return: Cached value, or default
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used entries if the cache is full
+        :param key: Cache key
+        :param value: Value to cache
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove a value from the cache
+        :param key: Cache key
+        :param default: Value to return if the key is not cached
+        :return: The removed value, or default
+        """
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def discard(self, predicate):
+        """Remove all entries matching a predicate
+        :param predicate: Function of (key, value) returning True for entries to remove
+        :return: Number of entries removed
+        """
+        with self._lock:
+            keys = [key for key, value in self._entries.items() if predicate(key, self._value(value))]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get cache counters
+        :return: Dict of entry, hit, miss and eviction counts
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _value(self, entry):
+        """Get the cached value from a stored entry"""
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries expire a fixed number of seconds after they are cached"""
+
+    def __init__(self, max_entries, ttl):
+        """
+        :param max_entries: Maximum number of entries to hold. 0 disables the cache.
+        :param ttl: Seconds an entry stays valid
+        """
+        super(TTLCache, self).__init__(max_entries)
+        self.ttl = ttl
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Get a cached value that has not expired, marking it as recently used
+        :param key: Cache key
+        :param default: Value to return if the key is not cached or has expired
+        :return: Cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        super(TTLCache, self).put(key, (time.monotonic() + self.ttl, value))
+
+    def pop(self, key, default=None):
+        entry = super(TTLCache, self).pop(key)
+        return default if entry is None else entry[1]
+
+    def stats(self):
+        ret = super(TTLCache, self).stats()
+        ret['expirations'] = self.expirations
+        return ret
+
+    def _value(self, entry):
+        return entry[1]
+
+class DiskCache(object):
+    """Size bounded cache stored in a SQLite database, so it can be shared by several processes
+    (e.g. gunicorn workers) on the same host. Errors accessing the database are logged and treated
+    as cache misses; the cache never causes a caller to fail.
+    """
+
+    def __init__(self, path, max_bytes, timeout=5.0):
+        """
+        :param path: Path of the SQLite database file
+        :param max_bytes: Maximum total size of the cached values
+        :param timeout: Seconds to wait on a database locked by another process
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Get the SQLite connection for the current thread, creating the cache table if needed"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                         'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get(self, key, default=None):
+        """Get a cached value, marking it as recently used
+        :param key: Cache key
+        :param default: Value to return if the key is not cached
+        :return: Cached value, or default
+        """
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), key))
+                self._count('hits')
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning('Disk cache read failed: %s' % e)
+        self._count('misses')
+        return default
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used entries when over the size limit
+        :param key: Cache key
+        :param value: Value to cache (str or bytes)
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        try:
+            conn = self._connection()
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                         (key, value, size, time.time()))
+            self._evict(conn)
+        except sqlite3.Error as e:
+            logger.warning('Disk cache write failed: %s' % e)
+
+    def _evict(self, conn):
+        """Delete least recently used entries until the cache is within its size limit"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        keys = []
+        for key, size in conn.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            keys.append(key)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        conn.executemany('DELETE FROM cache WHERE key = ?', [(key,) for key in keys])
+        self._count('evictions', len(keys))
+
+    def pop(self, key, default=None):
+        """Remove a value from the cache
+        :param key: Cache key
+        :param default: Value to return if the key is not cached
+        :return: The removed value, or default
+        """
+        ret = default
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                ret = row[0]
+        except sqlite3.Error as e:
+            logger.warning('Disk cache delete failed: %s' % e)
+        return ret
+
+    def clear(self):
+        try:
+            self._connection().execute('DELETE FROM cache')
+        except sqlite3.Error as e:
+            logger.warning('Disk cache clear failed: %s' % e)
+
+    def stats(self):
+        """Get cache counters
+        :return: Dict of entry, size, hit, miss and eviction counts
+        """
+        entries, size = 0, 0
+        try:
+            entries, size = self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        except sqlite3.Error as e:
+            logger.warning('Disk cache stats failed: %s' % e)
+        with self._lock:
+            return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class TieredCache(object):
+    """An in-process LRU cache in front of an optional shared DiskCache"""
+
+    def __init__(self, memory, disk=None):
+        """
+        :param memory: LRUCache
+        :param disk: DiskCache, or None for an in-process cache only
+        """
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        """Get a cached value from memory, falling back to disk
+        :param key: Cache key
+        :param default: Value to return if the key is not cached
+        :return: Cached value, or default
+        """
+        ret = self.memory.get(key)
+        if ret is None and self.disk is not None:
+            ret = self.disk.get(key)
+            if ret is not None:
+                self.memory.put(key, ret)
+        return default if ret is None else ret
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def pop(self, key, default=None):
+        ret = self.memory.pop(key)
+        if self.disk is not None:
+            disk_ret = self.disk.pop(key)
+            ret = disk_ret if ret is None else ret
+        return default if ret is None else ret
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        """Get counters for each tier
+        :return: Dict of memory and disk cache stats
+        """
+        return {'memory': self.memory.stats(), 'disk': self.disk.stats() if self.disk is not None else None}
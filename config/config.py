@@ -7,4 +7,105 @@ LC_MAP_ID = '4f4e476ee4b07f02db47e164' # Prod LC Map Community ID
 SCIENCEBASE_ENV = 'prod'
 #DEBUG = True
 LOGGING_LEVEL = logging.INFO
-FORCE_UPDATE = True
\ No newline at end of file
+FORCE_UPDATE = True
+# Translation cache. The in-process LRU tier holds TRANSLATION_CACHE_SIZE entries per worker; the
+# SQLite tier at TRANSLATION_CACHE_PATH is shared by all workers on the host (None disables it).
+TRANSLATION_CACHE_SIZE = 512
+TRANSLATION_CACHE_PATH = '/tmp/md_publisher_translations.db'
+TRANSLATION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Maximum number of concurrent requests to the mdTranslator per worker
+TRANSLATOR_WORKERS = 8
+
+# Number of records published concurrently by each /batch request
+BATCH_WORKERS = 4
+
+# Number of related products (relationships) published concurrently for a project
+RELATIONSHIP_WORKERS = 4
+
+# Identifier search results (including "not found") are cached for IDENTIFIER_CACHE_TTL seconds, separately for each
+# caller's credentials, since a search only finds the items its caller can read
+IDENTIFIER_CACHE_SIZE = 4096
+IDENTIFIER_CACHE_TTL = 300
+
+# Item ancestors, used for community membership checks, are cached for ANCESTOR_CACHE_TTL seconds, separately for
+# each caller's credentials, and dropped for an item and its descendants when it is updated or deleted
+ANCESTOR_CACHE_SIZE = 4096
+ANCESTOR_CACHE_TTL = 600
+
+# ItemLinks of an item are loaded once and reused for LINK_CACHE_TTL seconds
+LINK_CACHE_SIZE = 1024
+LINK_CACHE_TTL = 60
+
+# Subtree deletes send DELETE_CHUNK_SIZE items per request, DELETE_WORKERS requests at a time
+DELETE_CHUNK_SIZE = 100
+DELETE_WORKERS = 4
+
+# Largest attached mdJSON file that will be downloaded
+MDJSON_MAX_BYTES = 64 * 1024 * 1024
+
+# Connection pool size and timeout (seconds) of the HTTP client used by the async publish path (md_publisher_async)
+ASYNC_HTTP_MAX_CONNECTIONS = 100
+ASYNC_HTTP_TIMEOUT = 120
+
+# mdTranslator client: keep-alive connection pool size, connect and read timeouts (seconds), and retries
+# of failed connections and TRANSLATOR_RETRY_STATUS responses with jittered exponential backoff (seconds)
+TRANSLATOR_POOL_SIZE = 16
+TRANSLATOR_CONNECT_TIMEOUT = 5
+TRANSLATOR_READ_TIMEOUT = 120
+TRANSLATOR_RETRIES = 3
+TRANSLATOR_RETRY_BACKOFF = 0.5
+TRANSLATOR_RETRY_STATUS = [502, 503, 504]
+
+# Authenticated ScienceBase sessions are pooled per token, up to SB_SESSION_POOL_SIZE sessions,
+# each expiring after SB_SESSION_IDLE_TIMEOUT seconds unused
+SB_SESSION_POOL_SIZE = 64
+SB_SESSION_IDLE_TIMEOUT = 1800
+
+# mdJSON to sbJSON translation: 'remote' uses the mdTranslator, 'native' translates in-process (sbjson.py),
+# falling back to the mdTranslator for mdJSON it does not cover, and 'conformance' runs both, logging any
+# differences and publishing the mdTranslator result
+SBJSON_TRANSLATOR = 'remote'
+
+# Publishes and deletes requested with ?async=true (or Prefer: respond-async) run as background jobs on
+# JOB_WORKERS threads per worker. Jobs are stored at JOB_STORE_PATH, shared by all workers on the host,
+# and finished jobs are kept for JOB_RETENTION seconds.
+JOB_WORKERS = 2
+JOB_STORE_PATH = '/tmp/md_publisher_jobs.db'
+JOB_RETENTION = 7 * 24 * 3600
+
+# Request and remote call metrics of every worker on the host are shared through a SQLite database at
+# METRICS_STORE_PATH, which each worker writes every METRICS_FLUSH_INTERVAL seconds, so /metrics reports their
+# totals whichever worker serves it (None reports only the worker serving it).
+METRICS_STORE_PATH = '/tmp/md_publisher_metrics.db'
+METRICS_FLUSH_INTERVAL = 5
+
+# JSON serialization backend: 'orjson', 'json' (the standard library), or 'auto' for orjson when installed
+JSON_CODEC = 'auto'
+
+# Extent features copied from mdJSON can be reduced before publishing: coordinates rounded to EXTENT_PRECISION
+# decimal places (None keeps full precision), lines and polygon rings simplified within EXTENT_SIMPLIFY_TOLERANCE
+# degrees (0 keeps every vertex) and to at most EXTENT_MAX_VERTICES positions per feature (None for no limit,
+# and exceeded when positions are needed to keep polygon rings from crossing), and each feature given its
+# bounding box. This changes the published extents, and so the item of every record on its next publish, so
+# it is off unless one of these is set, e.g. 6, 0.0001 and 10000.
+EXTENT_PRECISION = None
+EXTENT_SIMPLIFY_TOLERANCE = 0
+EXTENT_MAX_VERTICES = None
+
+# Optional local mirror of the LC Map community (LC_MAP_ID) at COMMUNITY_MIRROR_PATH, finding items by identifier
+# without searching ScienceBase (None disables it). It is loaded in the background on first use and again every
+# COMMUNITY_MIRROR_RELOAD seconds, and refreshed with the items updated since when it is more than
+# COMMUNITY_MIRROR_REFRESH seconds old. Items deleted or moved out of the community by other tools stay in it
+# until the next load, so the items it finds are fetched with the caller's credentials and checked, and when it
+# finds none ScienceBase is searched. Lookups go to ScienceBase until it is loaded, or if it has not been
+# refreshed for COMMUNITY_MIRROR_MAX_AGE seconds.
+COMMUNITY_MIRROR_PATH = None
+COMMUNITY_MIRROR_REFRESH = 60
+COMMUNITY_MIRROR_RELOAD = 24 * 3600
+COMMUNITY_MIRROR_MAX_AGE = 600
+
+# Processes sharing the community mirror (e.g. gunicorn workers) take turns loading and refreshing it through a
+# lease in its database. The lease is renewed after each page of items, and is taken over by another process if
+# it is not renewed for COMMUNITY_MIRROR_LEASE seconds.
+COMMUNITY_MIRROR_LEASE = 300
@@ -0,0 +1,427 @@
+""" geometry.py reduces the GeoJSON extent features md-publisher copies from mdJSON into sbJSON: coordinates are
+rounded to a fixed precision, lines and polygon rings are simplified with Douglas-Peucker within a tolerance and
+a vertex budget, restoring positions until no ring crosses itself or another and every hole stays in its shell,
+and each feature is given its bounding box. Coordinate arrays are processed with numpy when it
+is installed, and in pure Python otherwise. """
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Nesting depth of the position lists in the coordinates of each geometry type: 0 is a position, 1 a list of
+# positions (a line or polygon ring), 2 a list of lines or rings, and 3 a list of polygons
+POSITION_DEPTH = {'Point': 0, 'MultiPoint': 1, 'LineString': 1, 'MultiLineString': 2, 'Polygon': 2, 'MultiPolygon': 3}
+
+# Geometry types whose position lists are lines or rings, which can be simplified
+LINE_TYPES = {'LineString': False, 'MultiLineString': False, 'Polygon': True, 'MultiPolygon': True}
+
+# Segments of more positions than this are measured with numpy, when it is installed
+VECTOR_MIN_POSITIONS = 64
+
+def reduce_features(features, tolerance=0, precision=None, max_vertices=None):
+    """Reduce GeoJSON features, without modifying them
+    :param features: GeoJSON features
+    :param tolerance: Douglas-Peucker tolerance, in coordinate units (degrees), or 0 to keep every vertex
+    :param precision: Decimal places coordinates are rounded to, or None to keep full precision
+    :param max_vertices: Most positions kept in the lines or rings of a feature, or None for no limit. Each
+    line keeps at least its end points, and each ring at least four positions, so parts and holes are never
+    dropped. Positions restored to keep polygons valid can take a feature over the limit.
+    :return: Reduced features, and the number of positions before and after
+    """
+    ret = []
+    before = 0
+    after = 0
+    for feature in features:
+        geometry = feature.get('geometry')
+        if not geometry or geometry.get('type') not in POSITION_DEPTH or 'coordinates' not in geometry:
+            ret.append(feature)
+            continue
+        depth = POSITION_DEPTH[geometry['type']]
+        lines = list(iter_position_lists(geometry['coordinates'], depth))
+        before += sum(len(line) for line in lines)
+        if geometry['type'] in LINE_TYPES:
+            polygons = None
+            if geometry['type'] == 'Polygon':
+                polygons = [len(geometry['coordinates'])]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = [len(polygon) for polygon in geometry['coordinates']]
+            lines = simplify_lines(lines, LINE_TYPES[geometry['type']], tolerance, precision, max_vertices, polygons)
+        else:
+            lines = [[round_position(p, precision) for p in line] for line in lines]
+        after += sum(len(line) for line in lines)
+        feature = dict(feature)
+        feature['geometry'] = dict(geometry, coordinates=rebuild_coordinates(geometry['coordinates'], depth, iter(lines)))
+        # The bounding box is of the original positions, which simplification may have cut inside
+        box = get_bbox(geometry['coordinates'], depth)
+        if box:
+            feature['bbox'] = round_bbox(box, precision)
+        ret.append(feature)
+    return ret, before, after
+
+def iter_position_lists(coordinates, depth):
+    """Yield the lists of positions in GeoJSON coordinates (a point is yielded as a list of one position)
+    :param coordinates: GeoJSON coordinates
+    :param depth: Nesting depth of the position lists (POSITION_DEPTH)
+    """
+    if depth == 0:
+        yield [coordinates]
+    elif depth == 1:
+        yield coordinates
+    else:
+        for part in coordinates:
+            yield from iter_position_lists(part, depth - 1)
+
+def rebuild_coordinates(coordinates, depth, lines):
+    """Rebuild GeoJSON coordinates with the same nesting, from replacement position lists
+    :param coordinates: Original GeoJSON coordinates
+    :param depth: Nesting depth of the position lists (POSITION_DEPTH)
+    :param lines: Iterator of the replacement position lists, in iter_position_lists order
+    :return: GeoJSON coordinates
+    """
+    if depth == 0:
+        return next(lines)[0]
+    if depth == 1:
+        return next(lines)
+    return [rebuild_coordinates(part, depth - 1, lines) for part in coordinates]
+
+def round_position(position, precision):
+    """Round a position's coordinates to a number of decimal places (None keeps full precision)"""
+    if precision is None:
+        return list(position)
+    return [round(v, precision) for v in position]
+
+def round_bbox(box, precision):
+    """Round a bounding box outwards to a number of decimal places, so it still contains every position
+    :param box: [west, south, east, north]
+    :param precision: Decimal places to round to, or None to keep full precision
+    :return: Rounded bounding box
+    """
+    if precision is None:
+        return list(box)
+    step = 10 ** -precision
+    west, south, east, north = [round(v, precision) for v in box]
+    # round() gives the nearest value, which is within half a step, so one step moves it past the edge
+    if west > box[0]:
+        west = round(west - step, precision)
+    if south > box[1]:
+        south = round(south - step, precision)
+    if east < box[2]:
+        east = round(east + step, precision)
+    if north < box[3]:
+        north = round(north + step, precision)
+    return [west, south, east, north]
+
+def simplify_lines(lines, closed, tolerance, precision, max_vertices, polygons=None):
+    """Round and simplify the lines or rings of a geometry. Rings keep the positions needed for them not to
+    cross (restore_valid_rings).
+    :param lines: Lists of positions
+    :param closed: Whether the lists are polygon rings
+    :param tolerance: Douglas-Peucker tolerance, or 0 to keep every vertex
+    :param precision: Decimal places to round to, or None
+    :param max_vertices: Most positions kept across all the lists, or None for no limit
+    :param polygons: Number of rings of each polygon, when the lists are rings; each polygon's shell comes first
+    :return: Lists of positions kept
+    """
+    kept = []
+    weights = []
+    points = []
+    for line in lines:
+        xs, ys = get_xy(line, precision)
+        keep = get_distinct(xs, ys)
+        # Rings reduced to fewer than four distinct-neighbour positions by rounding are left as they are
+        if len(keep) < (4 if closed else 2):
+            keep = list(range(len(line)))
+        kept.append(keep)
+        if closed:
+            points.append([(float(xs[i]), float(ys[i])) for i in keep])
+        if tolerance > 0 or max_vertices is not None:
+            weights.append(get_weights(xs, ys, keep, closed, tolerance))
+        else:
+            weights.append([math.inf] * len(keep))
+    threshold = tolerance
+    if max_vertices is not None:
+        finite = sorted((w for line_weights in weights for w in line_weights if w != math.inf), reverse=True)
+        required = sum(len(line_weights) for line_weights in weights) - len(finite)
+        allowed = max(max_vertices - required, 0)
+        if allowed < len(finite):
+            threshold = max(threshold, finite[allowed])
+    selected = [[threshold <= 0 or w > threshold or w == math.inf for w in line_weights] for line_weights in weights]
+    if closed and threshold > 0:
+        restore_valid_rings(points, weights, selected, polygons or [len(lines)])
+    ret = []
+    for line, keep, line_selected in zip(lines, kept, selected):
+        ret.append([round_position(line[i], precision) for i, s in zip(keep, line_selected) if s])
+    return ret
+
+def restore_valid_rings(points, weights, selected, polygons):
+    """Restore positions simplification dropped from polygon rings until no two ring segments cross and each
+    hole is inside its shell. Under each crossing segment, the dropped position weighing most is restored; for a
+    hole outside its shell, the shell's. Crossings the rings had before simplification (or that rounding made)
+    cannot be undone, and are left.
+    :param points: (x, y) of the positions of each ring that simplification chose from
+    :param weights: Weights of those positions (get_weights)
+    :param selected: Whether each position is kept, updated in place
+    :param polygons: Number of rings of each polygon, shell first
+    """
+    changed = None
+    while True:
+        # Segments that crossed and were left as they were cannot be fixed, so only the segments that restoring
+        # positions made are checked again
+        restored = []
+        for ring, start, end in get_crossing_segments(points, selected, changed):
+            if restore_heaviest(weights[ring], selected[ring], start, end):
+                restored.append((ring, start, end))
+        if not restored:
+            first = 0
+            for count in polygons:
+                shell = [p for p, s in zip(points[first], selected[first]) if s]
+                for hole in range(first + 1, first + count):
+                    if points[hole] and not is_inside(points[hole][0], shell):
+                        end = len(selected[first]) - 1
+                        if restore_heaviest(weights[first], selected[first], 0, end):
+                            restored.append((first, 0, end))
+                        break
+                first += count
+        if not restored:
+            return
+        changed = restored
+
+def restore_heaviest(weights, selected, start, end):
+    """Restore the dropped position weighing most between two kept positions
+    :param weights: Weights of the positions of a ring
+    :param selected: Whether each position is kept, updated in place
+    :param start: Index of the first kept position
+    :param end: Index of the last kept position
+    :return: True if a position was restored
+    """
+    dropped = [i for i in range(start + 1, end) if not selected[i]]
+    if not dropped:
+        return False
+    selected[max(dropped, key=lambda i: weights[i])] = True
+    return True
+
+def get_segments(selected, ring, start, end):
+    """Get the segments joining the kept positions of a ring between two positions
+    :return: List of (ring, index of the first position, index of the last position)
+    """
+    indexes = [i for i in range(start, end + 1) if selected[i]]
+    return [(ring, first, last) for first, last in zip(indexes, indexes[1:])]
+
+def get_crossing_segments(points, selected, changed=None):
+    """Find the segments of the kept positions of rings that cross another segment, using a grid of cells about
+    as long as the average segment
+    :param points: (x, y) of the positions of each ring
+    :param selected: Whether each position is kept
+    :param changed: (ring, first, last) of the spans of the rings whose segments changed since they were last
+    checked, or None to check every segment
+    :return: Set of (ring, index of the first position, index of the last position) of each crossing segment
+    """
+    segments = []
+    for ring, ring_selected in enumerate(selected):
+        segments.extend(get_segments(ring_selected, ring, 0, len(ring_selected) - 1))
+    if changed is None:
+        checked = segments
+    else:
+        checked = [segment for ring, start, end in changed for segment in get_segments(selected[ring], ring, start, end)]
+    ret = set()
+    if not checked:
+        return ret
+    west = min(x for ring_points in points for x, _ in ring_points)
+    south = min(y for ring_points in points for _, y in ring_points)
+    lengths = [max(abs(points[ring][last][0] - points[ring][first][0]), abs(points[ring][last][1] - points[ring][first][1]))
+               for ring, first, last in segments]
+    size = sum(lengths) / len(lengths) or 1.0
+
+    def get_cells(segment):
+        # The cells of each column the segment passes through
+        (x1, y1), (x2, y2) = sorted((points[segment[0]][segment[1]], points[segment[0]][segment[2]]))
+        slope = (y2 - y1) / (x2 - x1) if x2 != x1 else None
+        for i in range(int((x1 - west) / size), int((x2 - west) / size) + 1):
+            if slope is None:
+                ya, yb = y1, y2
+            else:
+                ya = y1 + (max(x1, west + i * size) - x1) * slope
+                yb = y1 + (min(x2, west + (i + 1) * size) - x1) * slope
+            for j in range(int((min(ya, yb) - south) / size), int((max(ya, yb) - south) / size) + 1):
+                yield i, j
+
+    grid = {}
+    for segment in segments:
+        for cell in get_cells(segment):
+            grid.setdefault(cell, []).append(segment)
+    for segment in checked:
+        a, b = points[segment[0]][segment[1]], points[segment[0]][segment[2]]
+        for cell in get_cells(segment):
+            for other in grid[cell]:
+                if is_crossing(a, b, points[other[0]][other[1]], points[other[0]][other[2]]):
+                    ret.add(segment)
+                    ret.add(other)
+    return ret
+
+def is_crossing(a, b, c, d):
+    """Return whether segment ab crosses segment cd at a point inside both (segments that only touch, such as
+    the adjacent segments of a ring, do not cross)"""
+    def orientation(p, q, r):
+        return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    return orientation(c, d, a) * orientation(c, d, b) < 0 and orientation(a, b, c) * orientation(a, b, d) < 0
+
+def is_inside(point, ring):
+    """Return whether a point is inside a ring, by ray casting
+    :param point: (x, y)
+    :param ring: (x, y) of the ring's positions, the last repeating the first
+    """
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+def get_xy(line, precision):
+    """Get the x and y coordinates of a list of positions, rounded to a number of decimal places
+    :return: Sequences of x and y
+    """
+    # Rounded with round() rather than numpy.round, which differs on values close to halfway, so the
+    # positions kept, and so the published item, do not depend on whether numpy is installed
+    if precision is None:
+        xs = [p[0] for p in line]
+        ys = [p[1] for p in line]
+    else:
+        xs = [round(p[0], precision) for p in line]
+        ys = [round(p[1], precision) for p in line]
+    if numpy is not None:
+        return numpy.array(xs, dtype=float), numpy.array(ys, dtype=float)
+    return xs, ys
+
+def get_distinct(xs, ys):
+    """Get the indexes of the positions that differ from the position before them"""
+    if numpy is not None:
+        if len(xs) == 0:
+            return []
+        distinct = numpy.ones(len(xs), dtype=bool)
+        distinct[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
+        return numpy.flatnonzero(distinct).tolist()
+    return [i for i in range(len(xs)) if i == 0 or xs[i] != xs[i - 1] or ys[i] != ys[i - 1]]
+
+def get_weights(xs, ys, keep, closed, floor=0):
+    """Get the Douglas-Peucker weight of each position: the largest tolerance at which it is kept. Keeping the
+    positions weighing more than a tolerance gives the Douglas-Peucker simplification at that tolerance, so one
+    pass serves both the tolerance and the vertex budget.
+    :param xs: x coordinates
+    :param ys: y coordinates
+    :param keep: Indexes of the positions to weigh
+    :param closed: Whether the positions are a polygon ring, whose first, last and farthest positions are kept
+    :param floor: Weights at or below floor are not needed, and are returned as 0
+    :return: Weights, in the order of keep; positions that are always kept weigh math.inf
+    """
+    n = len(keep)
+    weights = [math.inf] * n
+    if n <= 2 or (closed and n <= 4):
+        return weights
+    if numpy is not None:
+        xa = numpy.asarray(xs)[keep]
+        ya = numpy.asarray(ys)[keep]
+        xl = xa.tolist()
+        yl = ya.tolist()
+    else:
+        xl = [xs[i] for i in keep]
+        yl = [ys[i] for i in keep]
+
+    def farthest(first, last, from_point=False):
+        # numpy calls cost more than a short loop, so short segments are measured in Python
+        if numpy is not None and last - first > VECTOR_MIN_POSITIONS:
+            return get_farthest_vector(xa, ya, first, last, from_point)
+        return get_farthest(xl, yl, first, last, from_point)
+
+    stack = []
+    if closed:
+        # A ring starts and ends at the same position; split it at the position farthest from its start, and
+        # keep the position farthest from the chord of either half too, as a ring needs four positions
+        far, _ = farthest(0, n - 1, True)
+        weights[far] = math.inf
+        halves = [(0, far), (far, n - 1)]
+        candidates = [farthest(first, last) + (first, last) for first, last in halves if last - first >= 2]
+        i, _, first, last = max(candidates, key=lambda c: c[1])
+        weights[i] = math.inf
+        for half in halves:
+            if half == (first, last):
+                stack.append((first, i, math.inf))
+                stack.append((i, last, math.inf))
+            else:
+                stack.append(half + (math.inf,))
+    else:
+        stack.append((0, n - 1, math.inf))
+    while stack:
+        first, last, limit = stack.pop()
+        if last - first < 2:
+            continue
+        i, distance = farthest(first, last)
+        if distance <= floor:
+            for j in range(first + 1, last):
+                weights[j] = 0
+            continue
+        # A position never weighs more than the one whose selection split its segment
+        weight = min(distance, limit)
+        weights[i] = weight
+        stack.append((first, i, weight))
+        stack.append((i, last, weight))
+    return weights
+
+def get_farthest(xs, ys, first, last, from_point=False):
+    """Find the position between first and last farthest from the segment joining them
+    :param xs: x coordinates
+    :param ys: y coordinates
+    :param first: Index of the first position of the segment
+    :param last: Index of the last position of the segment
+    :param from_point: Measure the distance from the first position rather than from the segment
+    :return: Index of the farthest position, and its distance
+    """
+    x1, y1 = xs[first], ys[first]
+    dx = xs[last] - x1
+    dy = ys[last] - y1
+    length = math.hypot(dx, dy)
+    best = first + 1
+    best_distance = -1.0
+    for i in range(first + 1, last):
+        px = xs[i] - x1
+        py = ys[i] - y1
+        if from_point or length == 0:
+            distance = math.hypot(px, py)
+        else:
+            distance = abs(px * dy - py * dx) / length
+        if distance > best_distance:
+            best = i
+            best_distance = distance
+    return best, best_distance
+
+def get_farthest_vector(xs, ys, first, last, from_point=False):
+    """get_farthest over numpy arrays"""
+    x1, y1 = float(xs[first]), float(ys[first])
+    dx = float(xs[last]) - x1
+    dy = float(ys[last]) - y1
+    length = math.hypot(dx, dy)
+    px = xs[first + 1:last] - x1
+    py = ys[first + 1:last] - y1
+    if from_point or length == 0:
+        distances = numpy.hypot(px, py)
+    else:
+        distances = numpy.abs(px * dy - py * dx) / length
+    i = int(numpy.argmax(distances))
+    return first + 1 + i, float(distances[i])
+
+def get_bbox(coordinates, depth):
+    """Get the GeoJSON bounding box of coordinates
+    :param coordinates: GeoJSON coordinates
+    :param depth: Nesting depth of the position lists (POSITION_DEPTH)
+    :return: [west, south, east, north], or None if there are no positions
+    """
+    xs = []
+    ys = []
+    for line in iter_position_lists(coordinates, depth):
+        xs.extend(p[0] for p in line)
+        ys.extend(p[1] for p in line)
+    if not xs:
+        return None
+    return [min(xs), min(ys), max(xs), max(ys)]
@@ -0,0 +1,123 @@
+""" jobs.py provides the persistent store of the publishes and deletes md-publisher runs as background jobs """
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+class JobStore(object):
+    """Jobs stored in a SQLite database, so any process (e.g. gunicorn worker) on the same host can report
+    on a job started by another, and finished jobs survive restarts. A job is run by the process that
+    created it; jobs left queued or running by a process that has exited are reported as failed.
+    """
+
+    def __init__(self, path, retention, timeout=5.0):
+        """
+        :param path: Path of the SQLite database file
+        :param retention: Seconds to keep finished jobs
+        :param timeout: Seconds to wait on a database locked by another process
+        """
+        self.path = path
+        self.retention = retention
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        """Get the SQLite connection for the current thread, creating the jobs table if needed"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, '
+                         'host TEXT NOT NULL, pid INTEGER NOT NULL, created REAL NOT NULL, started REAL, finished REAL, '
+                         'progress TEXT, status_code INTEGER, result TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)')
+            self._local.conn = conn
+        return conn
+
+    def create(self, kind):
+        """Create a queued job, and delete finished jobs older than the retention period
+        :param kind: Kind of job, e.g. the endpoint that created it
+        :return: Job JSON
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        conn.execute('INSERT INTO jobs (id, kind, status, host, pid, created) VALUES (?, ?, ?, ?, ?, ?)',
+                     (job_id, kind, QUEUED, socket.gethostname(), os.getpid(), now))
+        conn.execute('DELETE FROM jobs WHERE finished < ?', (now - self.retention,))
+        return self.get(job_id)
+
+    def start(self, job_id):
+        """Mark a job as running
+        :param job_id: Job ID
+        """
+        self._update(job_id, 'status = ?, started = ?', (RUNNING, time.time()))
+
+    def update_progress(self, job_id, progress):
+        """Record the progress of a running job
+        :param job_id: Job ID
+        :param progress: Progress JSON
+        """
+        self._update(job_id, 'progress = ?', (json.dumps(progress),))
+
+    def finish(self, job_id, status_code, result):
+        """Record the result of a job
+        :param job_id: Job ID
+        :param status_code: HTTP status code the request would have returned
+        :param result: Response JSON the request would have returned
+        """
+        self._update(job_id, 'status = ?, finished = ?, status_code = ?, result = ?',
+                     (SUCCEEDED if status_code == 200 else FAILED, time.time(), status_code, json.dumps(result)))
+
+    def _update(self, job_id, assignments, values):
+        # Progress and results are best effort; a store error must not fail the job itself
+        try:
+            self._connection().execute('UPDATE jobs SET %s WHERE id = ?' % assignments, values + (job_id,))
+        except sqlite3.Error as e:
+            logger.warning('Job store update failed: %s' % e)
+
+    def get(self, job_id):
+        """Get a job
+        :param job_id: Job ID
+        :return: Job JSON, or None if there is no such job
+        """
+        row = self._connection().execute('SELECT id, kind, status, host, pid, created, started, finished, progress, '
+                                         'status_code, result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, host, pid, created, started, finished, progress, status_code, result = row
+        if status in (QUEUED, RUNNING) and host == socket.gethostname() and not is_running(pid):
+            result = {"error": {"messages": ["Job interrupted: the worker running it exited"]}}
+            self.finish(job_id, 500, result)
+            return self.get(job_id)
+        ret = {'id': job_id, 'kind': kind, 'status': status, 'created': created, 'started': started,
+               'finished': finished, 'progress': json.loads(progress) if progress else {}}
+        if finished is not None:
+            ret['status_code'] = status_code
+            ret['result'] = json.loads(result)
+        return ret
+
+def is_running(pid):
+    """Return whether a process is running on this host
+    :param pid: Process ID
+    :return: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,71 @@
+""" jsoncodec.py serializes and parses the JSON md-publisher exchanges with the mdTranslator, ScienceBase and
+its clients, using orjson when it is installed and the standard library json module otherwise """
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ['orjson', 'json']
+
+_backend = 'orjson' if orjson is not None else 'json'
+
+def set_backend(name):
+    """Choose the JSON backend
+    :param name: 'orjson', 'json', or 'auto' for orjson when it is installed
+    :return: Name of the backend in use
+    """
+    global _backend
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in BACKENDS:
+        raise ValueError('Unknown JSON backend %s' % name)
+    if name == 'orjson' and orjson is None:
+        raise ValueError('orjson is not installed')
+    _backend = name
+    return _backend
+
+def get_backend():
+    """:return: Name of the backend in use"""
+    return _backend
+
+def dumpb(obj, sort_keys=False):
+    """Serialize to compact UTF-8 JSON
+    :param obj: JSON-serializable object
+    :param sort_keys: Whether to sort object keys
+    :return: JSON bytes
+    """
+    if _backend == 'orjson':
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+        except TypeError:
+            # Integers beyond 64 bits, and types orjson does not know, are left to the json module
+            pass
+    return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def dumps(obj, sort_keys=False):
+    """Serialize to compact JSON
+    :param obj: JSON-serializable object
+    :param sort_keys: Whether to sort object keys
+    :return: JSON string
+    """
+    return dumpb(obj, sort_keys).decode('utf-8')
+
+def canonical_dumps(obj):
+    """Serialize to canonical JSON (sorted keys, no insignificant whitespace) with the standard library json
+    module whatever the backend, since orjson writes some floats (1e-07, 1e+16) and NaN differently and
+    canonical JSON is hashed into identifiers and cache keys
+    :param obj: JSON-serializable object
+    :return: JSON string
+    """
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def loads(data):
+    """Parse JSON
+    :param data: JSON str or bytes
+    :return: Parsed object
+    """
+    if _backend == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,19 +1,36 @@
 """ md-publisher.py is a flask application providing services to update ScienceBase items via mdJSON """
 from flask_selfdoc import Autodoc
-from flask import Flask, jsonify, abort, make_response, request, logging
+from flask import Flask, jsonify, abort, make_response, request, logging, Response, stream_with_context, has_request_context, copy_current_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from sciencebasepy import SbSession
 from dateutil import parser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import ast
-import json
+import contextlib
+import contextvars
+import copy
 import os
+import random
 import requests
+import requests.adapters
 import re
 import sys
+import threading
+import time
 import traceback
 import logging
 import bson
 import certifi
+import geometry
+import hashlib
+import jobs
+import jsoncodec
+import metrics
+import mirror
+import sbjson
+from urllib3.util import Retry
+from cache import LRUCache, TTLCache, DiskCache, TieredCache
 
 VERSION = '1.5.0'
 app = Flask(__name__)
@@ -24,6 +41,25 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 MD_PUBLISHER_ROOT = os.environ['MD_PUBLISHER_ROOT'] if 'MD_PUBLISHER_ROOT' in os.environ else '.'
 app.config.from_pyfile(MD_PUBLISHER_ROOT + '/config/config.py')
 
+class JsonCodecProvider(DefaultJSONProvider):
+    """Flask JSON provider (jsonify, request.get_json) using jsoncodec. Pretty printed responses and
+    types only the json module handles go through Flask's default provider."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent') is None:
+            try:
+                return jsoncodec.dumps(obj)
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return jsoncodec.loads(s)
+
+jsoncodec.set_backend(app.config['JSON_CODEC'])
+metrics.set_store(app.config['METRICS_STORE_PATH'], app.config['METRICS_FLUSH_INTERVAL'])
+app.json = JsonCodecProvider(app)
+
 ISO_19115_1 = 'iso19115_1'
 ISO_19115_2 = 'iso19115_2'
 MDJSON = 'mdJson'
@@ -33,6 +69,22 @@ COPY_SBID = 'sciencebase-production-id'
 LCC_SBID = 'gov.sciencebase.catalog'
 LCC_SBID2 = 'gov.sciencbase.catalog'
 
+# Identifier holding the hash of the mdJSON last published to an item. When a metadata file could not be
+# generated from the mdJSON, INCOMPLETE_MDJSON_HASH is recorded instead, so the next publish is not skipped
+# as unchanged.
+MDJSON_HASH_ID = 'md-publisher-mdjson-sha256'
+INCOMPLETE_MDJSON_HASH = 'incomplete'
+
+# Identifiers holding the hashes of the metadata files last published to an item (keyed "<file name>:<hash>"),
+# so updates only upload files that changed. Items published by earlier versions also hold an item JSON hash.
+FILE_HASH_ID = 'md-publisher-file-sha256'
+ITEM_HASH_ID = 'md-publisher-item-sha256'
+
+# Item JSON keys that ScienceBase sets or manages, left out when comparing the item to send with the item on
+# ScienceBase
+ITEM_SERVER_KEYS = ['id', 'link', 'provenance', 'files', 'distributionLinks', 'ancestors', 'relatedItems',
+                    'hasChildren', 'permissions', 'previewImage']
+
 LCC_IDENTIFIERS = [COPY_SBID, LCC_SBID, LCC_SBID2]
 SB_IDENTIFIERS = [LCC_SBID, LCC_SBID2]
 
@@ -41,13 +93,62 @@ PRODUCT_RESOURCE_TYPE = 'product'
 RESOURCE_TYPES = [PROJECT_RESOURCE_TYPE, PRODUCT_RESOURCE_TYPE]
 
 _sb_session = None
+
+# Pool of authenticated ScienceBase sessions, keyed by token fingerprint
+_sb_session_pool = None
+
 _session = None
+_session_lock = threading.Lock()
+
+# Cache of translator results, keyed by a hash of the canonical source JSON and translator options
+_translation_cache = None
+
+# Cache of identifier search results (including empty ones), keyed by (token fingerprint, id_type, id_key, community_id)
+_identifier_cache = None
+# Number of identifier cache invalidations, so that searches started before one do not cache their results
+_identifier_generation = 0
+_identifier_lock = threading.Lock()
+
+# Cache of item ancestor IDs, keyed by (token fingerprint, item ID), used to check whether items are in a community
+_ancestor_cache = None
+
+# Index of item ID to the (itemId, relatedItemId, itemLinkTypeId) keys of its ItemLinks
+_link_cache = None
+
+# Bounded executor for concurrent translator requests
+_translator_executor = None
 
 # Dict of ItemLink type IDs -- used when creating relationships
 _item_link_types = None
 
+# Store and worker pool of publishes and deletes run as background jobs
+_job_store = None
+_job_executor = None
+
+# Local mirror of the LC Map community, and the lock held while this process is loading or refreshing it. Processes
+# sharing the mirror take turns through a lease in its database.
+_community_mirror = None
+_community_mirror_lock = threading.Lock()
+_community_mirror_attempted = 0
+
+# Items fetched during the current publish, by get_sb_item
+item_memo = contextvars.ContextVar('item_memo', default=None)
+
+# Operation names of ScienceBase requests by URL fragment and HTTP method, for metrics
+SCIENCEBASE_OPERATIONS = [
+    ('/file/uploadAndUpsertItem', {'POST': 'upload_and_upsert_item'}),
+    ('/file/', {'GET': 'download_file'}),
+    ('/itemLink/', {'GET': 'get_item_links', 'POST': 'create_item_link'}),
+    ('/vocab/', {'GET': 'get_item_link_types'}),
+    ('/items', {'GET': 'find_items', 'DELETE': 'delete_items'}),
+    ('/item/', {'GET': 'get_item', 'PUT': 'update_item', 'POST': 'create_item', 'DELETE': 'delete_item'})
+]
+
 ITEM_FIELDS = "id,parentId,title,identifiers,facets,files,tags,extents,provenance,dates,contacts,ancestors"
 
+# Fields of an existing item needed to check that it is in the community and whether its mdJSON has changed
+CHECK_FIELDS = "identifiers,files,ancestors"
+
 with app.app_context():
     if not app.debug:
         # In production mode, add log handler to sys.stderr.
@@ -66,11 +167,32 @@ def version():
     """Returns the current service version"""
     return jsonify({'version': VERSION})
 
+@app.route('/metrics', methods=['GET'])
+@auto.doc()
+def get_metrics():
+    """Returns request and remote call counters and latency histograms in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_timing():
+    request.environ['md_publisher.start'] = time.perf_counter()
+    request.environ['md_publisher.timings'] = []
+
+@app.after_request
+def add_server_timing(response):
+    """Record the request metrics, and summarize its remote calls in a Server-Timing header"""
+    start = request.environ.get('md_publisher.start')
+    if start is not None:
+        seconds = time.perf_counter() - start
+        metrics.observe_request(request.endpoint or 'none', response.status_code, seconds)
+        response.headers['Server-Timing'] = metrics.server_timing(request.environ['md_publisher.timings'], seconds)
+    return response
+
 @app.route('/mdjson/<string:item_id>', methods=['GET', 'PUT'])
 @auto.doc()
 def get_md_json_for_sb_item(item_id):
     """Get mdJSON from ScienceBase for the given item_id. PUT will also replace the mdJSON file on the item."""
-    sb_json = get_sb_session(request).get_item(item_id)
+    sb_json = get_sb_item(get_sb_session(request), item_id)
     sb_json = fix_sbjson(sb_json)
 
     # First check if it has an mdjson file
@@ -92,43 +214,60 @@ def get_md_json_for_sb_item(item_id):
 @auto.doc()
 def replace_md_json():
     """Replace mdJSON on the associated ScienceBase item"""
-    return api_response(update_metadata_json(get_mdjson(request)))
+    return api_response_or_job(update_metadata_json, get_mdjson(request))
 
 @app.route('/project', methods=['POST'])
 @auto.doc()
 def create_project():
     """Create a project in ScienceBase from mdJSON."""
-    return api_response(create_or_update_item(get_mdjson(request)))
+    return api_response_or_job(create_or_update_item, get_mdjson(request))
 
 @app.route('/product', methods=['POST'])
 @auto.doc()
 def create_product():    
     """Create a product in ScienceBase from mdJSON"""
-    return api_response(create_or_update_item(get_mdjson(request)))
+    return api_response_or_job(create_or_update_item, get_mdjson(request))
 
 @app.route('/project/<string:item_id>', methods=['PUT'])
 @auto.doc()
 def update_project(item_id):
     """Update a project in ScienceBase from mdJSON"""
-    return api_response(create_or_update_item(get_mdjson(request), item_id))
+    return api_response_or_job(create_or_update_item, get_mdjson(request), item_id)
 
 @app.route('/product/<string:item_id>', methods=['PUT'])
 @auto.doc()
 def update_product(item_id):   
     """Update a product in ScienceBase from mdJSON""" 
-    return api_response(create_or_update_item(get_mdjson(request), item_id))
+    return api_response_or_job(create_or_update_item, get_mdjson(request), item_id)
+
+@app.route('/batch', methods=['POST'])
+@auto.doc()
+def batch_publish():
+    """Create or update many ScienceBase items from mdJSON. Accepts a JSON array of records or NDJSON
+    with one record per line, and streams back one NDJSON result per record as it finishes, followed by a summary."""
+    records = get_batch_records(request)
+    return Response(stream_with_context(publish_batch(records)), mimetype='application/x-ndjson')
 
 @app.route('/project/<string:item_id>', methods=['DELETE'])
 @auto.doc()
 def delete_project(item_id): 
     """Delete a project and its child items from ScienceBase"""
-    return api_response(delete_item(item_id, 'Project'))
+    return api_response_or_job(delete_item, item_id, 'Project')
 
 @app.route('/product/<string:item_id>', methods=['DELETE'])
 @auto.doc()
 def delete_product(item_id):        
     """Delete a project and its child items from ScienceBase"""
-    return api_response(delete_item(item_id))
+    return api_response_or_job(delete_item, item_id)
+
+@app.route('/jobs/<string:job_id>', methods=['GET'])
+@auto.doc()
+def get_job(job_id):
+    """Get the status, progress and, once finished, the result of a publish or delete run as a background job"""
+    job = get_job_store().get(job_id)
+    if job is None:
+        return make_response(jsonify({"error": {"messages": ["Job %s not found" % job_id]}}), 404)
+    return jsonify(job)
 
 @app.errorhandler(404)
 def not_found(error):
@@ -141,6 +280,17 @@ def internal_error(error):
 @app.errorhandler(Exception)
 def handle_exceptions(error):
     traceback.print_exc(file=sys.stdout)
+    status_code, errmsg = get_error_json(error)
+    response = jsonify(errmsg)   
+    response.status_code = status_code 
+
+    return response
+
+def get_error_json(error):
+    """Get the status code and error JSON to report for an exception
+    :param error: Exception
+    :return: Tuple of HTTP status code and error JSON
+    """
     status_code = None
     errmsg = u'{0}'.format(error).encode('ascii','ignore').decode('ascii')
 
@@ -148,65 +298,388 @@ def handle_exceptions(error):
     m = re.match(sciencebasepy_error_regex, errmsg)
     if m:
         status_code = int(m.group(1))
-        errmsg = json.loads(m.group(2))
+        errmsg = jsoncodec.loads(m.group(2))
     else:
         status_code = 400
         errmsg = {"error": {"messages":[errmsg]}}
 
-    response = jsonify(errmsg)   
-    response.status_code = status_code 
-
-    return response
+    return status_code, errmsg
 
 def get_mdjson(request):
     ret = {}
-    if request.json:
-        if 'data' in request.json:
-            ret = request.json['data']
+    request_json = request.get_json(silent=True)
+    if request_json:
+        if 'data' in request_json:
+            ret = request_json['data']
         else:
-            ret = request.json
+            ret = request_json
     return ret    
 
+def get_batch_records(request):
+    """Get the records posted to the batch endpoint
+    :param request: Flask request with a JSON array of records, or NDJSON with one record per line
+    :return: List of records
+    """
+    ret = get_mdjson(request)
+    if not isinstance(ret, list):
+        ret = [jsoncodec.loads(line) for line in request.get_data().splitlines() if line.strip()]
+    return ret
+
+def get_token_data(request):
+    """Get the request data that may hold ScienceBase tokens. For a batch, that is the first record.
+    :param request: Flask request
+    :return: Request data
+    """
+    ret = get_mdjson(request)
+    if isinstance(ret, list):
+        ret = ret[0] if ret else {}
+    elif not ret:
+        # NDJSON batch, only the first line is needed
+        body = request.get_data()
+        end = body.find(b'\n')
+        try:
+            ret = jsoncodec.loads(body[:end] if end >= 0 else body)
+        except ValueError:
+            ret = {}
+    if isinstance(ret, dict) and isinstance(ret.get('data'), dict):
+        ret = ret['data']
+    return ret if isinstance(ret, dict) else {}
+
 def get_sb_session(request):
-    """Get sciencebasepy session based on user credentials in 
+    """Get the sciencebasepy session for the user credentials in the request. Sessions are pooled by
+    token, so concurrent requests never share credentials.
     :param request: Flask request
     :return: sciencebasepy session
     """
-    global _sb_session
-    if _sb_session is None:
-        _sb_session = SbSession(app.config['SCIENCEBASE_ENV'])
+    return get_pooled_sb_session(get_request_token(request))
+
+def get_request_token(request):
+    """Get the ScienceBase tokens posted with a Flask request
+    :param request: Flask request
+    :return: Token dict, empty if no tokens were posted
+    """
+    token = {}
     if request and bool(request.data):
-        token = {}
-        request_data = get_mdjson(request)
+        token = get_token(get_token_data(request))
+    return token
+
+def get_token(request_data):
+    """Get the ScienceBase tokens posted with a request
+    :param request_data: Request data
+    :return: Token dict, empty if no tokens were posted
+    """
+    token = {}
+    if isinstance(request_data, dict):
         if 'access_token' in request_data:
             token['access_token'] = request_data['access_token']
         if 'refresh_token' in request_data:
             token['refresh_token'] = request_data['refresh_token']
-        if bool(token):
-            _sb_session.add_token(token)
-    return _sb_session
+    return token
+
+def get_token_fingerprint(token):
+    """Get the key by which sessions for a token are pooled, and lookups made with them are cached
+    :param token: Token dict
+    :return: Token fingerprint, or None for anonymous sessions
+    """
+    if not token:
+        return None
+    return hashlib.sha256(canonical_json(token).encode('utf-8')).hexdigest()
+
+def get_sb_session_pool():
+    """Get the pool of authenticated sciencebasepy sessions, keyed by token fingerprint. Sessions idle
+    for SB_SESSION_IDLE_TIMEOUT seconds expire, and the least recently used are evicted beyond SB_SESSION_POOL_SIZE.
+    :return: Session pool
+    """
+    global _sb_session_pool
+    if _sb_session_pool is None:
+        _sb_session_pool = TTLCache(app.config['SB_SESSION_POOL_SIZE'], app.config['SB_SESSION_IDLE_TIMEOUT'])
+    return _sb_session_pool
+
+def new_sb_session():
+    """Create a sciencebasepy session whose requests are recorded in the metrics
+    :return: sciencebasepy session
+    """
+    ret = SbSession(app.config['SCIENCEBASE_ENV'])
+    instrument_session(ret._session, get_sciencebase_operation)
+    return ret
+
+def get_pooled_sb_session(token):
+    """Get a sciencebasepy session authenticated with the given token, reusing a pooled session
+    (and its warm connections) if one exists
+    :param token: Token dict, empty for an anonymous session
+    :return: sciencebasepy session
+    """
+    global _sb_session
+    if not token:
+        if _sb_session is None:
+            _sb_session = new_sb_session()
+        return _sb_session
+
+    pool = get_sb_session_pool()
+    fingerprint = get_token_fingerprint(token)
+    ret = pool.get(fingerprint)
+    if ret is None:
+        ret = new_sb_session()
+        ret.add_token(token)
+    # Putting the session back restarts its idle timeout
+    pool.put(fingerprint, ret)
+    return ret
+
+def record_remote_call(operation, seconds, error=False, sent=0, received=0):
+    """Record a remote call against the endpoint of the current request
+    :param operation: Operation name
+    :param seconds: Latency of the call
+    :param error: Whether the call failed
+    :param sent: Bytes sent
+    :param received: Bytes received
+    """
+    if has_request_context():
+        endpoint, timings = request.endpoint or 'none', request.environ.get('md_publisher.timings')
+    else:
+        endpoint, timings = metrics.current_endpoint.get() or 'none', metrics.current_timings.get()
+    metrics.observe_remote_call(operation, endpoint, seconds, error, sent, received, timings)
+
+def instrument_session(session, get_operation):
+    """Record the metrics of every request made with a requests session
+    :param session: Requests session
+    :param get_operation: Function of (method, url, request kwargs) returning the operation name
+    :return: The session
+    """
+    send_request = session.request
+
+    def instrumented_request(method, url, *args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        received = 0
+        try:
+            response = send_request(method, url, *args, **kwargs)
+            error = response.status_code >= 400
+            received = int(response.headers.get('Content-Length') or 0)
+            return response
+        finally:
+            record_remote_call(get_operation(method, url, kwargs), time.perf_counter() - start, error, get_request_size(kwargs), received)
+
+    session.request = instrumented_request
+    return session
+
+def get_request_size(kwargs):
+    """Get the approximate number of body bytes sent by a request"""
+    ret = 0
+    data = kwargs.get('data')
+    for value in (data.values() if isinstance(data, dict) else [data]):
+        if isinstance(value, (str, bytes)):
+            ret += len(value)
+    for f in kwargs.get('files') or []:
+        if isinstance(f[1], tuple) and isinstance(f[1][1], (str, bytes)):
+            ret += len(f[1][1])
+    return ret
+
+def get_sciencebase_operation(method, url, kwargs=None):
+    """Get the operation name of a ScienceBase request, e.g. sciencebase.get_item
+    :param method: HTTP method
+    :param url: Request URL
+    :param kwargs: Request arguments
+    :return: Operation name
+    """
+    method = method.upper()
+    for pattern, operations in SCIENCEBASE_OPERATIONS:
+        if pattern in url:
+            return 'sciencebase.' + operations.get(method, method.lower())
+    return 'sciencebase.' + method.lower()
+
+def get_translator_operation(method, url, kwargs=None):
+    """Get the operation name of an mdTranslator request, e.g. mdtranslator.sbJson"""
+    data = (kwargs or {}).get('data')
+    return 'mdtranslator.%s' % (data.get('writer') if isinstance(data, dict) else 'translate')
 
 def get_session():
-    """Get requests session 
+    """Get the requests session used for the mdTranslator. The session is shared by all threads; its
+    connection pool holds TRANSLATOR_POOL_SIZE keep-alive connections, and failed connections and
+    TRANSLATOR_RETRY_STATUS responses are retried with jittered exponential backoff. Translation has no
+    side effects, so the translator POST is safe to retry.
     :return: Requests session
     """
     app.logger.debug('get_session')
     global _session
     if _session is None:
-        _session = requests.Session()
-        _session.headers.update({'Accept': 'application/json'})
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=app.config['TRANSLATOR_RETRIES'],
+                    status_forcelist=app.config['TRANSLATOR_RETRY_STATUS'],
+                    allowed_methods=None,
+                    backoff_factor=app.config['TRANSLATOR_RETRY_BACKOFF'],
+                    backoff_jitter=app.config['TRANSLATOR_RETRY_BACKOFF'],
+                    raise_on_status=False)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=app.config['TRANSLATOR_POOL_SIZE'], pool_block=True, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'Accept': 'application/json'})
+                _session = instrument_session(session, get_translator_operation)
     return _session
 
-def translate_json(source_json, destination_format = None): 
+def get_translator_timeout():
+    """Get the mdTranslator (connect, read) timeouts in seconds"""
+    return (app.config['TRANSLATOR_CONNECT_TIMEOUT'], app.config['TRANSLATOR_READ_TIMEOUT'])
+
+def get_translator_retry_delay(retry):
+    """Get the jittered exponential backoff before retrying an mdTranslator request, as used by get_session
+    :param retry: Number of the retry, starting at 1
+    :return: Seconds to wait
+    """
+    backoff = app.config['TRANSLATOR_RETRY_BACKOFF']
+    return backoff * (2 ** (retry - 1)) + random.uniform(0, backoff)
+
+def get_translation_cache():
+    """Get the translation cache. The in-process tier is private to this worker, the on-disk
+    tier (if TRANSLATION_CACHE_PATH is set) is shared by all workers on the host.
+    :return: Translation cache
+    """
+    global _translation_cache
+    if _translation_cache is None:
+        disk = None
+        if app.config['TRANSLATION_CACHE_PATH']:
+            disk = DiskCache(app.config['TRANSLATION_CACHE_PATH'], app.config['TRANSLATION_CACHE_MAX_BYTES'])
+        _translation_cache = TieredCache(LRUCache(app.config['TRANSLATION_CACHE_SIZE']), disk)
+    return _translation_cache
+
+def canonical_json(source_json):
+    """Serialize JSON canonically (sorted keys, no insignificant whitespace), so that equal documents
+    serialize, and hash, identically with either JSON backend
+    :param source_json: JSON to serialize
+    :return: Canonical JSON string
+    """
+    return jsoncodec.canonical_dumps(source_json)
+
+def get_translation_cache_key(options):
+    """Get the translation cache key for the given translator options, which include the source JSON
+    :param options: Translator options
+    :return: Cache key
+    """
+    key = hashlib.sha256()
+    for option in ['reader', 'writer', 'validate', 'format']:
+        key.update(('%s=%s\n' % (option, options[option])).encode('utf-8'))
+    key.update(options['file'].encode('utf-8'))
+    return key.hexdigest()
+
+def translate_json(source_json, destination_format = None, source_text = None): 
     """Translate between sbJSON and mdJSON through the 
     :param source_json: Source JSON
     :param destination_format: Destination format (defaults to mdJSON)
+    :param source_text: canonical_json of the source JSON, if the caller has serialized it
     :return Translated JSON, or an error message
     """  
     app.logger.debug('translate_json') 
 
     ret = None
 
+    # cert_file_path = "/etc/httpd/conf/ssl.crt/star_sciencebase_gov.crt"
+    # key_file_path = "/etc/httpd/conf/ssl.key/star_sciencebase_gov.key"
+    # root_cert = '/etc/httpd/conf/ssl.crt/DigiCertCA.crt'
+    # cert = (cert_file_path, key_file_path)
+
+    options, cache_key, cached = get_cached_translation(source_json, destination_format, source_text)
+    if cached is not None:
+        return cached
+
+    try:
+        r = get_session().post(app.config['MDTRANSLATOR_URL'], data=options, timeout=get_translator_timeout())
+    except requests.RequestException as e:
+        return {'error': {'messages': ['mdTranslator request failed: %s' % e]}}
+    ret = read_translator_response(r.status_code, r.text, options['writer'])
+    cache_translation(cache_key, ret)
+    return ret
+
+def get_cached_translation(source_json, destination_format = None, source_text = None):
+    """Get the translator options for the given JSON, and any earlier result of the same translation.
+    Identical source JSON and options always translate the same way.
+    :param source_json: Source JSON
+    :param destination_format: Destination format
+    :param source_text: canonical_json of the source JSON, or None to serialize it
+    :return: Tuple of translator options, translation cache key, and cached translated JSON or None
+    """
+    options = get_translator_options(source_json, destination_format, source_text)
+    cache_key = get_translation_cache_key(options)
+    cached = get_translation_cache().get(cache_key)
+    if cached is not None:
+        app.logger.debug('translate_json cache hit %s' % cache_key)
+        cached = jsoncodec.loads(cached)
+    return options, cache_key, cached
+
+def cache_translation(cache_key, ret):
+    """Cache a translation. Only successful translations are cached, so translator errors are retried
+    on the next publish.
+    :param cache_key: Translation cache key
+    :param ret: Translated JSON, or an error message
+    """
+    if ret and not (isinstance(ret, dict) and 'error' in ret):
+        get_translation_cache().put(cache_key, jsoncodec.dumps(ret))
+
+def translate_mdjson_to_sbjson(md_json, md_text = None):
+    """Translate mdJSON to sbJSON. Depending on SBJSON_TRANSLATOR, this uses the mdTranslator ('remote'),
+    the in-process translator in sbjson.py with the mdTranslator as fallback for mdJSON it does not cover
+    ('native'), or both, logging any differences and returning the mdTranslator result ('conformance').
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON, if the caller has serialized it
+    :return: sbJSON, or an error message
+    """
+    app.logger.debug('translate_mdjson_to_sbjson')
+    native = translate_natively(md_json)
+    remote = translate_json(md_json, None, md_text) if needs_remote_sbjson(native) else None
+    return choose_sbjson(md_json, native, remote)
+
+def translate_natively(md_json):
+    """Translate mdJSON to sbJSON in-process, if SBJSON_TRANSLATOR allows and sbjson.py covers the mdJSON
+    :param md_json: mdJSON
+    :return: sbJSON, or None
+    """
+    if app.config['SBJSON_TRANSLATOR'] == 'remote':
+        return None
+    try:
+        return sbjson.translate(md_json)
+    except sbjson.UnsupportedMdJson as e:
+        app.logger.debug('Using mdTranslator: %s' % e)
+        return None
+
+def needs_remote_sbjson(native):
+    """Return whether the mdTranslator sbJSON translation is needed
+    :param native: sbJSON translated in-process, or None
+    """
+    return native is None or app.config['SBJSON_TRANSLATOR'] == 'conformance'
+
+def choose_sbjson(md_json, native, remote):
+    """Choose the sbJSON translation to publish, logging any differences in 'conformance' mode
+    :param md_json: mdJSON
+    :param native: sbJSON translated in-process, or None
+    :param remote: sbJSON translated by the mdTranslator (or an error message), or None if not needed
+    :return: sbJSON, or an error message
+    """
+    if remote is None:
+        return native
+    if native is not None and 'error' not in remote:
+        log_sbjson_differences(md_json, native, remote)
+    return remote
+
+def log_sbjson_differences(md_json, native, remote):
+    """Log differences between the in-process and mdTranslator sbJSON translations
+    :param md_json: mdJSON that was translated
+    :param native: sbJSON translated in-process
+    :param remote: sbJSON translated by the mdTranslator
+    :return: List of differences
+    """
+    ret = sbjson.diff(fix_sbjson(copy.deepcopy(native)), fix_sbjson(copy.deepcopy(remote)))
+    if ret:
+        app.logger.warning('sbJSON translations of %s differ: %s' % (native.get('title'), '; '.join(ret)))
+    return ret
+
+def get_translator_options(source_json, destination_format = None, source_text = None):
+    """Get the mdTranslator request options to translate the given JSON
+    :param source_json: Source JSON
+    :param destination_format: Destination format (defaults to sbJSON for mdJSON, otherwise mdJSON)
+    :param source_text: canonical_json of the source JSON, or None to serialize it
+    :return: mdTranslator options
+    """
     source_format = None
     if 'schema' in source_json and 'name' in source_json['schema'] and source_json['schema']['name'] == MDJSON:
         source_format = MDJSON
@@ -216,27 +689,29 @@ def translate_json(source_json, destination_format = None):
         source_format = SBJSON
         if destination_format is None:
             destination_format = MDJSON
-    options = {
+    return {
         u'writer': destination_format, 
         u'reader': source_format, 
         u'validate': u'none' if source_format == SBJSON else u'normal',
         u'format': u'json', 
-        u'file': json.dumps(source_json)
+        u'file': source_text if source_text is not None else canonical_json(source_json)
     }  
 
-    # cert_file_path = "/etc/httpd/conf/ssl.crt/star_sciencebase_gov.crt"
-    # key_file_path = "/etc/httpd/conf/ssl.key/star_sciencebase_gov.key"
-    # root_cert = '/etc/httpd/conf/ssl.crt/DigiCertCA.crt'
-    # cert = (cert_file_path, key_file_path)
-
-    r = get_session().post(app.config['MDTRANSLATOR_URL'], data=options)
-    if (r.status_code != 200):
-        ret = {'error': {'messages': ['HTTP %d: %s' % (r.status_code, r.text)]}}
+def read_translator_response(status_code, text, destination_format):
+    """Read the translated document, or the translation errors, from an mdTranslator response
+    :param status_code: HTTP status code of the response
+    :param text: Body of the response
+    :param destination_format: Destination format
+    :return: Translated JSON, or an error message
+    """
+    ret = None
+    if (status_code != 200):
+        ret = {'error': {'messages': ['HTTP %d: %s' % (status_code, text)]}}
     else:
-        ret = r.json()
+        ret = jsoncodec.loads(text)
         if 'success' in ret and ret['success'] and 'data' in ret:
             if destination_format == MDJSON or destination_format == SBJSON:
-                ret = json.loads(ret['data'])
+                ret = jsoncodec.loads(ret['data'])
             else:
                 ret = ret['data']
         elif 'success' in ret and not ret['success']:
@@ -245,7 +720,7 @@ def translate_json(source_json, destination_format = None):
                 msgs = ret['messages']['readerStructureMessages']
                 if len(msgs) > 1:
                     try:
-                        msgs = json.loads(msgs[1])
+                        msgs = jsoncodec.loads(msgs[1])
                     except:
                         pass
                 messages['error']['messages'].extend([m for m in msgs])
@@ -253,7 +728,7 @@ def translate_json(source_json, destination_format = None):
                 msgs = ret['messages']['readerValidationMessages']
                 if len(msgs) > 1:
                     try:
-                        msgs = json.loads(msgs[1])
+                        msgs = jsoncodec.loads(msgs[1])
                     except:
                         pass
                 messages['error']['messages'].extend([m for m in msgs])
@@ -266,6 +741,55 @@ def translate_json(source_json, destination_format = None):
             raise Exception(ret)
     return ret
 
+def get_translator_executor():
+    """Get the bounded executor used to run independent translator requests concurrently
+    :return: Translator executor
+    """
+    global _translator_executor
+    if _translator_executor is None:
+        _translator_executor = ThreadPoolExecutor(max_workers=app.config['TRANSLATOR_WORKERS'], thread_name_prefix='translator')
+    return _translator_executor
+
+def start_iso_translations(md_json, md_text = None):
+    """Start translating mdJSON to ISO 19115-1 and ISO 19115-2 concurrently
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON, if the caller has serialized it
+    :return: Dict of metadata file name to translation Future
+    """
+    app.logger.debug('start_iso_translations')
+    executor = get_translator_executor()
+    # The translations send the serialized mdJSON, a snapshot the caller cannot change while they run
+    if md_text is None:
+        md_text = canonical_json(md_json)
+    return {
+        app.config['ISO1_FILENAME']: submit_with_request_context(executor, translate_json, md_json, ISO_19115_1, md_text),
+        app.config['ISO2_FILENAME']: submit_with_request_context(executor, translate_json, md_json, ISO_19115_2, md_text)
+    }
+
+def cancel_iso_translations(iso_translations):
+    """Cancel ISO translations that are no longer needed
+    :param iso_translations: Dict of metadata file name to translation Future, or None
+    """
+    if iso_translations:
+        for future in iso_translations.values():
+            future.cancel()
+
+def get_iso_translation(fname, future):
+    """Wait for an ISO translation to finish
+    :param fname: Name of the metadata file being generated
+    :param future: Translation Future
+    :return: ISO XML, or None if the translation failed
+    """
+    ret = None
+    try:
+        ret = future.result()
+        if isinstance(ret, dict) and 'error' in ret:
+            app.logger.error('Unable to generate %s: %s' % (fname, str(ret['error'].get('messages'))))
+            ret = None
+    except Exception as e:
+        app.logger.error(u'Unable to generate {0}: {1}'.format(fname, e).encode('ascii','ignore').decode('ascii'))
+    return ret
+
 def fix_sbjson(sbjson):
     """Make required changes to the sbJSON to ensure correctness.
     :param sbjson: sbJSON to fix
@@ -307,42 +831,303 @@ def get_mdjson_from_file(sbjson):
     """
     app.logger.debug('get_mdjson_from_file')
     ret = None
-    if sbjson and 'files' in sbjson:
-        for sbfile in sbjson['files']:
-            if sbfile['name'] == app.config['MDJSON_FILENAME']:
-                try:
-                    ret = ''
-                    r = get_sb_session(request)._session.get(sbfile['url'], stream=True)
-                    for line in r.iter_lines():
-                        # filter out keep-alive new lines
-                        if line:
-                            ret += (line.decode('utf-8'))
-                    ret = json.loads(ret)
-                except:
-                    app.logger.error('Failed to parse attached mdJSON')
+    sbfile = get_mdjson_file(sbjson)
+    if sbfile:
+        try:
+            ret = jsoncodec.loads(download_file(sbfile['url'], app.config['MDJSON_MAX_BYTES']))
+        except:
+            ret = None
+            app.logger.error('Failed to parse attached mdJSON')
     return ret
 
-def upsert_item_and_upload_metadata(item, md_json):
+def get_mdjson_file(sbjson):
+    """Get the mdJSON file attached to a ScienceBase Item
+    :param sbjson: ScienceBase Item JSON
+    :return: ScienceBase file JSON, or None
+    """
+    for sbfile in (sbjson or {}).get('files') or []:
+        if sbfile['name'] == app.config['MDJSON_FILENAME']:
+            return sbfile
+    return None
+
+def download_file(url, max_bytes):
+    """Download a ScienceBase file into memory, streaming it into a single buffer
+    :param url: File URL
+    :param max_bytes: Maximum file size
+    :return: File contents
+    """
+    app.logger.debug('download_file')
+    ret = bytearray()
+    # Closing the response returns the connection to the session's pool
+    with get_sb_session(request)._session.get(url, stream=True) as r:
+        r.raise_for_status()
+        content_length = r.headers.get('Content-Length')
+        if content_length and int(content_length) > max_bytes:
+            raise ValueError('%s is larger than %d bytes' % (url, max_bytes))
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            ret += chunk
+            if len(ret) > max_bytes:
+                raise ValueError('%s is larger than %d bytes' % (url, max_bytes))
+    return ret
+
+def get_mdjson_hash(md_json, md_text = None):
+    """Get the content hash of mdJSON. Key order and formatting do not affect the hash.
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON, if the caller has serialized it
+    :return: SHA-256 hex digest of the canonical mdJSON
+    """
+    if md_text is None:
+        md_text = canonical_json(md_json)
+    return hashlib.sha256(md_text.encode('utf-8')).hexdigest()
+
+def set_mdjson_hash(item, md_hash):
+    """Record the hash of the mdJSON being published as an identifier on the ScienceBase Item
+    :param item: ScienceBase Item JSON
+    :param md_hash: get_mdjson_hash of the mdJSON, or INCOMPLETE_MDJSON_HASH
+    :return: Updated ScienceBase Item JSON
+    """
+    identifiers = [identifier for identifier in item.get('identifiers') or [] if identifier.get('type') != MDJSON_HASH_ID]
+    identifiers.append({'type': MDJSON_HASH_ID, 'scheme': MDJSON_HASH_ID, 'key': md_hash})
+    item['identifiers'] = identifiers
+    return item
+
+def get_published_mdjson_hash(item):
+    """Get the hash of the mdJSON last published to the ScienceBase Item
+    :param item: ScienceBase Item JSON
+    :return: mdJSON hash, or None if the item was not published with one
+    """
+    return get_published_hash(item, MDJSON_HASH_ID)
+
+def get_published_hash(item, hash_id):
+    """Get a hash recorded as an identifier on the ScienceBase Item
+    :param item: ScienceBase Item JSON
+    :param hash_id: Identifier type
+    :return: Hash, or None if the item has none
+    """
+    for identifier in item.get('identifiers') or []:
+        if identifier.get('type') == hash_id:
+            return identifier.get('key')
+    return None
+
+def get_published_file_hashes(item):
+    """Get the hashes of the metadata files last published to the ScienceBase Item
+    :param item: ScienceBase Item JSON
+    :return: Dict of file name to hash
+    """
+    ret = {}
+    for identifier in item.get('identifiers') or []:
+        if identifier.get('type') == FILE_HASH_ID:
+            fname, _, file_hash = identifier.get('key', '').rpartition(':')
+            ret[fname] = file_hash
+    return ret
+
+def get_item_hash(item, keys=None):
+    """Get the content hash of ScienceBase Item JSON. It leaves out the ITEM_SERVER_KEYS and the item hash
+    identifier of earlier versions, so the Item to send and the Item as fetched from ScienceBase hash the
+    same when their content is the same.
+    :param item: ScienceBase Item JSON
+    :param keys: Keys to hash, or None for all of them
+    :return: SHA-256 hex digest
+    """
+    projection = dict((key, item.get(key)) for key in (keys if keys is not None else item) if key not in ITEM_SERVER_KEYS)
+    projection['identifiers'] = [identifier for identifier in item.get('identifiers') or [] if identifier.get('type') != ITEM_HASH_ID]
+    return hashlib.sha256(canonical_json(projection).encode('utf-8')).hexdigest()
+
+def get_item_fields(item):
+    """Get the fields to fetch an existing Item with, to merge into and compare with the given Item
+    :param item: ScienceBase Item JSON to send
+    :return: Comma separated fields: ITEM_FIELDS and the keys of the Item
+    """
+    ret = ITEM_FIELDS.split(',')
+    return ','.join(ret + sorted(key for key in item if key not in ret and key not in ITEM_SERVER_KEYS))
+
+def set_published_hashes(item, file_hashes):
+    """Record the hashes of the metadata files being published as identifiers on the ScienceBase Item
+    :param item: ScienceBase Item JSON
+    :param file_hashes: Dict of file name to hash
+    :return: Updated ScienceBase Item JSON
+    """
+    identifiers = [identifier for identifier in item.get('identifiers') or [] if identifier.get('type') not in (FILE_HASH_ID, ITEM_HASH_ID)]
+    for fname, file_hash in sorted(file_hashes.items()):
+        identifiers.append({'type': FILE_HASH_ID, 'scheme': FILE_HASH_ID, 'key': '%s:%s' % (fname, file_hash)})
+    item['identifiers'] = identifiers
+    return item
+
+def skip_unchanged_files(item, files, file_hashes, existing):
+    """Leave metadata files whose content is already on the ScienceBase Item out of an upload, keeping the
+    Item's existing copies. A file is only left out if md-publisher published the same content last time,
+    and the file on the Item still has that content's size and, when ScienceBase reports one, MD5 checksum.
+    :param item: ScienceBase Item JSON to post
+    :param files: Staged files
+    :param file_hashes: Dict of staged file name to hash
+    :param existing: ScienceBase Item JSON on ScienceBase, with identifiers and files
+    :return: Files that changed
+    """
+    published = get_published_file_hashes(existing)
+    existing_files = dict((sbfile['name'], sbfile) for sbfile in existing.get('files') or [])
+    ret = []
+    for f in files:
+        fname = f[1][0]
+        if fname in existing_files and published.get(fname) == file_hashes[fname] and is_file_on_item(existing_files[fname], f[1][1]):
+            item['files'] = [sbfile for sbfile in item.get('files') or [] if sbfile['name'] != fname] + [existing_files[fname]]
+        else:
+            ret.append(f)
+    return ret
+
+def is_file_on_item(sbfile, contents):
+    """Return whether a file on a ScienceBase Item has the given contents, by its size and any MD5 checksum
+    :param sbfile: ScienceBase file JSON
+    :param contents: File contents, bytes
+    :return: True if the file matches
+    """
+    if sbfile.get('size') != len(contents):
+        return False
+    checksum = sbfile.get('checksum') or {}
+    if checksum.get('value') and str(checksum.get('type', '')).upper() == 'MD5':
+        return checksum['value'].lower() == hashlib.md5(contents).hexdigest()
+    return True
+
+def get_upsert_action(item, files, existing):
+    """Decide how to send an Item to ScienceBase
+    :param item: ScienceBase Item JSON to post, with its hashes set
+    :param files: Files that changed
+    :param existing: ScienceBase Item JSON on ScienceBase, fetched with the get_item_fields of the Item, or
+    None for a new Item
+    :return: 'upload' to upload the files and upsert the Item, 'update' to update only the Item JSON, or
+    None when the Item on ScienceBase already has what would be sent
+    """
+    if existing is None or files:
+        return 'upload'
+    if get_item_hash(existing, list(item)) != get_item_hash(item):
+        return 'update'
+    return None
+
+def is_mdjson_unchanged(item, md_json, md_open=None, md_text=None):
+    """Return whether the mdJSON is the same as that last published to the ScienceBase Item. Compares the
+    recorded hash, and only downloads the attached mdJSON for items published before hashes were recorded.
+    :param item: ScienceBase Item JSON, with identifiers and files
+    :param md_json: mdJSON
+    :param md_open: mdJSON attached to the item, if the caller has downloaded the get_unhashed_mdjson_file
+    :param md_text: canonical_json of the mdJSON, if the caller has serialized it
+    :return: True if the mdJSON has not changed
+    """
+    app.logger.debug('is_mdjson_unchanged')
+    published_hash = get_published_mdjson_hash(item)
+    if published_hash == INCOMPLETE_MDJSON_HASH:
+        return False
+    if published_hash:
+        return published_hash == get_mdjson_hash(md_json, md_text)
+    if md_open is None:
+        md_open = get_mdjson_from_file(item)
+    return bool(md_open) and md_json == md_open
+
+def get_unhashed_mdjson_file(item):
+    """Get the attached mdJSON file to compare with, for an Item published before hashes were recorded
+    :param item: ScienceBase Item JSON, with identifiers and files
+    :return: ScienceBase file JSON, or None if the Item has an mdJSON hash or no mdJSON file
+    """
+    if get_published_mdjson_hash(item):
+        return None
+    return get_mdjson_file(item)
+
+def upsert_item_and_upload_metadata(item, md_json, iso_translations = None, md_text = None):
     """Create or update a ScienceBase Item, and upload metadata files to it
     :param item: ScienceBase Item JSON
     :param mdjson: mdJSON 
+    :param iso_translations: ISO translations already started with start_iso_translations, if any
+    :param md_text: canonical_json of the mdJSON, if the caller has serialized it
     :return: Updated ScienceBase Item JSON
     """
     app.logger.debug('upsert_item_and_upload_metadata')
     ret = None
-    iso1 = None
-    iso2 = None
-    files = []
+    if md_text is None:
+        md_text = canonical_json(md_json)
+
+    # The two ISO translations are independent, so run them concurrently
+    if iso_translations is None:
+        iso_translations = start_iso_translations(md_json, md_text)
+    iso1_fname = app.config['ISO1_FILENAME']
+    iso2_fname = app.config['ISO2_FILENAME']
+    iso1 = get_iso_translation(iso1_fname, iso_translations[iso1_fname])
+    iso2 = get_iso_translation(iso2_fname, iso_translations[iso2_fname])
 
+    sb = get_sb_session(request)
+    existing = get_existing_item(sb, item)
+    action, files, data = plan_upsert(item, md_text, iso1, iso2, existing)
     try:
-        iso1 = translate_json(md_json, ISO_19115_1)
-        iso2 = translate_json(md_json, ISO_19115_2)
-    except:
-        pass
-    
+        if action == 'upload':
+            response = sb._session.post(sb._base_upload_file_url, files=files, params={'scrapeFile':'false'}, data=data)
+            ret = sb._get_json(response)
+        elif action == 'update':
+            ret = sb.update_item(item)
+        else:
+            ret = existing
+        if action:
+            item_upserted(item, ret)
+    except Exception as e:
+        msg = get_upsert_error(item, files)
+        app.logger.error(msg)
+        ret = {"error": {"messages": [msg, "{0}".format(e)]}}
+
+    return ret
+
+def plan_upsert(item, md_text, iso1, iso2, existing):
+    """Stage the item and metadata files, and decide how to send them to ScienceBase
+    :param item: ScienceBase Item JSON
+    :param md_text: canonical_json of the mdJSON
+    :param iso1: ISO 19115-1 XML, or None
+    :param iso2: ISO 19115-2 XML, or None
+    :param existing: ScienceBase Item JSON on ScienceBase, or None for a new Item
+    :return: Tuple of the get_upsert_action action, and the files and form data to post
+    """
+    files, data = get_metadata_upload(item, md_text, iso1, iso2, existing)
+    action = get_upsert_action(item, files, existing)
+    if action == 'update':
+        app.logger.info('Metadata files of %s unchanged, updating the item only' % item['id'])
+    elif action is None:
+        app.logger.info('Nothing changed on %s' % item['id'])
+    return action, files, data
+
+def get_existing_item(sb, item):
+    """Get the Item to be updated as it is on ScienceBase, to compare with what is about to be sent. Publishes
+    have usually fetched it already, so it comes from the publish's item memo.
+    :param sb: SbSession
+    :param item: ScienceBase Item JSON to post
+    :return: ScienceBase Item JSON, or None for a new Item or if it could not be fetched
+    """
+    if not item.get('id'):
+        return None
+    try:
+        return get_sb_item(sb, item['id'], get_item_fields(item))
+    except Exception as e:
+        app.logger.warning(u'Unable to get %s, uploading all metadata: {0}'.format(e) % item['id'])
+        return None
+
+def get_upsert_error(item, files):
+    """Get the error message for a failed upsert
+    :param item: ScienceBase Item JSON that was posted
+    :param files: Files that were uploaded
+    :return: Error message
+    """
+    if files:
+        return 'Unable to upload %s' % (', '.join([f[1][0] for f in files]))
+    return 'Unable to update %s' % item.get('id')
+
+def get_metadata_upload(item, md_text, iso1, iso2, existing=None):
+    """Stage the item and metadata files for ScienceBase's upload and upsert request
+    :param item: ScienceBase Item JSON
+    :param md_text: canonical_json of the mdJSON
+    :param iso1: ISO 19115-1 XML, or None
+    :param iso2: ISO 19115-2 XML, or None
+    :param existing: ScienceBase Item JSON on ScienceBase, if the item exists. Files it already has are not staged.
+    :return: Tuple of the files and form data to post
+    """
+    files = []
+    file_hashes = {}
     iso1_fname = app.config['ISO1_FILENAME']
     iso2_fname = app.config['ISO2_FILENAME']
-    for fname, contents in [(app.config['MDJSON_FILENAME'], md_json), (iso1_fname, iso1), (iso2_fname, iso2)]:
+    md_fname = app.config['MDJSON_FILENAME']
+    for fname, contents in [(md_fname, md_text), (iso1_fname, iso1), (iso2_fname, iso2)]:
         if contents:
             # Remove any existing files of the same name
             if 'files' in item: 
@@ -354,32 +1139,43 @@ def upsert_item_and_upload_metadata(item, md_json):
 
             # Stage the new file
             mime_type = None
-            if isinstance(contents, dict):
-                contents = json.dumps(contents)
+            if fname == md_fname:
                 mime_type = "application/json"
             elif fname == iso1_fname:
                 mime_type = "application/vnd.iso.19139-1+xml"
             elif fname == iso2_fname:
                 mime_type = "application/vnd.iso.19139-2+xml"
-            files.append(("file", (fname, contents.encode('utf-8'), mime_type)))
+            contents = contents.encode('utf-8')
+            file_hashes[fname] = hashlib.sha256(contents).hexdigest()
+            files.append(("file", (fname, contents, mime_type)))
         else:
             app.logger.debug("FILE %s HAS NO CONTENTS" % fname)
-            
 
-    data = {"item": json.dumps(item)}
+    if iso1 and iso2:
+        set_mdjson_hash(item, get_mdjson_hash(None, md_text))
+    else:
+        set_mdjson_hash(item, INCOMPLETE_MDJSON_HASH)
+    set_published_hashes(item, file_hashes)
+    if existing:
+        files = skip_unchanged_files(item, files, file_hashes, existing)
+
+    data = {"item": jsoncodec.dumps(item)}
     if "id" in item and item["id"]:
         data["id"] = item["id"]
+    return files, data
 
-    sb = get_sb_session(request)
-    try:
-        response = sb._session.post(sb._base_upload_file_url, files=files, params={'scrapeFile':'false'}, data=data)
-        ret = sb._get_json(response)
-    except Exception as e:
-        msg = 'Unable to upload %s' % (fname)
-        app.logger.error(msg)
-        ret = {"error": {"messages": [msg, "{0}".format(e)]}}
-
-    return ret
+def item_upserted(item, response):
+    """Update the caches after an Item has been created or updated
+    :param item: ScienceBase Item JSON that was posted
+    :param response: ScienceBase Item JSON returned
+    """
+    invalidate_identifier_cache([item, response])
+    # The item may have moved to a new parent, taking its descendants with it
+    invalidate_ancestor_cache([response.get('id')])
+    forget_item(get_item_memo(), response.get('id'))
+    community_mirror = get_community_mirror()
+    if community_mirror is not None and response.get('id') and community_mirror.get_refreshed() is not None:
+        community_mirror.put_item(response)
 
 def get_valid_identifier(identifier):
     """Verify identifier is an ObjectId, and strip off any request parameters
@@ -408,29 +1204,121 @@ def create_or_update_item(md, item_id = None):
     ret = None
     mdjson = None
 
-    parent_id = get_valid_identifier(md['parentid']) if 'parentid' in md else None
-    community_id = md['community_id'] if 'community_id' in md else parent_id
-    orphan_project_folder_id = md['projects_parent_id'] if 'projects_parent_id' in md else app.config['LC_MAP_ID']
-    orphan_product_folder_id = md['products_parent_id'] if 'products_parent_id' in md else app.config['LC_MAP_ID']
-    force = md['force_update'] if 'force_update' in md else app.config['FORCE_UPDATE']
+    parent_id, community_id, orphan_project_folder_id, orphan_product_folder_id, force = get_publish_options(md)
 
     if 'mdjson' in md:
         mdjson = md['mdjson']
-        item = create_or_update_sbitem_from_mdjson(item_id, parent_id, mdjson, community_id, orphan_project_folder_id, orphan_product_folder_id, force)
-        ret = item
-        if 'error' not in item:            
-            if 'relationships' in md and len(md['relationships']) > 0:
-                ret = [item]
-                related_items = md['relationships']   
-                for related_item in related_items:
-                    product_item = create_or_update_sbitem_from_mdjson(None, item['id'], related_item, community_id, orphan_project_folder_id, orphan_product_folder_id, force)
-                    create_item_link(sb, 'parentProject', 'productOf', item['id'], product_item['id'])
-                    ret.append(product_item)                    
+        with memoize_items():
+            item = create_or_update_sbitem_from_mdjson(item_id, parent_id, mdjson, community_id, orphan_project_folder_id, orphan_product_folder_id, force)
+            ret = item
+            if 'error' not in item:            
+                if 'relationships' in md and len(md['relationships']) > 0:
+                    ret = [item]
+                    ret.extend(publish_related_items(item['id'], md['relationships'], community_id, orphan_project_folder_id, orphan_product_folder_id, force))
     else:
         ret = {"error": {"messages":["mdjson is required"]}}
 
     return ret
 
+def get_publish_options(md):
+    """Get the publishing options posted with the mdJSON
+    :param md: Posted data
+    :return: Tuple of parent ID, community ID, orphan project folder ID, orphan product folder ID and force update flag
+    """
+    parent_id = get_valid_identifier(md['parentid']) if 'parentid' in md else None
+    community_id = md['community_id'] if 'community_id' in md else parent_id
+    orphan_project_folder_id = md['projects_parent_id'] if 'projects_parent_id' in md else app.config['LC_MAP_ID']
+    orphan_product_folder_id = md['products_parent_id'] if 'products_parent_id' in md else app.config['LC_MAP_ID']
+    force = md['force_update'] if 'force_update' in md else app.config['FORCE_UPDATE']
+    return parent_id, community_id, orphan_project_folder_id, orphan_product_folder_id, force
+
+def publish_related_items(parent_item_id, related_items, community_id, orphan_project_folder_id, orphan_product_folder_id, force):
+    """Create or update related products under the parent item concurrently, RELATIONSHIP_WORKERS at a time
+    :param parent_item_id: ID of the parent ScienceBase Item
+    :param related_items: List of mdJSON for the related products
+    :return: List of resulting ScienceBase Item JSON, in the order of related_items
+    """
+    app.logger.debug('publish_related_items')
+    with ThreadPoolExecutor(max_workers=app.config['RELATIONSHIP_WORKERS'], thread_name_prefix='related') as executor:
+        futures = [submit_with_request_context(executor, publish_related_item, parent_item_id, related_item, community_id, orphan_project_folder_id, orphan_product_folder_id, force) for related_item in related_items]
+        for published, future in enumerate(as_completed(futures), 1):
+            report_job_progress({'item': parent_item_id, 'related_items': len(futures), 'published': published})
+        return [future.result() for future in futures]
+
+def publish_related_item(parent_item_id, related_item, community_id, orphan_project_folder_id, orphan_product_folder_id, force):
+    """Create or update a related product and link it to the parent item. Errors are returned, not raised,
+    so one failed product does not affect the others.
+    :param parent_item_id: ID of the parent ScienceBase Item
+    :param related_item: mdJSON of the related product
+    :return: Resulting ScienceBase Item JSON
+    """
+    app.logger.debug('publish_related_item')
+    try:
+        product_item = create_or_update_sbitem_from_mdjson(None, parent_item_id, related_item, community_id, orphan_project_folder_id, orphan_product_folder_id, force)
+        if 'error' not in product_item:
+            link_items(parent_item_id, product_item['id'], get_item_link_type_id('productOf'), True)
+        return product_item
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        return get_error_json(e)[1]
+
+def submit_with_request_context(executor, fn, *args):
+    """Submit a function to an executor, running it in a copy of the current request context (if any) and
+    context variables, so it can use the request's ScienceBase credentials from a worker thread
+    :param executor: Executor
+    :param fn: Function to run
+    :param args: Function arguments
+    :return: Future
+    """
+    if has_request_context():
+        fn = copy_current_request_context(fn)
+    # Run in a copy of the context variables too, so the function shares the publish's memo
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def publish_record(record):
+    """Create or update the ScienceBase Item for one record of a batch
+    :param record: Record in the format posted to /project or /product, optionally with an item_id to update
+    :return: Tuple of HTTP status code and resulting JSON
+    """
+    app.logger.debug('publish_record')
+    try:
+        md = record['data'] if isinstance(record, dict) and 'data' in record else record
+        if not isinstance(md, dict):
+            return 400, {"error": {"messages": ["Each record must be a JSON object"]}}
+        ret = create_or_update_item(md, get_valid_identifier(md.get('item_id')))
+        return get_response_status(ret), ret
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        return get_error_json(e)
+
+def publish_batch(records):
+    """Publish records on a bounded worker pool
+    :param records: List of records
+    :return: Generator of NDJSON lines, one per record as it finishes, then a summary line
+    """
+    app.logger.debug('publish_batch')
+    start = time.time()
+    succeeded = 0
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=app.config['BATCH_WORKERS'], thread_name_prefix='batch')
+    try:
+        futures = {}
+        for index, record in enumerate(records):
+            futures[submit_with_request_context(executor, publish_record, record)] = index
+        for future in as_completed(futures):
+            status_code, result = future.result()
+            if status_code == 200:
+                succeeded += 1
+            else:
+                failed += 1
+            yield jsoncodec.dumps({"index": futures[future], "status": status_code, "result": result}) + '\n'
+    finally:
+        # If the client goes away, finish the records in progress but do not start any more
+        executor.shutdown(wait=True, cancel_futures=True)
+    summary = {"total": len(records), "succeeded": succeeded, "failed": failed, "seconds": round(time.time() - start, 3)}
+    app.logger.info('Batch complete: %s' % str(summary))
+    yield jsoncodec.dumps({"summary": summary}) + '\n'
+
 def get_parent_id(md_json, sb_json, base_folder_id, orphan_project_folder_id, orphan_product_folder_id):
     """Get the ScienceBase Item parent ID based on the given mdJSON and sbJSON if it is under the given base folder
     :param md_json: mdJSON
@@ -445,19 +1333,34 @@ def get_parent_id(md_json, sb_json, base_folder_id, orphan_project_folder_id, or
     if sb_json and 'parentId' in sb_json and sb_json['parentId'] and is_ancestor(sb_json['parentId'], base_folder_id):
         sb_parent_id = sb_json['parentId']
     else:
-        resource_type = get_resource_type(md_json)
         # Run through and search for parent ScienceBase item id if the item is a product        
-        if resource_type == PRODUCT_RESOURCE_TYPE:
-            result = find_sb_items({'identifiers': get_associated_project_identifiers(md_json)}, base_folder_id)
+        search_item = get_parent_project_search(md_json)
+        if search_item:
+            result = find_sb_items(search_item, base_folder_id)
             if result and len(result) > 0:
                 sb_parent_id = result[0]['id']
         if not sb_parent_id:
-            if resource_type == PROJECT_RESOURCE_TYPE:
-                sb_parent_id = orphan_project_folder_id
-            else:
-                sb_parent_id = orphan_product_folder_id        
+            sb_parent_id = get_orphan_folder_id(md_json, orphan_project_folder_id, orphan_product_folder_id)
     return sb_parent_id
 
+def get_parent_project_search(md_json):
+    """Get the item to search for to find the parent project of a product
+    :param md_json: mdJSON
+    :return: Search item JSON with the project identifiers, or None if the mdJSON is not a product
+    """
+    if get_resource_type(md_json) == PRODUCT_RESOURCE_TYPE:
+        return {'identifiers': get_associated_project_identifiers(md_json)}
+    return None
+
+def get_orphan_folder_id(md_json, orphan_project_folder_id, orphan_product_folder_id):
+    """Get the folder for a project or product with no parent
+    :param md_json: mdJSON
+    :return: Folder ID
+    """
+    if get_resource_type(md_json) == PROJECT_RESOURCE_TYPE:
+        return orphan_project_folder_id
+    return orphan_product_folder_id
+
 def get_associated_project_identifiers(md_json):
     """Get the associated project identifiers from the mdJSON
     :param md_json: mdJSON
@@ -509,31 +1412,24 @@ def create_or_update_sbitem_from_mdjson(item_id, parent_id, md_json, base_folder
     app.logger.debug("create_or_update_sbitem_from_mdjson")
     ret = {"error":{"messages": []}}
     sb = get_sb_session(request)    
+    # Serialize the mdJSON once for the translations, the unchanged check and the upload
+    md_text = canonical_json(md_json)
+    # When the item will always be updated, generate the ISO metadata while the sbJSON is translated
+    iso_translations = start_iso_translations(md_json, md_text) if force else None
     # Use the translator to convert the PTS mdJson to ScienceBase sbJson
-    sb_json = fix_sbjson(translate_json(md_json))
+    sb_json = prepare_sbjson(md_json, translate_mdjson_to_sbjson(md_json, md_text), item_id)
     if 'error' in sb_json:
-        title = ''
-        if 'citation' in md_json.get('metadata', {}).get('resourceInfo', {}):
-            title = md_json['metadata']['resourceInfo']['citation']['title']
-        ret['error']['messages'].append("An error occurred translating mdJSON for record %s" % title)
-        for message in sb_json['error']['messages']:
-            ret['error']['messages'].append(message)
-        return ret
-    
-    if get_resource_type(md_json) == PROJECT_RESOURCE_TYPE:
-        add_browse_categories(sb_json, ['Project'])
-        
-    # Find if item exists, see whether merging or creating new item 
-    if item_id:
-        sb_json['id'] = item_id
-    sb_found_record = find_sb_items(sb_json, base_folder_id)
-
-    if len(sb_found_record) > 1:
-        ret['error']['messages'].append('More than one instance found, skipping: %s ' % (str(sb_json['title'].encode('utf-8'))))
-        return ret
-    elif item_id and len(sb_found_record) == 0:
-        ret['error']['messages'].append("No item found for specified ScienceBase identifier %s" % (item_id))
-        return ret
+        cancel_iso_translations(iso_translations)
+        return sb_json
+
+    # Find if item exists, see whether merging or creating new item. An item found by ID is fetched with
+    # the fields used next, so they come from the item memo: all of them if it will be merged, or else
+    # those the unchanged check needs.
+    sb_found_record = find_sb_items(sb_json, base_folder_id, get_found_item_fields(force, sb_json))
+    error = get_found_items_error(sb_json, sb_found_record, item_id)
+    if error:
+        cancel_iso_translations(iso_translations)
+        return error
     
     messages = []
     errors = []
@@ -541,65 +1437,157 @@ def create_or_update_sbitem_from_mdjson(item_id, parent_id, md_json, base_folder
     create_or_update = True
     if len(sb_found_record) == 1:     
         # The item exists in ScienceBase, and we need to merge
-        msg = 'Exists in LCC Map Community: ' + str(sb_json['title'].encode('utf-8'))
-        app.logger.info(msg)
-        messages.append(msg)
+        messages.append(get_found_item_message(sb_json))
         exist_sb_id = str(sb_found_record[0]['id'])
 
-        # This is the existing SB item
-        sb_item = sb.get_item(exist_sb_id, {'fields':ITEM_FIELDS})
-
-        sb_item_date = sb_item['provenance']['dateCreated']
         if not force:
-            # Obtain the mdJSON file for comparison before continuing
-            md_open = get_mdjson_from_file(sb_item)
-            if md_open and md_json == md_open:
+            # Compare with the mdJSON published last time before continuing. Only the hashes and files are
+            # needed, and find_sb_items has usually fetched them already.
+            sb_item = get_sb_item(sb, exist_sb_id, CHECK_FIELDS)
+            if is_mdjson_unchanged(sb_item, md_json, md_text=md_text):
                 create_or_update = False
-                msg = "Nothing new to update for: %s" % sb_item['id']
-                app.logger.info(msg)
-                messages.append(msg)
+                messages.append(get_unchanged_message(exist_sb_id))
         if create_or_update:    
-            # Obtain extent(s)
-            sb_json['extents'] = geojson_to_sb_extent(md_json)
-            # Merge the existing item into the sbJSON from the translator
-            sb_json = merge_items(sb_item, sb_json)                           
+            # This is the existing SB item, with the fields to compare the merged item with
+            sb_item = get_sb_item(sb, exist_sb_id, get_item_fields(sb_json))
     if create_or_update:        
-        if not sb_item: 
-            msg = 'No record exists in harvest community, creating new item in ScienceBase for: ' + str(sb_json['title'].encode('utf-8'))
-            app.logger.info(msg)
-            messages.append(msg)
-            sb_json['id'] = None
-            sb_json['extents'] = geojson_to_sb_extent(md_json)
-
+        sb_json = build_sbjson(sb_json, sb_item, md_json, messages)
         sb_json['parentId'] = parent_id if parent_id else get_parent_id(md_json, sb_json, base_folder_id, orphan_project_folder_id, orphan_product_folder_id)
 
         # Upload the mdJson as a file to the item
         # If an error uploading occurs, keep the sb_json we have so far and continue 
-        response = upsert_item_and_upload_metadata(sb_json, md_json)
+        response = upsert_item_and_upload_metadata(sb_json, md_json, iso_translations, md_text)
         if not 'error' in response:
             sb_json = response
             create_associated_links(sb_json['id'], md_json, base_folder_id)
             ret = sb_json
         else:
-            logging.error(str(response))
-            if 'messages' in response['error']:
-                errors.extend(response['error']['messages'])
-            else:
-                errors.extend(response)
+            errors.extend(get_response_errors(response))
+
+    return get_publish_result(ret, messages, errors)
+
+def prepare_sbjson(md_json, sb_json, item_id):
+    """Fix the sbJSON translated from mdJSON, and add what publishing adds to it
+    :param md_json: mdJSON
+    :param sb_json: sbJSON, or the translation error
+    :param item_id: ID of the ScienceBase Item to update, or None
+    :return: sbJSON, or the error JSON to return if the mdJSON could not be translated
+    """
+    sb_json = fix_sbjson(sb_json)
+    if 'error' in sb_json:
+        return get_translation_error(md_json, sb_json)
+    if get_resource_type(md_json) == PROJECT_RESOURCE_TYPE:
+        add_browse_categories(sb_json, ['Project'])
+    if item_id:
+        sb_json['id'] = item_id
+    return sb_json
+
+def get_found_item_fields(force, sb_json):
+    """Get the fields to fetch first of an existing item
+    :param force: Whether the item is updated even if its mdJSON is unchanged
+    :param sb_json: sbJSON being published
+    :return: Comma separated fields
+    """
+    return get_item_fields(sb_json) if force else CHECK_FIELDS
+
+def get_found_items_error(sb_json, sb_found_record, item_id):
+    """Get the error to return when the items found for a record cannot be published to
+    :param sb_json: sbJSON
+    :param sb_found_record: Items found
+    :param item_id: ID of the ScienceBase Item to update, or None
+    :return: Error JSON, or None
+    """
+    ret = {"error":{"messages": []}}
+    if len(sb_found_record) > 1:
+        ret['error']['messages'].append('More than one instance found, skipping: %s ' % (str(sb_json['title'].encode('utf-8'))))
+        return ret
+    elif item_id and len(sb_found_record) == 0:
+        ret['error']['messages'].append("No item found for specified ScienceBase identifier %s" % (item_id))
+        return ret
+    return None
 
+def get_found_item_message(sb_json):
+    """Log and get the message for a record whose item exists
+    :param sb_json: sbJSON
+    :return: Message
+    """
+    msg = 'Exists in LCC Map Community: ' + str(sb_json['title'].encode('utf-8'))
+    app.logger.info(msg)
+    return msg
+
+def get_unchanged_message(item_id):
+    """Log and get the message for an item whose mdJSON has not changed
+    :param item_id: Item ID
+    :return: Message
+    """
+    msg = "Nothing new to update for: %s" % item_id
+    app.logger.info(msg)
+    return msg
+
+def build_sbjson(sb_json, sb_item, md_json, messages):
+    """Add the extents to the sbJSON, and merge the existing item into it
+    :param sb_json: sbJSON from the translator
+    :param sb_item: Existing ScienceBase Item JSON, with ITEM_FIELDS, or None to create a new Item
+    :param md_json: mdJSON
+    :param messages: Messages, to which the creation of a new item is added
+    :return: ScienceBase Item JSON to post, without a parentId
+    """
+    # Obtain extent(s)
+    sb_json['extents'] = geojson_to_sb_extent(md_json)
+    if sb_item:
+        # Merge the existing item into the sbJSON from the translator
+        return merge_items(sb_item, sb_json)
+    msg = 'No record exists in harvest community, creating new item in ScienceBase for: ' + str(sb_json['title'].encode('utf-8'))
+    app.logger.info(msg)
+    messages.append(msg)
+    sb_json['id'] = None
+    return sb_json
+
+def get_response_errors(response):
+    """Log a failed upsert and get its error messages
+    :param response: Error JSON
+    :return: List of messages
+    """
+    logging.error(str(response))
+    if 'messages' in response['error']:
+        return response['error']['messages']
+    return response
+
+def get_publish_result(ret, messages, errors):
+    """Add the messages and errors of a publish to its result
+    :param ret: ScienceBase Item JSON of the resulting Item, or the initial error JSON
+    :param messages: Messages
+    :param errors: Error messages
+    :return: Result JSON
+    """
     if len(messages) > 0:
         ret['messages'] = messages
     if len(errors) > 0:
         ret['error'] =  {"messages": errors}
+    return ret
 
+def get_translation_error(md_json, sb_json):
+    """Get the error to report when mdJSON could not be translated
+    :param md_json: mdJSON
+    :param sb_json: Error returned by the translator
+    :return: Error JSON
+    """
+    ret = {"error":{"messages": []}}
+    title = ''
+    if 'citation' in md_json.get('metadata', {}).get('resourceInfo', {}):
+        title = md_json['metadata']['resourceInfo']['citation']['title']
+    ret['error']['messages'].append("An error occurred translating mdJSON for record %s" % title)
+    for message in sb_json['error']['messages']:
+        ret['error']['messages'].append(message)
     return ret
 
 def update_metadata_json(md_json,):
     app.logger.debug("update_metadata_json")
     ret = {"error":{"messages": []}}
     sb = get_sb_session(request)    
+    md_text = canonical_json(md_json)
     # Use the translator to convert the PTS mdJson to ScienceBase sbJson
-    sb_json = fix_sbjson(translate_json(md_json))
+    sb_json = fix_sbjson(translate_mdjson_to_sbjson(md_json, md_text))
     if 'error' in sb_json:
         title = ''
         if md_json and 'metadata' in md_json and md_json['metadata'] and 'citation' in md_json['metadata'] and md_json['metadata']['citation'] and 'resourceInfo' in md_json['metadata']['citation']:
@@ -621,8 +1609,9 @@ def update_metadata_json(md_json,):
         ret['error']['messages'].append("No ScienceBase item found for %s" % (title))
         return ret
 
-    sb_item = sb.get_item(sb_found_record[0]['id'])
-    response = upsert_item_and_upload_metadata(sb_item, md_json)
+    with memoize_items():
+        sb_item = get_sb_item(sb, sb_found_record[0]['id'])
+        response = upsert_item_and_upload_metadata(sb_item, md_json, md_text=md_text)
     if 'error' in response:
         logging.error(str(response))
         if 'messages' in response['error']:
@@ -654,14 +1643,98 @@ def api_response(r):
         except ValueError as e:
             ret = jsonify(message=[r])
     
-    if ('success' in ret_json and not ret_json['success']) or (len(ret_json.get('error', {}).get('messages', {})) > 0):
-        ret.status_code = 400
+    ret.status_code = get_response_status(ret_json)
+    if ret.status_code != 200:
         app.logger.debug(ret_json)
-    else:
-        ret.status_code = 200
 
     return ret
 
+def api_response_or_job(fn, *args):
+    """Run a publish or delete and create its API response or, if the client asked for async mode,
+    enqueue it as a background job and respond with 202 and the job
+    :param fn: Function returning the response value
+    :param args: Function arguments
+    :return: API response
+    """
+    if not is_job_request(request.args, request.headers):
+        return api_response(fn(*args))
+    app.logger.debug('api_response_or_job')
+    # The job runs after this response is sent, so read the body (and the credentials in it) now
+    request.get_data()
+    job = get_job_store().create(request.endpoint)
+    submit_with_request_context(get_job_executor(), run_job, job['id'], fn, *args)
+    ret = jsonify(job)
+    ret.status_code = 202
+    ret.headers['Location'] = '/jobs/%s' % job['id']
+    return ret
+
+def is_job_request(args, headers):
+    """Return whether the client asked for a publish or delete to run as a background job, with an async
+    query parameter or a Prefer: respond-async header
+    :param args: Query parameters
+    :param headers: Request headers
+    :return: True to run as a job
+    """
+    return (args.get('async', '').lower() in ('1', 'true', 'yes')) or ('respond-async' in headers.get('prefer', '').lower())
+
+def run_job(job_id, fn, *args):
+    """Run a background job, recording its result in the job store
+    :param job_id: Job ID
+    :param fn: Function returning the response value
+    :param args: Function arguments
+    """
+    app.logger.debug('run_job')
+    store = get_job_store()
+    store.start(job_id)
+    request.environ['md_publisher.job'] = job_id
+    try:
+        ret = fn(*args)
+        if ret is None:
+            ret = {"error": {"messages": ["An error occurred"]}}
+        status_code = get_response_status(ret)
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        status_code, ret = get_error_json(e)
+    store.finish(job_id, status_code, ret)
+    app.logger.info('Job %s finished with status %d' % (job_id, status_code))
+
+def report_job_progress(progress):
+    """Record the progress of the current request's background job, if it is running as one
+    :param progress: Progress JSON
+    """
+    if has_request_context() and 'md_publisher.job' in request.environ:
+        get_job_store().update_progress(request.environ['md_publisher.job'], progress)
+
+def get_job_store():
+    """Get the store of background jobs
+    :return: Job store
+    """
+    global _job_store
+    if _job_store is None:
+        _job_store = jobs.JobStore(app.config['JOB_STORE_PATH'], app.config['JOB_RETENTION'])
+    return _job_store
+
+def get_job_executor():
+    """Get the worker pool that runs background jobs
+    :return: Job executor
+    """
+    global _job_executor
+    if _job_executor is None:
+        _job_executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job')
+    return _job_executor
+
+def get_response_status(ret_json):
+    """Get the HTTP status code for a response value
+    :param ret_json: Response JSON, or a list of them when related items were published
+    :return: 400 if the response holds an error, otherwise 200
+    """
+    if isinstance(ret_json, list):
+        return 400 if any(get_response_status(r) != 200 for r in ret_json if isinstance(r, dict)) else 200
+    error = ret_json.get('error', {})
+    if ('success' in ret_json and not ret_json['success']) or (not isinstance(error, dict)) or (len(error.get('messages', {})) > 0):
+        return 400
+    return 200
+
 def add_browse_categories(item_json, browse_categories):
     """Add browse categories to the ScienceBase Item JSON
     :param item_json: ScienceBase Item JSON
@@ -706,7 +1779,7 @@ def merge_items(original_item, new_item):
                         orig_project_facet = facet     
                     elif facet['className'] == 'gov.sciencebase.catalog.item.facet.BudgetFacet':
                         orig_budget_facet = facet
-            new_facet_names = []            
+            new_facet_names = set()
             for facet in new_item['facets']:
                 # Get the project status from the new project facet and update the original one with it  
                 if facet['className'] == 'gov.sciencebase.catalog.item.facet.ProjectFacet':
@@ -724,7 +1797,7 @@ def merge_items(original_item, new_item):
                         orig_budget_facet = facet
                     
 
-                new_facet_names.append(facet['className'])     
+                new_facet_names.add(facet['className'])
                                  
             # Merge in any non-conflicting facets from the original item
             facets = [facet for facet in new_item['facets'] if not facet['className'].endswith('ProjectFacet') and not facet['className'].endswith('BudgetFacet')]
@@ -741,7 +1814,8 @@ def merge_items(original_item, new_item):
 
     # Merge tags
     if 'tags' in new_item and new_item['tags'] and 'tags' in original_item:
-        new_item['tags'].extend([x for x in original_item['tags'] if x not in new_item['tags']])
+        new_tags = set(get_merge_key(x) for x in new_item['tags'])
+        new_item['tags'].extend([x for x in original_item['tags'] if get_merge_key(x) not in new_tags])
     elif 'tags' in original_item:
         app.logger.debug("No new tags, bringing in existing tags")
         new_item['tags'] = original_item['tags'] 
@@ -754,14 +1828,36 @@ def merge_items(original_item, new_item):
 
     # Remove duplicate identifiers:
     if 'identifiers' in new_item:
-        ids = []
-        for identifier in new_item['identifiers']:
-            if identifier not in ids:
-                ids.append(identifier)
-        new_item['identifiers'] = ids
+        new_item['identifiers'] = remove_duplicates(new_item['identifiers'])
     
     return new_item
 
+def get_merge_key(value):
+    """Get a hashable key for a JSON value, so lists of tags, identifiers and facets can be merged with set
+    lookups rather than list scans. Keys are equal exactly when the values are (==).
+    :param value: JSON value
+    :return: Hashable key
+    """
+    if isinstance(value, dict):
+        return frozenset((key, get_merge_key(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(get_merge_key(item) for item in value)
+    return value
+
+def remove_duplicates(values):
+    """Remove duplicate JSON values, keeping the first of each in order
+    :param values: List of JSON values
+    :return: List without duplicates
+    """
+    ret = []
+    seen = set()
+    for value in values:
+        key = get_merge_key(value)
+        if key not in seen:
+            seen.add(key)
+            ret.append(value)
+    return ret
+
 def create_associated_links(sb_item_id, md_json, base_folder_id):
     """Create associated Item Links
     :param sb_item_id: The ScienceBase ID of the item to link from
@@ -772,23 +1868,44 @@ def create_associated_links(sb_item_id, md_json, base_folder_id):
     errors = []
     # Create any required item links for item
     if 'associatedResource' in md_json.get('metadata', {}):
-        for associated_resource in md_json['metadata']['associatedResource']:            
-            if 'associationType' in associated_resource:
-                app.logger.debug(associated_resource['associationType'])
-                associated_resource_ids = get_resource_identifiers(associated_resource)
-                if associated_resource_ids:
-                    app.logger.debug("Creating link to %s" % (associated_resource_ids))
-                    try:
-                        association_type = associated_resource['associationType']
-                        resource_type = get_resource_type(md_json)
-                        create_item_link(association_type, resource_type, sb_item_id, associated_resource_ids, base_folder_id)
-                    except Exception as e:
-                        msg = "Unable to create %s relationship between %s and %s" % (associated_resource['associationType'], sb_item_id, str(associated_resource_ids))
-                        errors.append(msg)
-                        app.logger.error(msg)
-                        app.logger.error(u"error: {0}".format(e).encode('ascii','ignore').decode('ascii'))
+        # Look up the community membership of all linked ScienceBase items at once
+        filter_descendants([identifier['key'] for associated_resource in md_json['metadata']['associatedResource']
+            for identifier in get_resource_identifiers(associated_resource) if identifier['type'] in SB_IDENTIFIERS and identifier['key']], base_folder_id)
+        resource_type = get_resource_type(md_json)
+        for association_type, associated_resource_ids in get_associations(md_json):
+            app.logger.debug("Creating link to %s" % (associated_resource_ids))
+            try:
+                create_item_link(association_type, resource_type, sb_item_id, associated_resource_ids, base_folder_id)
+            except Exception as e:
+                errors.append(get_link_error(association_type, sb_item_id, associated_resource_ids, e))
     return errors
 
+def get_associations(md_json):
+    """Get the associated resources of mdJSON to link to
+    :param md_json: mdJSON
+    :return: List of (association type, identifiers of the associated resource)
+    """
+    ret = []
+    for associated_resource in md_json.get('metadata', {}).get('associatedResource', []):
+        if 'associationType' in associated_resource:
+            associated_resource_ids = get_resource_identifiers(associated_resource)
+            if associated_resource_ids:
+                ret.append((associated_resource['associationType'], associated_resource_ids))
+    return ret
+
+def get_link_error(association_type, sb_item_id, associated_resource_ids, e):
+    """Log and get the error message for a link that could not be created
+    :param association_type: Type of association
+    :param sb_item_id: The ScienceBase ID of the item linked from
+    :param associated_resource_ids: Identifiers of the associated resource
+    :param e: Exception raised
+    :return: Error message
+    """
+    msg = "Unable to create %s relationship between %s and %s" % (association_type, sb_item_id, str(associated_resource_ids))
+    app.logger.error(msg)
+    app.logger.error(u"error: {0}".format(e).encode('ascii','ignore').decode('ascii'))
+    return msg
+
 def get_resource_type(md_json):
     """Get resource type from mdJSON
     :param md_json: mdJSON
@@ -814,16 +1931,9 @@ def create_item_link(association_type, resource_type, parent_item_id, child_item
     """
     app.logger.debug('create_item_link %s %s:%s' % (association_type, parent_item_id, str(child_item_ids)))
     ret = None
-    global _item_link_types
-    sb = get_sb_session(request)
 
     # First, find the child
-    search_item = {'identifiers': child_item_ids}
-    for identifier in child_item_ids:
-        if ('scheme' in identifier and identifier['scheme'] in SB_IDENTIFIERS) or ('type' in identifier and identifier['type'] in SB_IDENTIFIERS):
-            search_item['id'] = identifier['key']
-            break
-    child_items = find_sb_items(search_item, base_folder_id)
+    child_items = find_sb_items(get_child_search_item(child_item_ids), base_folder_id)
     child_item_id = None
     if len(child_items) > 0:
         child_item_id = child_items[0]['id']
@@ -832,40 +1942,87 @@ def create_item_link(association_type, resource_type, parent_item_id, child_item
         app.logger.info("Child not found %s" % (str(child_item_ids)))
         return ret
 
-    if not _item_link_types:
-        # Load the known ItemLink types from vocab. This only needs to be done once.
-        _item_link_types = {}
-        for item_link_type in sb.get_item_link_types():
-            _item_link_types[item_link_type['name']] = item_link_type['id']
+    link_type, reverse = get_link_type(association_type, resource_type)
+    if link_type:
+        ret = link_items(parent_item_id, child_item_id, get_item_link_type_id(link_type), reverse)
+    return ret
+
+def get_child_search_item(child_item_ids):
+    """Get the item to search for to find the child of a link
+    :param child_item_ids: List of identifiers by which to find the child item
+    :return: Search item JSON, with the ScienceBase ID if one of the identifiers is
+    """
+    ret = {'identifiers': child_item_ids}
+    for identifier in child_item_ids:
+        if ('scheme' in identifier and identifier['scheme'] in SB_IDENTIFIERS) or ('type' in identifier and identifier['type'] in SB_IDENTIFIERS):
+            ret['id'] = identifier['key']
+            break
+    return ret
 
-    item_link_type_id = None
-    reverse = False
+def get_link_type(association_type, resource_type):
+    """Get the ItemLink type of an association
+    :param association_type: Type of association
+    :param resource_type: Resource type of the item linked from
+    :return: Tuple of the ItemLink type name (None if the association is not linked) and whether the
+    relationship is a reverse relationship
+    """
     if association_type == PRODUCT_RESOURCE_TYPE:
-        item_link_type_id = _item_link_types['productOf']
-        reverse = True
+        return 'productOf', True
     elif association_type == 'parentProject':
         # If this item is a project, it is a sub-project of the parent project
         # Otherwise it is a product of the parent project
         if PROJECT_RESOURCE_TYPE in resource_type:
-            item_link_type_id = _item_link_types['subprojectOf']            
-        else:
-            item_link_type_id = _item_link_types['productOf']
-        reverse = False
+            return 'subprojectOf', False
+        return 'productOf', False
     elif association_type == 'subProject':
-        item_link_type_id = _item_link_types['subprojectOf']
-        reverse = True
+        return 'subprojectOf', True
     elif association_type == 'alternate':
-        item_link_type_id = _item_link_types['alternate']
-        reverse = False
+        return 'alternate', False
     elif association_type == 'crossReference':
-        item_link_type_id = _item_link_types['related']
-        reverse = False
+        return 'related', False
+    return None, False
 
-    if item_link_type_id and not has_link(parent_item_id, child_item_id, item_link_type_id, reverse):
+def get_item_link_type_id(name):
+    """Get the ID of an ItemLink type
+    :param name: ItemLink type name
+    :return: ItemLink type ID
+    """
+    if not _item_link_types:
+        # Load the known ItemLink types from vocab. This only needs to be done once.
+        set_item_link_types(get_sb_session(request).get_item_link_types())
+    return _item_link_types[name]
+
+def set_item_link_types(item_link_types):
+    """Set the known ItemLink types
+    :param item_link_types: ItemLink type JSON from the ScienceBase vocab
+    """
+    global _item_link_types
+    _item_link_types = dict((item_link_type['name'], item_link_type['id']) for item_link_type in item_link_types)
+
+def link_items(parent_item_id, child_item_id, item_link_type_id, reverse):
+    """Create an item link between the given items, unless it already exists
+    :param parent_item_id: Parent Item ID
+    :param child_item_id: Child Item ID
+    :param item_link_type_id: ID of the link type
+    :param reverse: Whether the relationship is a reverse relationship
+    :return: ScienceBase ItemLink JSON, or None if the link already existed
+    """
+    ret = None
+    if not has_link(parent_item_id, child_item_id, item_link_type_id, reverse):
         app.logger.debug('Create item link between %s and %s' % (parent_item_id, child_item_id))
-        ret = sb.create_item_link(parent_item_id, child_item_id, item_link_type_id, reverse)
+        ret = get_sb_session(request).create_item_link(parent_item_id, child_item_id, item_link_type_id, reverse)
+        link_created(get_link_key(parent_item_id, child_item_id, item_link_type_id, reverse))
     return ret
 
+def link_created(link_key):
+    """Keep the link index of both items of a new ItemLink current
+    :param link_key: get_link_key of the ItemLink
+    """
+    for item_id in link_key[:2]:
+        link_keys = get_link_cache().get(item_id)
+        if link_keys is not None:
+            link_keys.add(link_key)
+
 def has_link(parent_item_id, child_item_id, item_link_type_id, reverse):
     """Return whether a link exists between the given items
     :param parent_item_id: Parent Item ID
@@ -875,48 +2032,113 @@ def has_link(parent_item_id, child_item_id, item_link_type_id, reverse):
     :return: True if the link exists, otherwise False
     """
     app.logger.debug("has_link %s %s %s %s" % (parent_item_id, child_item_id, item_link_type_id, reverse))
-    ret = False
-    item_id = parent_item_id
-    related_item_id = child_item_id
+    link_key = get_link_key(parent_item_id, child_item_id, item_link_type_id, reverse)
+    return link_key in get_link_keys(link_key[0])
+
+def get_link_key(parent_item_id, child_item_id, item_link_type_id, reverse):
+    """Get the key identifying an ItemLink in the link index
+    :param parent_item_id: Parent Item ID
+    :param child_item_id: Child Item ID
+    :param item_link_type_id: ID of the link type
+    :param reverse: Whether the relationship is a reverse relationship
+    :return: Tuple of (itemId, relatedItemId, itemLinkTypeId)
+    """
     if reverse:
-        item_id = child_item_id
-        related_item_id = parent_item_id
+        return (child_item_id, parent_item_id, item_link_type_id)
+    return (parent_item_id, child_item_id, item_link_type_id)
 
-    existing_links = get_sb_session(request).get_item_links(item_id)
-    for l in existing_links:
-        if l['itemLinkTypeId'] == item_link_type_id and l['itemId'] == item_id and l['relatedItemId'] == related_item_id:
-            ret = True
-            break
+def get_link_cache():
+    """Get the ItemLink index
+    :return: Link cache
+    """
+    global _link_cache
+    if _link_cache is None:
+        _link_cache = TTLCache(app.config['LINK_CACHE_SIZE'], app.config['LINK_CACHE_TTL'])
+    return _link_cache
+
+def get_link_keys(item_id):
+    """Get the keys of the ItemLinks involving the given Item, loading them from ScienceBase at most
+    once per LINK_CACHE_TTL seconds
+    :param item_id: Item ID
+    :return: Set of (itemId, relatedItemId, itemLinkTypeId)
+    """
+    app.logger.debug("get_link_keys")
+    ret = get_link_cache().get(item_id)
+    if ret is None:
+        ret = set_link_keys(item_id, get_sb_session(request).get_item_links(item_id))
     return ret
 
-def find_sb_items(sb_json, base_folder_id):
+def set_link_keys(item_id, item_links):
+    """Index the ItemLinks involving the given Item
+    :param item_id: Item ID
+    :param item_links: ScienceBase ItemLink JSON of the Item
+    :return: Set of (itemId, relatedItemId, itemLinkTypeId)
+    """
+    ret = set((l['itemId'], l['relatedItemId'], l['itemLinkTypeId']) for l in item_links)
+    get_link_cache().put(item_id, ret)
+    return ret
+
+def find_sb_items(sb_json, base_folder_id, fields='ancestors'):
     """ Find item by a list of identifiers
     :param sb_json: ScienceBase Item JSON
     :param base_folder_id: ID of the folder under which to search
+    :param fields: Fields to fetch with the ancestors of an item found by ID or in the community mirror, for
+    the caller to use next
     """
     app.logger.debug("find_sb_items")
     ret = []
 
     if 'id' in sb_json and sb_json['id']:
         # Verify the item is in the community
-        if is_ancestor(sb_json['id'], base_folder_id):
+        if is_ancestor(sb_json['id'], base_folder_id, fields):
             ret = [sb_json]
             app.logger.debug("Found by ScienceBase ID " + sb_json['id'])
         else:
             # For testing with copied communities
-            items = find_items_by_identifier(COPY_SBID, sb_json['id'], base_folder_id)
+            items = find_items_by_identifier(COPY_SBID, sb_json['id'], base_folder_id, fields)
             if len(items) > 0:
                 ret = items
 
     # If it wasn't found by ID in the community, search for it by alternate identifier    
     if len(ret) == 0:
-        for id_type, id_key in get_identifiers(sb_json).items():
-            if id_key:
-                app.logger.debug("Looking by identifier %s: %s" % (id_type, id_key))
-                items = find_items_by_identifier(id_type, id_key, base_folder_id)
-                if len(items) > 0:
-                    ret = items
-                    break
+        ret = find_items_by_identifiers(get_identifier_searches(sb_json), base_folder_id, fields)
+    return ret
+
+def get_identifier_searches(sb_json):
+    """Get the alternate identifiers to search for an Item by
+    :param sb_json: ScienceBase Item JSON
+    :return: List of (id_type, id_key), in order of precedence
+    """
+    return [(id_type, id_key) for id_type, id_key in get_identifiers(sb_json).items() if id_key]
+
+def find_items_by_identifiers(identifiers, community_id, fields='ancestors'):
+    """Find ScienceBase Items by the first of several alternate identifiers that matches. The searches run
+    concurrently, and the result is decided as soon as an identifier matches and every identifier before
+    it has not, so an unmatched record costs one round trip rather than one per identifier.
+    :param identifiers: List of (id_type, id_key), in order of precedence
+    :param community_id: Folder under which to search
+    :param fields: Fields to fetch for the items the community mirror finds
+    :return: ScienceBase Items JSON of the first identifier with a match, or an empty list
+    """
+    app.logger.debug("find_items_by_identifiers")
+    ret = []
+    if len(identifiers) <= 1:
+        return find_items_by_identifier(identifiers[0][0], identifiers[0][1], community_id, fields) if identifiers else ret
+    # An item the community mirror finds by several identifiers is fetched once
+    sb = get_sb_session(request)
+    mirrored = dict((item_id, get_mirrored_item(sb, item_id, fields)) for item_id in get_mirrored_item_ids(identifiers, community_id))
+    executor = ThreadPoolExecutor(max_workers=len(identifiers), thread_name_prefix='identifier')
+    try:
+        futures = [submit_with_request_context(executor, find_items_by_identifier, id_type, id_key, community_id, fields, mirrored) for id_type, id_key in identifiers]
+        for future in futures:
+            items = future.result()
+            if len(items) > 0:
+                ret = items
+                break
+    finally:
+        # Searches for lower precedence identifiers still running finish in the background, filling the identifier
+        # cache unless an upsert invalidates it first
+        executor.shutdown(wait=False, cancel_futures=True)
     return ret
 
 def get_identifiers(sb_json):
@@ -948,15 +2170,56 @@ def is_lcc_identifier(type_or_scheme):
         ret = id_regex.fullmatch(type_or_scheme) is not None
     return ret
 
-def find_items_by_identifier(id_type, id_key, community_id):
-    """Find ScienceBase Items by alternate identifier
+def find_items_by_identifier(id_type, id_key, community_id, fields='ancestors', fetched=None):
+    """Find ScienceBase Items by alternate identifier. Items found in the community mirror are fetched with
+    the caller's session to check them, so the mirror only saves the search.
     :param id_type: Type of ID
     :param id_key: Value of ID
     :param community_id: Folder under which to search
+    :param fields: Fields to fetch for the items the community mirror finds
+    :param fetched: Dict of Item ID to the get_mirrored_item result, for items the caller has already fetched
     :return: ScienceBase Items JSON
     """
     app.logger.debug("find_items_by_identifier")
-    ret = []
+    app.logger.debug("Looking by identifier %s: %s" % (id_type, id_key))
+    sb = get_sb_session(request)
+    ret = None
+    mirrored = find_mirrored_items(id_type, id_key, community_id)
+    if mirrored is not None:
+        fetched = fetched or {}
+        found = [fetched[item['id']] if item['id'] in fetched else get_mirrored_item(sb, item['id'], fields) for item in mirrored]
+        ret = check_mirrored_items(found, id_type, id_key, community_id)
+    fingerprint = get_token_fingerprint(get_request_token(request))
+    if ret is None:
+        ret = find_cached_items(id_type, id_key, community_id, fingerprint)
+    if ret is None:
+        generation = get_identifier_generation()
+        response = sb.find_items(get_identifier_query(id_type, id_key, community_id))
+        ret = identifier_search_done(id_type, id_key, community_id, response, fingerprint, generation)
+    return ret
+
+def find_cached_items(id_type, id_key, community_id, fingerprint):
+    """Find ScienceBase Items by alternate identifier in the identifier cache, among the searches made with
+    the same credentials, since a search only finds the items its caller can read
+    :param id_type: Type of ID
+    :param id_key: Value of ID
+    :param community_id: Folder under which to search
+    :param fingerprint: get_token_fingerprint of the caller's token
+    :return: ScienceBase Items JSON, or None if ScienceBase must be searched
+    """
+    cached = get_identifier_cache().get((fingerprint, id_type, id_key, community_id))
+    if cached is not None:
+        app.logger.debug("Identifier cache hit %s: %s" % (id_type, id_key))
+        return list(cached)
+    return None
+
+def get_identifier_query(id_type, id_key, community_id):
+    """Get the ScienceBase search for Items by alternate identifier
+    :param id_type: Type of ID
+    :param id_key: Value of ID
+    :param community_id: Folder under which to search
+    :return: Search parameters
+    """
     query = {
         'q':'', 
         'ancestors': community_id, 
@@ -965,42 +2228,495 @@ def find_items_by_identifier(id_type, id_key, community_id):
         query['lq'] = "id:%s" % (id_key)
     else:
         query['itemIdentifier'] = "{type:'%s',key:'%s'}" % (id_type, id_key)
-    response = get_sb_session(request).find_items(query)
+    return query
+
+def identifier_search_done(id_type, id_key, community_id, response, fingerprint, generation):
+    """Get the Items found by an identifier search, and cache them (including none found) for the caller,
+    unless the identifier cache was invalidated while the search ran: an item created, updated or deleted
+    meanwhile may not be in the results.
+    :param id_type: Type of ID
+    :param id_key: Value of ID
+    :param community_id: Folder searched
+    :param response: ScienceBase search response
+    :param fingerprint: get_token_fingerprint of the caller's token
+    :param generation: get_identifier_generation when the search started
+    :return: ScienceBase Items JSON
+    """
+    ret = []
     if 'total' in response and response['total'] > 0:
         ret = response['items']
         app.logger.debug("Found by identifier %s: %s" % (id_type, id_key))
+    with _identifier_lock:
+        if generation == _identifier_generation:
+            get_identifier_cache().put((fingerprint, id_type, id_key, community_id), list(ret))
+        else:
+            app.logger.debug("Identifier cache invalidated during search %s: %s" % (id_type, id_key))
     return ret
 
-def is_ancestor(item_id, folder_id):
+def get_identifier_generation():
+    """Get the number of identifier cache invalidations so far, to pass to identifier_search_done
+    :return: Invalidation count
+    """
+    return _identifier_generation
+
+def get_identifier_cache():
+    """Get the cache of identifier search results
+    :return: Identifier cache
+    """
+    global _identifier_cache
+    if _identifier_cache is None:
+        _identifier_cache = TTLCache(app.config['IDENTIFIER_CACHE_SIZE'], app.config['IDENTIFIER_CACHE_TTL'])
+    return _identifier_cache
+
+def invalidate_identifier_cache(items):
+    """Drop cached identifier searches that may have changed because the given items were created,
+    updated or deleted: searches by any caller for any of their identifiers, and searches that returned them
+    :param items: ScienceBase Item JSON of the changed items
+    """
+    app.logger.debug("invalidate_identifier_cache")
+    item_ids = set()
+    identifiers = set()
+    for item in items:
+        if item and item.get('id'):
+            item_ids.add(item['id'])
+            for id_type in SB_IDENTIFIERS + [COPY_SBID]:
+                identifiers.add((id_type, item['id']))
+        identifiers.update(get_identifiers(item).items())
+
+    def is_stale(key, value):
+        return key[1:3] in identifiers or any(found.get('id') in item_ids for found in value)
+    global _identifier_generation
+    with _identifier_lock:
+        _identifier_generation += 1
+        get_identifier_cache().discard(is_stale)
+
+def is_ancestor(item_id, folder_id, fields='ancestors'):
     """Return whether the given Item is under the given Folder
     :param item_id: Item ID
     :param folder_id: Folder ID
+    :param fields: Fields to fetch if the ancestors are not cached, including ancestors
     :return: Whether the Item is under the Folder
     """
     app.logger.debug("is_ancestor")
-    ret = False
-    try:
-        item = get_sb_session(request).get_item(item_id, {'fields':ITEM_FIELDS})     
-        ret = folder_id in item['ancestors']
-    except:
-        # Either it does not exist in ScienceBase or we don't have access
-        ret = False
+    ancestors = get_ancestors(item_id, fields)
+    ret = ancestors is not None and folder_id in ancestors
     app.logger.debug("is_ancestor %s %s %s" % (item_id, folder_id, str(ret)))
     return ret
 
-def get_delete_ids(sb, item_id, delete_self):
-    """Get list of Item IDs to delete in order to delete the given Item
+def get_ancestor_cache():
+    """Get the cache of item ancestors
+    :return: Ancestor cache
+    """
+    global _ancestor_cache
+    if _ancestor_cache is None:
+        _ancestor_cache = TTLCache(app.config['ANCESTOR_CACHE_SIZE'], app.config['ANCESTOR_CACHE_TTL'])
+    return _ancestor_cache
+
+def invalidate_ancestor_cache(item_ids):
+    """Drop the cached ancestors, for every caller, of Items that moved or were deleted and of their descendants
+    :param item_ids: Item IDs
+    """
+    app.logger.debug("invalidate_ancestor_cache")
+    item_ids = set(item_ids)
+    get_ancestor_cache().discard(lambda key, value: key[1] in item_ids or not item_ids.isdisjoint(value))
+
+def get_ancestors(item_id, fields='ancestors'):
+    """Get the IDs of the ancestors of the given Item
+    :param item_id: Item ID
+    :param fields: Fields to fetch if the ancestors are not cached, including ancestors
+    :return: List of ancestor IDs, or None if the Item does not exist or we don't have access
+    """
+    app.logger.debug("get_ancestors")
+    fingerprint = get_token_fingerprint(get_request_token(request))
+    ret = get_known_ancestors(item_id, fingerprint)
+    if ret is None:
+        try:
+            ret = get_sb_item(get_sb_session(request), item_id, fields)['ancestors']
+            get_ancestor_cache().put((fingerprint, item_id), ret)
+        except:
+            # Either it does not exist in ScienceBase or we don't have access
+            ret = None
+    return ret
+
+def get_known_ancestors(item_id, fingerprint):
+    """Get the IDs of the ancestors of the given Item from the ancestor cache, as fetched with the caller's
+    credentials. The community mirror is not used: only fetching the Item shows that the caller can read it
+    and that it is still there.
+    :param item_id: Item ID
+    :param fingerprint: Token fingerprint of the caller (get_token_fingerprint)
+    :return: List of ancestor IDs, or None if the Item must be fetched
+    """
+    return get_ancestor_cache().get((fingerprint, item_id))
+
+def get_community_mirror():
+    """Get the local mirror of the LC Map community
+    :return: CommunityMirror, or None if COMMUNITY_MIRROR_PATH is not set
+    """
+    global _community_mirror
+    if _community_mirror is None and app.config['COMMUNITY_MIRROR_PATH']:
+        _community_mirror = mirror.CommunityMirror(app.config['COMMUNITY_MIRROR_PATH'], app.config['LC_MAP_ID'])
+    return _community_mirror
+
+def get_current_community_mirror(folder_id):
+    """Get the community mirror if it can answer lookups under a folder: it has been refreshed within
+    COMMUNITY_MIRROR_MAX_AGE seconds, and holds the folder. Starts a refresh if one is due.
+    :param folder_id: Folder ID
+    :return: CommunityMirror, or None
+    """
+    community_mirror = get_community_mirror()
+    if community_mirror is None:
+        return None
+    refreshed = community_mirror.get_refreshed()
+    if is_community_mirror_due(refreshed) and has_request_context():
+        start_community_mirror_refresh(get_sb_session(request))
+    if refreshed is None or time.time() - refreshed > app.config['COMMUNITY_MIRROR_MAX_AGE']:
+        return None
+    return community_mirror if community_mirror.covers(folder_id) else None
+
+def is_community_mirror_due(refreshed):
+    """Return whether the community mirror should be loaded or refreshed
+    :param refreshed: Time of the last load or refresh, or None
+    """
+    return refreshed is None or time.time() - refreshed > app.config['COMMUNITY_MIRROR_REFRESH']
+
+def start_community_mirror_refresh(sb):
+    """Load or refresh the community mirror in the background, unless that is already under way in this
+    process or was attempted less than COMMUNITY_MIRROR_REFRESH seconds ago. refresh_community_mirror
+    checks for other processes.
+    :param sb: sciencebasepy session to search the community with
+    """
+    global _community_mirror_attempted
+    community_mirror = get_community_mirror()
+    if community_mirror is None or not _community_mirror_lock.acquire(blocking=False):
+        return
+    if time.time() - _community_mirror_attempted < app.config['COMMUNITY_MIRROR_REFRESH'] or not is_community_mirror_due(community_mirror.get_refreshed()):
+        _community_mirror_lock.release()
+        return
+    _community_mirror_attempted = time.time()
+    threading.Thread(target=refresh_community_mirror, args=(community_mirror, sb), name='community-mirror', daemon=True).start()
+
+def refresh_community_mirror(community_mirror, sb):
+    """Load the community mirror if it has not been loaded for COMMUNITY_MIRROR_RELOAD seconds, or else
+    apply the items updated since it was last refreshed. Nothing is done while another process holds the
+    mirror's lease, or if that process has just refreshed it. Releases the community mirror lock.
+    :param community_mirror: CommunityMirror
     :param sb: sciencebasepy session
+    """
+    lease = ('%d:%d:%f' % (os.getpid(), threading.get_ident(), time.time()), app.config['COMMUNITY_MIRROR_LEASE'])
+    try:
+        if not community_mirror.acquire_lease(*lease):
+            app.logger.debug('Community mirror is being refreshed by another process')
+            return
+        if not is_community_mirror_due(community_mirror.get_refreshed()):
+            return
+        loaded = community_mirror.get_meta('loaded')
+        if loaded is None or time.time() - loaded > app.config['COMMUNITY_MIRROR_RELOAD']:
+            community_mirror.load(sb, lease=lease)
+        else:
+            community_mirror.refresh(sb, lease=lease)
+    except Exception as e:
+        # Lookups go to ScienceBase until the mirror is refreshed
+        app.logger.warning(u"Unable to refresh the community mirror: {0}".format(e).encode('ascii','ignore').decode('ascii'))
+    finally:
+        community_mirror.release_lease(lease[0])
+        _community_mirror_lock.release()
+
+def find_mirrored_items(id_type, id_key, folder_id):
+    """Find items under a folder by identifier in the community mirror. The mirror may be out of date and
+    may hold items the caller cannot read, so the items are only candidates for check_mirrored_items, and
+    items it does not hold may still exist.
+    :param id_type: Type of ID
+    :param id_key: Value of ID
+    :param folder_id: Folder under which to search
+    :return: Items JSON, or None if the mirror has none or cannot answer
+    """
+    community_mirror = get_current_community_mirror(folder_id)
+    if community_mirror is None:
+        return None
+    if id_type in SB_IDENTIFIERS:
+        items = community_mirror.find_item_by_id(id_key)
+    else:
+        items = community_mirror.find_items(id_type, id_key)
+    if items is None:
+        return None
+    return [item for item in items if folder_id in item['ancestors']] or None
+
+def get_mirrored_item_ids(identifiers, folder_id):
+    """Get the IDs of the items the community mirror finds under a folder by any of several identifiers
+    :param identifiers: List of (id_type, id_key)
+    :param folder_id: Folder under which to search
+    :return: List of Item IDs
+    """
+    ret = []
+    for id_type, id_key in identifiers:
+        for item in find_mirrored_items(id_type, id_key, folder_id) or []:
+            if item['id'] not in ret:
+                ret.append(item['id'])
+    return ret
+
+def get_mirror_check_fields(fields):
+    """Get the fields to fetch an item found in the community mirror with
+    :param fields: Comma separated fields the caller will use next
+    :return: Comma separated fields, including those check_mirrored_items needs
+    """
+    ret = fields.split(',') if fields else []
+    return ','.join(ret + [field for field in ['identifiers', 'ancestors'] if field not in ret])
+
+def get_mirrored_item(sb, item_id, fields):
+    """Fetch an item found in the community mirror, with the caller's session
+    :param sb: SbSession
+    :param item_id: Item ID
+    :param fields: Comma separated fields the caller will use next
+    :return: ScienceBase Item JSON, or None if it does not exist or the caller has no access
+    """
+    try:
+        return get_sb_item(sb, item_id, get_mirror_check_fields(fields))
+    except Exception:
+        return None
+
+def check_mirrored_items(found, id_type, id_key, folder_id):
+    """Check the items found in the community mirror as fetched from ScienceBase. Items that have left the
+    community are removed from the mirror.
+    :param found: ScienceBase Item JSON of each item found in the mirror, None for one that could not be fetched
+    :param id_type: Type of ID
+    :param id_key: Value of ID
+    :param folder_id: Folder under which to search
+    :return: The items, or None if any could not be fetched, is no longer under the folder or no longer has
+    the identifier, and ScienceBase must be searched
+    """
+    ret = []
+    for item in found:
+        if item is None:
+            return None
+        ancestors = item.get('ancestors') or []
+        if app.config['LC_MAP_ID'] not in ancestors:
+            get_community_mirror().delete_items([item['id']])
+        if folder_id not in ancestors:
+            return None
+        if id_type not in SB_IDENTIFIERS and (id_type, str(id_key)) not in mirror.get_identifier_pairs(item):
+            return None
+        ret.append(item)
+    app.logger.debug("Community mirror found %s: %s" % (id_type, id_key))
+    return ret
+
+def get_sb_item(sb, item_id, fields=None):
+    """Get the given fields of a ScienceBase Item, memoized for the current publish
+    :param sb: SbSession
+    :param item_id: Item ID
+    :param fields: Comma separated fields, or None for the whole Item
+    :return: ScienceBase Item JSON
+    """
+    app.logger.debug("get_sb_item")
+    memo = get_item_memo()
+    ret = find_memoized_item(memo, item_id, fields)
+    if ret is None:
+        ret = sb.get_item(item_id, {'fields': fields} if fields else None)
+        memoize_item(memo, item_id, fields, ret)
+        ret = copy.deepcopy(ret)
+    return ret
+
+def get_item_memo():
+    """Get the memo of Items fetched during the current publish. Threads publishing related items run in a
+    copy of the context variables, which holds the same memo, so they share it too.
+    :return: Dict of (Item ID, fields) to Item JSON, fields None for a whole Item, or None outside of a publish
+    """
+    return item_memo.get()
+
+@contextlib.contextmanager
+def memoize_items():
+    """Memoize the Items fetched with get_sb_item within a publish. The memo is dropped when the publish
+    ends, so a batch only holds the Items of the records in progress.
+    """
+    token = item_memo.set({})
+    try:
+        yield
+    finally:
+        item_memo.reset(token)
+
+def find_memoized_item(memo, item_id, fields):
+    """Find an Item in a memo. An Item fetched with more fields (or whole) answers a request for fewer.
+    :param memo: Item memo
+    :param item_id: Item ID
+    :param fields: Comma separated fields, or None for the whole Item
+    :return: Copy of the ScienceBase Item JSON with only the requested fields, or None if not memoized
+    """
+    if not memo:
+        return None
+    wanted = get_memo_fields(fields)
+    for (memo_id, memo_fields), item in list(memo.items()):
+        if memo_id != item_id:
+            continue
+        if memo_fields is None and wanted is None:
+            return copy.deepcopy(item)
+        if wanted is not None and (memo_fields is None or wanted <= memo_fields):
+            # Keep what ScienceBase returns whatever the fields requested, such as the ID and link
+            return copy.deepcopy({key: value for key, value in item.items() if key in wanted or key == 'id' or (memo_fields is not None and key not in memo_fields)})
+    return None
+
+def memoize_item(memo, item_id, fields, item):
+    """Add an Item to a memo
+    :param memo: Item memo, or None
+    :param item_id: Item ID
+    :param fields: Comma separated fields the Item was fetched with, or None for the whole Item
+    :param item: ScienceBase Item JSON
+    """
+    if memo is not None:
+        memo[(item_id, get_memo_fields(fields))] = item
+
+def get_memo_fields(fields):
+    """Get the item memo key for comma separated fields
+    :param fields: Comma separated fields, or None for the whole Item
+    :return: Frozen set of fields, or None
+    """
+    return frozenset(fields.split(',')) if fields else None
+
+def forget_item(memo, item_id):
+    """Drop an Item that has changed from a memo
+    :param memo: Item memo, or None
     :param item_id: Item ID
-    :param delete_self: True to include the Item in the list, False to only include children
     """
-    app.logger.debug('get_delete_ids')
-    items_to_delete = []
-    for child_id in sb.get_child_ids(item_id):
-        items_to_delete.extend(get_delete_ids(sb, child_id, True))
-    if delete_self:
-        items_to_delete.append(item_id)
-    return items_to_delete
+    if memo:
+        for key in [key for key in list(memo) if key[0] == item_id]:
+            memo.pop(key, None)
+
+def get_ancestors_for_items(item_ids):
+    """Get the ancestors of many Items, fetching any that are not cached with a single search
+    :param item_ids: Item IDs
+    :return: Dict of Item ID to list of ancestor IDs. Items that were not found are left out.
+    """
+    app.logger.debug("get_ancestors_for_items")
+    cache = get_ancestor_cache()
+    fingerprint = get_token_fingerprint(get_request_token(request))
+    ret = {}
+    missing = []
+    for item_id in set(item_ids):
+        ancestors = get_known_ancestors(item_id, fingerprint)
+        if ancestors is None:
+            missing.append(item_id)
+        else:
+            ret[item_id] = ancestors
+    if missing:
+        try:
+            response = get_sb_session(request).find_items({'lq': 'id:(%s)' % ' OR '.join(missing), 'fields': 'ancestors', 'max': len(missing)})
+            for item in response.get('items', []):
+                if 'ancestors' in item:
+                    cache.put((fingerprint, item['id']), item['ancestors'])
+                    ret[item['id']] = item['ancestors']
+        except Exception as e:
+            # Callers fall back to fetching each item with get_ancestors
+            app.logger.warning(u"Unable to search for ancestors: {0}".format(e).encode('ascii','ignore').decode('ascii'))
+    return ret
+
+def filter_descendants(item_ids, folder_id):
+    """Get the given Items that are under the given Folder
+    :param item_ids: Item IDs
+    :param folder_id: Folder ID
+    :return: Set of the Item IDs under the Folder
+    """
+    app.logger.debug("filter_descendants")
+    ancestors = get_ancestors_for_items(item_ids)
+    ret = set()
+    for item_id in set(item_ids):
+        item_ancestors = ancestors[item_id] if item_id in ancestors else get_ancestors(item_id)
+        if item_ancestors is not None and folder_id in item_ancestors:
+            ret.add(item_id)
+    return ret
+
+def get_descendant_parents(sb, item_id):
+    """Get the descendants of an Item (excluding linked items) with a paged search
+    :param sb: sciencebasepy session
+    :param item_id: Item ID
+    :return: Dict of descendant Item ID to parent ID
+    """
+    app.logger.debug('get_descendant_parents')
+    ret = {}
+    items = sb.find_items({'filter': 'ancestorsExcludingLinks=' + item_id, 'fields': 'parentId', 'max': sb._max_item_count})
+    while items and 'items' in items:
+        for item in items['items']:
+            ret[item['id']] = item.get('parentId')
+        items = sb.next(items)
+    return ret
+
+def get_delete_levels(sb, item_id):
+    """Get the Item and its descendants grouped by depth, deepest first, so each level can be deleted
+    in parallel once the level below it is gone
+    :param sb: sciencebasepy session
+    :param item_id: Item ID
+    :return: List of lists of Item IDs
+    """
+    app.logger.debug('get_delete_levels')
+    parents = get_descendant_parents(sb, item_id)
+    depths = {item_id: 0}
+    for descendant_id in parents:
+        chain = []
+        current = descendant_id
+        while current not in depths and current in parents:
+            chain.append(current)
+            current = parents[current]
+        if current not in depths:
+            # The search results are incomplete, walk the tree instead
+            return get_delete_levels_by_traversal(sb, item_id)
+        depth = depths[current]
+        for chain_id in reversed(chain):
+            depth += 1
+            depths[chain_id] = depth
+
+    levels = [[] for i in range(max(depths.values()) + 1)]
+    for level_item_id, depth in depths.items():
+        levels[depth].append(level_item_id)
+    levels.reverse()
+    return levels
+
+def get_delete_levels_by_traversal(sb, item_id):
+    """Get the Item and its descendants grouped by depth, deepest first, looking up the children of
+    each level concurrently
+    :param sb: sciencebasepy session
+    :param item_id: Item ID
+    :return: List of lists of Item IDs
+    """
+    app.logger.debug('get_delete_levels_by_traversal')
+    levels = [[item_id]]
+    with ThreadPoolExecutor(max_workers=app.config['DELETE_WORKERS'], thread_name_prefix='delete') as executor:
+        while levels[-1]:
+            levels.append([child_id for child_ids in executor.map(sb.get_child_ids, levels[-1]) for child_id in child_ids])
+    levels.pop()
+    levels.reverse()
+    return levels
+
+def delete_tree(sb, item_id):
+    """Delete an Item and its descendants. Each level of the tree, deepest first, is deleted in chunks of
+    DELETE_CHUNK_SIZE items sent in parallel. Deletion stops at the first level that fails.
+    :param sb: sciencebasepy session
+    :param item_id: Item ID
+    :return: Delete JSON with the deleted IDs and progress, and an error if the tree was not fully deleted
+    """
+    app.logger.debug('delete_tree')
+    levels = get_delete_levels(sb, item_id)
+    chunk_size = app.config['DELETE_CHUNK_SIZE']
+    deleted = []
+    progress = {'total': sum(len(level) for level in levels), 'levels': len(levels), 'chunks': 0}
+    ret = {'deleted': deleted, 'progress': progress}
+
+    with ThreadPoolExecutor(max_workers=app.config['DELETE_WORKERS'], thread_name_prefix='delete') as executor:
+        for level in levels:
+            chunks = [level[i:i + chunk_size] for i in range(0, len(level), chunk_size)]
+            futures = [(chunk, executor.submit(sb.delete_items, chunk)) for chunk in chunks]
+            failed = False
+            for chunk, future in futures:
+                try:
+                    future.result()
+                    deleted.extend(chunk)
+                    progress['chunks'] += 1
+                except Exception as e:
+                    failed = True
+                    app.logger.error(u"Unable to delete {0}: {1}".format(chunk, e).encode('ascii','ignore').decode('ascii'))
+            app.logger.info('Deleted %d of %d items under %s' % (len(deleted), progress['total'], item_id))
+            report_job_progress(dict(progress, deleted=len(deleted)))
+            if failed:
+                ret['error'] = 'Unable to delete %s' % item_id
+                break
+    progress['deleted'] = len(deleted)
+    return ret
 
 def delete_item(item_id, browseCategory = None):
     """Delete the Item
@@ -1018,11 +2734,14 @@ def delete_item(item_id, browseCategory = None):
     elif browseCategory is not None and ('browseCategories' not in item or browseCategory not in item['browseCategories']):
         ret = {'error': 'Item %s not correct type, %s browse category not found' % (item_id, browseCategory)}
     else:
-        delete_ids = get_delete_ids(sb, item_id, True)
-        if sb.delete_items(delete_ids):
-            ret = {'deleted': delete_ids}
-        else:
-            ret = {'error': 'Unable to delete %s' % item_id}
+        ret = delete_tree(sb, item_id)
+        delete_ids = ret['deleted']
+        invalidate_identifier_cache([{'id': delete_id} for delete_id in delete_ids])
+        invalidate_ancestor_cache(delete_ids)
+        for delete_id in delete_ids:
+            get_link_cache().pop(delete_id)
+        if get_community_mirror() is not None:
+            get_community_mirror().delete_items(delete_ids)
     return ret
 
 
@@ -1040,8 +2759,24 @@ def geojson_to_sb_extent(md_json):
                     if 'geographicElement' in geographicExtent:
                         for element in geographicExtent['geographicElement']:
                             features.extend(get_features(element))
+    if features:
+        features = reduce_extent(features)
     return features
 
+def reduce_extent(features):
+    """Round, simplify and add bounding boxes to extent features, as configured, logging the size before and after
+    :param features: GeoJSON features, which are not modified
+    :return: Reduced GeoJSON features, or the features themselves if no reduction is configured
+    """
+    app.logger.debug('reduce_extent')
+    if app.config['EXTENT_PRECISION'] is None and not app.config['EXTENT_SIMPLIFY_TOLERANCE'] and app.config['EXTENT_MAX_VERTICES'] is None:
+        return features
+    ret, before, after = geometry.reduce_features(features, app.config['EXTENT_SIMPLIFY_TOLERANCE'],
+                                                  app.config['EXTENT_PRECISION'], app.config['EXTENT_MAX_VERTICES'])
+    app.logger.info('Extent reduced from %d positions (%d bytes) to %d positions (%d bytes)' %
+                    (before, len(jsoncodec.dumpb(features)), after, len(jsoncodec.dumpb(ret))))
+    return ret
+
 def get_features(geographic_element):
     """Get geospatial features from geojson geographic element
     :param geographic_element: Geographic element
@@ -1058,8 +2793,10 @@ def get_features(geographic_element):
         features.extend(geographic_element['features'])
     for extent in features:
         if 'id' in extent:
-            extent['properties']['name'] = extent['id']
-            del(extent['id'])
+            # Copy rather than modify the feature, so the mdJSON published is what was posted
+            extent = dict(extent)
+            extent['properties'] = dict(extent.get('properties') or {})
+            extent['properties']['name'] = extent.pop('id')
         if extent['geometry']['type'] != 'GeometryCollection':
             ret.append(extent)
     return ret
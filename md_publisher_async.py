@@ -0,0 +1,644 @@
+""" md_publisher_async.py serves the md-publisher publish endpoints from an asyncio event loop through ASGI.
+
+POST /project, POST /product, PUT /project/<item_id> and PUT /product/<item_id> run the publish pipeline
+(translate, find, merge, upload, link) with async HTTP clients, overlapping the independent remote calls of
+each publish, so one process can serve many concurrent publishes. All other requests are passed through to
+the Flask application. Run with an ASGI server, e.g.
+
+    gunicorn -k uvicorn.workers.UvicornWorker -b :5000 md_publisher_async:application
+"""
+from asgiref.wsgi import WsgiToAsgi
+from sciencebasepy import SbSession
+import asyncio
+import copy
+import httpx
+import jsoncodec
+import re
+import sys
+import time
+import traceback
+import urllib.parse
+import md_publisher
+import metrics
+from md_publisher import app
+
+PUBLISH_PATH = re.compile(r'^/(?:project|product)(?:/([^/]+))?/?$')
+
+_client = None
+_sb_urls = None
+
+_wsgi_application = WsgiToAsgi(app)
+
+async def application(scope, receive, send):
+    """ASGI entry point
+    :param scope: ASGI connection scope
+    :param receive: ASGI receive channel
+    :param send: ASGI send channel
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http':
+        m = PUBLISH_PATH.match(scope['path'])
+        if m and ((scope['method'] == 'POST' and not m.group(1)) or (scope['method'] == 'PUT' and m.group(1))) and not is_job_request(scope):
+            await publish(scope, receive, send, m.group(1))
+            return
+    await _wsgi_application(scope, receive, send)
+
+def is_job_request(scope):
+    """Return whether the client asked for a background job, which md_publisher runs
+    :param scope: ASGI connection scope
+    :return: True to run as a job
+    """
+    args = dict(urllib.parse.parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    headers = dict((name.decode('latin-1').lower(), value.decode('latin-1')) for name, value in scope.get('headers', []))
+    return md_publisher.is_job_request(args, headers)
+
+async def lifespan(receive, send):
+    """Handle ASGI lifespan events, closing the HTTP client on shutdown"""
+    global _client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _client is not None:
+                await _client.aclose()
+                _client = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def publish(scope, receive, send, item_id):
+    """Create or update a ScienceBase Item from the posted mdJSON and send the API response
+    :param scope: ASGI connection scope
+    :param receive: ASGI receive channel
+    :param send: ASGI send channel
+    :param item_id: ID of the ScienceBase Item to update, or None to create or find it
+    """
+    app.logger.debug('publish')
+    start = time.perf_counter()
+    # Record metrics under the endpoint names the Flask application uses
+    endpoint = '%s_%s' % ('update' if item_id else 'create', scope['path'].strip('/').split('/')[0])
+    metrics.current_endpoint.set(endpoint)
+    timings = []
+    metrics.current_timings.set(timings)
+    try:
+        md = get_mdjson(await read_body(receive))
+        sb = AsyncSbSession(get_client(), await get_auth_headers(md), md_publisher.get_token_fingerprint(md_publisher.get_token(md)))
+        await start_community_mirror_refresh(md)
+        ret = await create_or_update_item(sb, md, item_id)
+        # Match the Flask API: lists of items are wrapped in a message
+        ret_json = ret if isinstance(ret, dict) else {'message': [ret]}
+        status_code = md_publisher.get_response_status(ret_json)
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        status_code, ret_json = md_publisher.get_error_json(e)
+
+    body = jsoncodec.dumpb(ret_json)
+    seconds = time.perf_counter() - start
+    metrics.observe_request(endpoint, status_code, seconds)
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('ascii')),
+        (b'access-control-allow-origin', b'*'),
+        (b'server-timing', metrics.server_timing(timings, seconds).encode('utf-8'))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def read_body(receive):
+    """Read the request body
+    :param receive: ASGI receive channel
+    :return: Request body
+    """
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+def get_mdjson(body):
+    """Get the posted data, the same way as md_publisher.get_mdjson
+    :param body: Request body
+    :return: Posted data
+    """
+    ret = {}
+    try:
+        request_json = jsoncodec.loads(body) if body else None
+    except ValueError:
+        request_json = None
+    if request_json:
+        if 'data' in request_json:
+            ret = request_json['data']
+        else:
+            ret = request_json
+    return ret
+
+def get_client():
+    """Get the async HTTP client shared by all publishes in this process
+    :return: httpx AsyncClient
+    """
+    global _client
+    if _client is None:
+        limits = httpx.Limits(max_connections=app.config['ASYNC_HTTP_MAX_CONNECTIONS'], max_keepalive_connections=app.config['ASYNC_HTTP_MAX_CONNECTIONS'])
+        _client = httpx.AsyncClient(limits=limits, timeout=app.config['ASYNC_HTTP_TIMEOUT'], headers={'Accept': 'application/json'})
+    return _client
+
+async def get_auth_headers(md):
+    """Get the ScienceBase authorization headers for the tokens posted with the request
+    :param md: Posted data
+    :return: Headers dict
+    """
+    token = md_publisher.get_token(md)
+    if not token:
+        return {}
+    # Sessions come from md_publisher's per-token pool. Keycloak token handling is synchronous
+    # in sciencebasepy, so run it off the event loop.
+    sb = await asyncio.to_thread(md_publisher.get_pooled_sb_session, token)
+    return {'authorization': sb._session.headers['authorization']}
+
+async def start_community_mirror_refresh(md):
+    """Start loading or refreshing md_publisher's community mirror if it is due, with the sciencebasepy
+    session for the tokens posted with the request
+    :param md: Posted data
+    """
+    community_mirror = md_publisher.get_community_mirror()
+    if community_mirror is not None and md_publisher.is_community_mirror_due(community_mirror.get_refreshed()):
+        sb = await asyncio.to_thread(md_publisher.get_pooled_sb_session, md_publisher.get_token(md))
+        md_publisher.start_community_mirror_refresh(sb)
+
+class AsyncSbSession(object):
+    """The ScienceBase calls made by the publish path, over an async HTTP client. Responses are checked
+    the same way sciencebasepy checks them, so errors are reported identically.
+    """
+
+    def __init__(self, client, headers, fingerprint=None):
+        """
+        :param client: httpx AsyncClient
+        :param headers: Authorization headers for this request
+        :param fingerprint: md_publisher.get_token_fingerprint of the tokens, keying the lookups cached for them
+        """
+        global _sb_urls
+        if _sb_urls is None:
+            _sb_urls = SbSession(app.config['SCIENCEBASE_ENV'])
+        self._client = client
+        self._headers = headers
+        self.fingerprint = fingerprint
+        self._urls = _sb_urls
+        # Items fetched during this request, as md_publisher.get_sb_item memoizes them
+        self.items = {}
+
+    async def _request(self, method, url, **kwargs):
+        """Send a request, recording it in md_publisher's metrics"""
+        start = time.perf_counter()
+        r = None
+        try:
+            r = await self._client.request(method, url, headers=self._headers, **kwargs)
+            return r
+        finally:
+            md_publisher.record_remote_call(md_publisher.get_sciencebase_operation(method, url), time.perf_counter() - start,
+                                            r is None or r.status_code >= 400, md_publisher.get_request_size(kwargs), len(r.content) if r is not None else 0)
+
+    async def _get_json(self, url, params=None):
+        r = await self._request('GET', url, params=params)
+        return self._urls._get_json(r)
+
+    async def get_item(self, item_id, params=None):
+        fields = (params or {}).get('fields')
+        if not fields:
+            return await self._get_json(self._urls._base_item_url + item_id, params)
+        ret = md_publisher.find_memoized_item(self.items, item_id, fields)
+        if ret is None:
+            ret = await self._get_json(self._urls._base_item_url + item_id, params)
+            md_publisher.memoize_item(self.items, item_id, fields, ret)
+            ret = copy.deepcopy(ret)
+        return ret
+
+    async def find_items(self, params):
+        return await self._get_json(self._urls._base_items_url, params)
+
+    async def get_item_links(self, item_id):
+        return await self._get_json(self._urls._base_item_link_url + item_id)
+
+    async def get_item_link_types(self):
+        response = await self._get_json(self._urls._base_sb_url.replace('catalog', 'vocab') + '4f4e475de4b07f02db47decc/terms')
+        return response['list'] if response and 'list' in response else []
+
+    async def create_item_link(self, from_item_id, to_item_id, link_type_id, reverse=False):
+        item_link_json = {'itemLinkTypeId': link_type_id, 'itemId': from_item_id, 'relatedItemId': to_item_id}
+        if reverse:
+            item_link_json['reverseRelationship'] = True
+        r = await self._request('POST', self._urls._base_item_link_url, content=jsoncodec.dumpb(item_link_json))
+        return self._urls._get_json(r)
+
+    async def upload_and_upsert_item(self, files, data):
+        r = await self._request('POST', self._urls._base_upload_file_url, files=files, data=data, params={'scrapeFile': 'false'})
+        return self._urls._get_json(r)
+
+    async def update_item(self, item_json):
+        r = await self._request('PUT', self._urls._base_item_url + item_json['id'], content=jsoncodec.dumpb(item_json))
+        return self._urls._get_json(r)
+
+    async def download(self, url, max_bytes):
+        ret = bytearray()
+        start = time.perf_counter()
+        error = True
+        try:
+            async with self._client.stream('GET', url, headers=self._headers) as r:
+                r.raise_for_status()
+                async for chunk in r.aiter_bytes():
+                    ret += chunk
+                    if len(ret) > max_bytes:
+                        raise ValueError('%s is larger than %d bytes' % (url, max_bytes))
+            error = False
+        finally:
+            md_publisher.record_remote_call(md_publisher.get_sciencebase_operation('GET', url), time.perf_counter() - start, error, 0, len(ret))
+        return ret
+
+async def translate_json(source_json, destination_format = None, source_text = None):
+    """Translate JSON through the mdTranslator, sharing md_publisher's translation cache and retrying
+    the same way as md_publisher.get_session
+    :param source_json: Source JSON
+    :param destination_format: Destination format
+    :param source_text: canonical_json of the source JSON, if the caller has serialized it
+    :return: Translated JSON, or an error message
+    """
+    app.logger.debug('translate_json')
+    # The translation cache may read from and write to disk, so use it off the event loop
+    options, cache_key, cached = await asyncio.to_thread(md_publisher.get_cached_translation, source_json, destination_format, source_text)
+    if cached is not None:
+        return cached
+
+    timeout = md_publisher.get_translator_timeout()
+    operation = md_publisher.get_translator_operation('POST', app.config['MDTRANSLATOR_URL'], {'data': options})
+    for retry in range(app.config['TRANSLATOR_RETRIES'] + 1):
+        if retry:
+            await asyncio.sleep(md_publisher.get_translator_retry_delay(retry))
+        start = time.perf_counter()
+        r = None
+        try:
+            r = await get_client().post(app.config['MDTRANSLATOR_URL'], data=options, timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+        except httpx.TransportError as e:
+            app.logger.warning('mdTranslator request failed: %s' % e)
+            if retry == app.config['TRANSLATOR_RETRIES']:
+                return {'error': {'messages': ['mdTranslator request failed: %s' % e]}}
+            continue
+        finally:
+            md_publisher.record_remote_call(operation, time.perf_counter() - start, r is None or r.status_code >= 400,
+                                            md_publisher.get_request_size({'data': options}), len(r.content) if r is not None else 0)
+        if r.status_code not in app.config['TRANSLATOR_RETRY_STATUS']:
+            break
+    ret = md_publisher.read_translator_response(r.status_code, r.text, options['writer'])
+    await asyncio.to_thread(md_publisher.cache_translation, cache_key, ret)
+    return ret
+
+async def translate_mdjson_to_sbjson(md_json, md_text):
+    """Translate mdJSON to sbJSON according to SBJSON_TRANSLATOR, as md_publisher.translate_mdjson_to_sbjson does
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON
+    :return: sbJSON, or an error message
+    """
+    native = await asyncio.to_thread(md_publisher.translate_natively, md_json)
+    remote = await translate_json(md_json, None, md_text) if md_publisher.needs_remote_sbjson(native) else None
+    return await asyncio.to_thread(md_publisher.choose_sbjson, md_json, native, remote)
+
+def start_iso_translations(md_json, md_text):
+    """Start translating mdJSON to ISO 19115-1 and ISO 19115-2
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON
+    :return: Dict of metadata file name to translation Task
+    """
+    return {
+        app.config['ISO1_FILENAME']: asyncio.ensure_future(translate_json(md_json, md_publisher.ISO_19115_1, md_text)),
+        app.config['ISO2_FILENAME']: asyncio.ensure_future(translate_json(md_json, md_publisher.ISO_19115_2, md_text))
+    }
+
+async def get_iso_translation(fname, task):
+    """Wait for an ISO translation to finish
+    :param fname: Name of the metadata file being generated
+    :param task: Translation Task
+    :return: ISO XML, or None if the translation failed
+    """
+    ret = None
+    try:
+        ret = await task
+        if isinstance(ret, dict) and 'error' in ret:
+            app.logger.error('Unable to generate %s: %s' % (fname, str(ret['error'].get('messages'))))
+            ret = None
+    except Exception as e:
+        app.logger.error(u'Unable to generate {0}: {1}'.format(fname, e).encode('ascii','ignore').decode('ascii'))
+    return ret
+
+def cancel_iso_translations(iso_translations):
+    if iso_translations:
+        for task in iso_translations.values():
+            task.cancel()
+
+async def create_or_update_item(sb, md, item_id = None):
+    """Create or update the ScienceBase Item from mdJSON, and any related products concurrently
+    :param sb: AsyncSbSession
+    :param md: Posted data
+    :param item_id: ID of the ScienceBase Item to update
+    :return: Resulting ScienceBase Item JSON
+    """
+    app.logger.debug('create_or_update_item')
+    if 'mdjson' not in md:
+        return {"error": {"messages":["mdjson is required"]}}
+
+    parent_id, community_id, orphan_project_folder_id, orphan_product_folder_id, force = md_publisher.get_publish_options(md)
+    item = await create_or_update_sbitem_from_mdjson(sb, item_id, parent_id, md['mdjson'], community_id, orphan_project_folder_id, orphan_product_folder_id, force)
+    ret = item
+    if 'error' not in item and md.get('relationships'):
+        semaphore = asyncio.Semaphore(app.config['RELATIONSHIP_WORKERS'])
+
+        async def publish_related_item(related_item):
+            async with semaphore:
+                try:
+                    product_item = await create_or_update_sbitem_from_mdjson(sb, None, item['id'], related_item, community_id, orphan_project_folder_id, orphan_product_folder_id, force)
+                    if 'error' not in product_item:
+                        await link_items(sb, item['id'], product_item['id'], await get_item_link_type_id(sb, 'productOf'), True)
+                    return product_item
+                except Exception as e:
+                    traceback.print_exc(file=sys.stdout)
+                    return md_publisher.get_error_json(e)[1]
+
+        ret = [item]
+        ret.extend(await asyncio.gather(*[publish_related_item(related_item) for related_item in md['relationships']]))
+    return ret
+
+async def create_or_update_sbitem_from_mdjson(sb, item_id, parent_id, md_json, base_folder_id, orphan_project_folder_id, orphan_product_folder_id, force):
+    """Create or update the specified ScienceBase item from the given mdJSON, with the decisions of
+    md_publisher.create_or_update_sbitem_from_mdjson
+    :return: ScienceBase Item JSON of the resulting Item
+    """
+    app.logger.debug("create_or_update_sbitem_from_mdjson")
+    ret = {"error":{"messages": []}}
+    # Serialize the mdJSON once for the translations, the unchanged check and the upload
+    md_text = await asyncio.to_thread(md_publisher.canonical_json, md_json)
+    iso_translations = start_iso_translations(md_json, md_text) if force else None
+    sb_json = md_publisher.prepare_sbjson(md_json, await translate_mdjson_to_sbjson(md_json, md_text), item_id)
+    if 'error' in sb_json:
+        cancel_iso_translations(iso_translations)
+        return sb_json
+
+    sb_found_record = await find_sb_items(sb, sb_json, base_folder_id, md_publisher.get_found_item_fields(force, sb_json))
+    error = md_publisher.get_found_items_error(sb_json, sb_found_record, item_id)
+    if error:
+        cancel_iso_translations(iso_translations)
+        return error
+
+    messages = []
+    errors = []
+    sb_item = None
+    create_or_update = True
+    if len(sb_found_record) == 1:
+        messages.append(md_publisher.get_found_item_message(sb_json))
+        exist_sb_id = str(sb_found_record[0]['id'])
+        if not force:
+            sb_item = await sb.get_item(exist_sb_id, {'fields': md_publisher.CHECK_FIELDS})
+            if await is_mdjson_unchanged(sb, sb_item, md_json, md_text):
+                create_or_update = False
+                messages.append(md_publisher.get_unchanged_message(exist_sb_id))
+        if create_or_update:
+            sb_item = await sb.get_item(exist_sb_id, {'fields': md_publisher.get_item_fields(sb_json)})
+    if create_or_update:
+        # Reducing the extents and merging are CPU bound, so run them off the event loop
+        sb_json = await asyncio.to_thread(md_publisher.build_sbjson, sb_json, sb_item, md_json, messages)
+        sb_json['parentId'] = parent_id if parent_id else await get_parent_id(sb, md_json, sb_json, base_folder_id, orphan_project_folder_id, orphan_product_folder_id)
+
+        response = await upsert_item_and_upload_metadata(sb, sb_json, md_json, md_text, iso_translations)
+        if not 'error' in response:
+            sb_json = response
+            await create_associated_links(sb, sb_json['id'], md_json, base_folder_id)
+            ret = sb_json
+        else:
+            errors.extend(md_publisher.get_response_errors(response))
+
+    return md_publisher.get_publish_result(ret, messages, errors)
+
+async def is_mdjson_unchanged(sb, item, md_json, md_text):
+    """Return whether the mdJSON is the same as that last published to the ScienceBase Item, downloading
+    the attached mdJSON for md_publisher.is_mdjson_unchanged if the Item has no mdJSON hash
+    :param sb: AsyncSbSession
+    :param item: ScienceBase Item JSON, with identifiers and files
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON
+    :return: True if the mdJSON has not changed
+    """
+    md_open = None
+    sbfile = md_publisher.get_unhashed_mdjson_file(item)
+    if sbfile:
+        try:
+            md_open = jsoncodec.loads(await sb.download(sbfile['url'], app.config['MDJSON_MAX_BYTES']))
+        except Exception:
+            app.logger.error('Failed to parse attached mdJSON')
+            return False
+    return await asyncio.to_thread(md_publisher.is_mdjson_unchanged, item, md_json, md_open, md_text)
+
+async def upsert_item_and_upload_metadata(sb, item, md_json, md_text, iso_translations = None):
+    """Create or update a ScienceBase Item, and upload metadata files to it
+    :param sb: AsyncSbSession
+    :param item: ScienceBase Item JSON
+    :param md_json: mdJSON
+    :param md_text: canonical_json of the mdJSON
+    :param iso_translations: ISO translations already started, if any
+    :return: Updated ScienceBase Item JSON
+    """
+    app.logger.debug('upsert_item_and_upload_metadata')
+    if iso_translations is None:
+        iso_translations = start_iso_translations(md_json, md_text)
+    iso1_fname = app.config['ISO1_FILENAME']
+    iso2_fname = app.config['ISO2_FILENAME']
+    iso1, iso2 = await asyncio.gather(get_iso_translation(iso1_fname, iso_translations[iso1_fname]), get_iso_translation(iso2_fname, iso_translations[iso2_fname]))
+    existing = await get_existing_item(sb, item)
+    # Staging hashes the files and serializes the item, so run it off the event loop
+    action, files, data = await asyncio.to_thread(md_publisher.plan_upsert, item, md_text, iso1, iso2, existing)
+    try:
+        if action == 'upload':
+            ret = await sb.upload_and_upsert_item(files, data)
+        elif action == 'update':
+            ret = await sb.update_item(item)
+        else:
+            ret = existing
+        if action:
+            # Updates the community mirror in SQLite
+            await asyncio.to_thread(md_publisher.item_upserted, item, ret)
+            md_publisher.forget_item(sb.items, ret.get('id'))
+    except Exception as e:
+        msg = md_publisher.get_upsert_error(item, files)
+        app.logger.error(msg)
+        ret = {"error": {"messages": [msg, "{0}".format(e)]}}
+    return ret
+
+async def get_existing_item(sb, item):
+    """Get the Item to be updated as it is on ScienceBase, as md_publisher.get_existing_item does
+    :return: ScienceBase Item JSON, or None for a new Item or if it could not be fetched
+    """
+    if not item.get('id'):
+        return None
+    try:
+        return await sb.get_item(item['id'], {'fields': md_publisher.get_item_fields(item)})
+    except Exception as e:
+        app.logger.warning(u'Unable to get %s, uploading all metadata: {0}'.format(e) % item['id'])
+        return None
+
+async def get_parent_id(sb, md_json, sb_json, base_folder_id, orphan_project_folder_id, orphan_product_folder_id):
+    """Get the ScienceBase Item parent ID, as md_publisher.get_parent_id does
+    :return: Appropriate parent ID
+    """
+    app.logger.debug("get_parent_id")
+    if sb_json and sb_json.get('parentId') and await is_ancestor(sb, sb_json['parentId'], base_folder_id):
+        return sb_json['parentId']
+    search_item = md_publisher.get_parent_project_search(md_json)
+    if search_item:
+        result = await find_sb_items(sb, search_item, base_folder_id)
+        if result:
+            return result[0]['id']
+    return md_publisher.get_orphan_folder_id(md_json, orphan_project_folder_id, orphan_product_folder_id)
+
+async def find_sb_items(sb, sb_json, base_folder_id, fields='ancestors'):
+    """Find items by ID or by a list of identifiers. The identifier searches run concurrently, and the
+    first identifier (in get_identifiers order) with a match wins, as in md_publisher.find_items_by_identifiers.
+    :param sb: AsyncSbSession
+    :param sb_json: ScienceBase Item JSON
+    :param base_folder_id: ID of the folder under which to search
+    :param fields: Fields to fetch with the ancestors of an item found by ID or in the community mirror
+    :return: List of matching items
+    """
+    app.logger.debug("find_sb_items")
+    ret = []
+    if sb_json.get('id'):
+        if await is_ancestor(sb, sb_json['id'], base_folder_id, fields):
+            ret = [sb_json]
+        else:
+            ret = await find_items_by_identifier(sb, md_publisher.COPY_SBID, sb_json['id'], base_folder_id, fields)
+
+    if len(ret) == 0:
+        identifiers = md_publisher.get_identifier_searches(sb_json)
+        # An item the community mirror finds by several identifiers is fetched once
+        item_ids = await asyncio.to_thread(md_publisher.get_mirrored_item_ids, identifiers, base_folder_id)
+        fetched = dict(zip(item_ids, await asyncio.gather(*[get_mirrored_item(sb, item_id, fields) for item_id in item_ids])))
+        tasks = [asyncio.ensure_future(find_items_by_identifier(sb, id_type, id_key, base_folder_id, fields, fetched))
+                 for id_type, id_key in identifiers]
+        try:
+            for task in tasks:
+                items = await task
+                if len(items) > 0:
+                    ret = items
+                    break
+        finally:
+            # The result is decided, so lower precedence searches still running are not needed
+            for task in tasks:
+                task.cancel()
+    return ret
+
+async def find_items_by_identifier(sb, id_type, id_key, community_id, fields='ancestors', fetched=None):
+    """Find ScienceBase Items by alternate identifier, sharing md_publisher's community mirror and identifier
+    cache. Items found in the mirror are fetched to check them, as in md_publisher.find_items_by_identifier.
+    :param fields: Fields to fetch for the items the community mirror finds
+    :param fetched: Dict of Item ID to the get_mirrored_item result, for items the caller has already fetched
+    :return: ScienceBase Items JSON
+    """
+    ret = None
+    # The community mirror is read from and written to SQLite, so use it off the event loop
+    mirrored = await asyncio.to_thread(md_publisher.find_mirrored_items, id_type, id_key, community_id)
+    if mirrored is not None:
+        fetched = fetched or {}
+        found = await asyncio.gather(*[fetch_mirrored_item(sb, item['id'], fields, fetched) for item in mirrored])
+        ret = await asyncio.to_thread(md_publisher.check_mirrored_items, found, id_type, id_key, community_id)
+    if ret is None:
+        ret = md_publisher.find_cached_items(id_type, id_key, community_id, sb.fingerprint)
+    if ret is None:
+        generation = md_publisher.get_identifier_generation()
+        response = await sb.find_items(md_publisher.get_identifier_query(id_type, id_key, community_id))
+        ret = md_publisher.identifier_search_done(id_type, id_key, community_id, response, sb.fingerprint, generation)
+    return ret
+
+async def get_mirrored_item(sb, item_id, fields):
+    """Fetch an item found in the community mirror, as md_publisher.get_mirrored_item does
+    :return: ScienceBase Item JSON, or None if it does not exist or the caller has no access
+    """
+    try:
+        return await sb.get_item(item_id, {'fields': md_publisher.get_mirror_check_fields(fields)})
+    except Exception:
+        return None
+
+async def fetch_mirrored_item(sb, item_id, fields, fetched):
+    """Get an item found in the community mirror from those already fetched, or else fetch it
+    :return: ScienceBase Item JSON, or None if it does not exist or the caller has no access
+    """
+    if item_id in fetched:
+        return fetched[item_id]
+    return await get_mirrored_item(sb, item_id, fields)
+
+async def is_ancestor(sb, item_id, folder_id, fields='ancestors'):
+    """Return whether the given Item is under the given Folder, sharing md_publisher's ancestor cache
+    :param fields: Fields to fetch if the ancestors are not cached, including ancestors
+    :return: Whether the Item is under the Folder
+    """
+    ancestors = md_publisher.get_known_ancestors(item_id, sb.fingerprint)
+    if ancestors is None:
+        try:
+            ancestors = (await sb.get_item(item_id, {'fields': fields}))['ancestors']
+            md_publisher.get_ancestor_cache().put((sb.fingerprint, item_id), ancestors)
+        except Exception:
+            # Either it does not exist in ScienceBase or we don't have access
+            return False
+    return folder_id in ancestors
+
+async def create_associated_links(sb, sb_item_id, md_json, base_folder_id):
+    """Create the associated Item Links concurrently
+    :param sb: AsyncSbSession
+    :param sb_item_id: The ScienceBase ID of the item to link from
+    :param md_json: mdJSON containing association information
+    :param base_folder_id: Items must exist under the given folder
+    :return: List of error messages
+    """
+    app.logger.debug("create_associated_links")
+    resource_type = md_publisher.get_resource_type(md_json)
+
+    async def create_link(association_type, associated_resource_ids):
+        try:
+            await create_item_link(sb, association_type, resource_type, sb_item_id, associated_resource_ids, base_folder_id)
+        except Exception as e:
+            return md_publisher.get_link_error(association_type, sb_item_id, associated_resource_ids, e)
+
+    links = [create_link(association_type, associated_resource_ids) for association_type, associated_resource_ids in md_publisher.get_associations(md_json)]
+    return [msg for msg in await asyncio.gather(*links) if msg]
+
+async def create_item_link(sb, association_type, resource_type, parent_item_id, child_item_ids, base_folder_id):
+    """Create an item link, as md_publisher.create_item_link does
+    :return: ScienceBase ItemLink JSON
+    """
+    child_items = await find_sb_items(sb, md_publisher.get_child_search_item(child_item_ids), base_folder_id)
+    if len(child_items) == 0:
+        app.logger.info("Child not found %s" % (str(child_item_ids)))
+        return None
+    link_type, reverse = md_publisher.get_link_type(association_type, resource_type)
+    if link_type:
+        return await link_items(sb, parent_item_id, child_items[0]['id'], await get_item_link_type_id(sb, link_type), reverse)
+    return None
+
+async def get_item_link_type_id(sb, name):
+    """Get the ID of an ItemLink type, sharing md_publisher's ItemLink types
+    :param sb: AsyncSbSession
+    :param name: ItemLink type name
+    :return: ItemLink type ID
+    """
+    if not md_publisher._item_link_types:
+        md_publisher.set_item_link_types(await sb.get_item_link_types())
+    return md_publisher._item_link_types[name]
+
+async def link_items(sb, parent_item_id, child_item_id, item_link_type_id, reverse):
+    """Create an item link between the given items unless it already exists, sharing md_publisher's link index
+    :return: ScienceBase ItemLink JSON, or None if the link already existed
+    """
+    link_key = md_publisher.get_link_key(parent_item_id, child_item_id, item_link_type_id, reverse)
+    link_keys = md_publisher.get_link_cache().get(link_key[0])
+    if link_keys is None:
+        link_keys = md_publisher.set_link_keys(link_key[0], await sb.get_item_links(link_key[0]))
+    if link_key in link_keys:
+        return None
+    ret = await sb.create_item_link(parent_item_id, child_item_id, item_link_type_id, reverse)
+    md_publisher.link_created(link_key)
+    return ret
@@ -0,0 +1,308 @@
+""" metrics.py provides counters and latency histograms for md-publisher, rendered in the Prometheus text
+exposition format, and Server-Timing summaries of the remote calls made by a request """
+import bisect
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Endpoint and Server-Timing list of the current request, for code that runs outside a Flask request
+# context (the asyncio publish path)
+current_endpoint = contextvars.ContextVar('current_endpoint', default=None)
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_store = None
+
+class Counter(object):
+    """Thread-safe counter with labels"""
+
+    def __init__(self, name, documentation, labelnames):
+        """
+        :param name: Metric name
+        :param documentation: Metric help text
+        :param labelnames: Label names
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, labels, amount=1):
+        """Increment the counter
+        :param labels: Tuple of label values
+        :param amount: Amount to add
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        """:return: Dict of label values tuple to a list of the counter value"""
+        with self._lock:
+            return {labels: [value] for labels, value in self._values.items()}
+
+    def render(self, values=None):
+        """
+        :param values: Values to render, as returned by snapshot(), or None for this process's
+        :return: List of exposition lines
+        """
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+        if values is None:
+            values = self.snapshot()
+        for labels, value in sorted(values.items()):
+            lines.append('%s%s %s' % (self.name, format_labels(self.labelnames, labels), format_value(value[0])))
+        return lines
+
+class Histogram(object):
+    """Thread-safe histogram with labels"""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        """
+        :param name: Metric name
+        :param documentation: Metric help text
+        :param labelnames: Label names
+        :param buckets: Upper bounds of the buckets, in increasing order
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, labels, value):
+        """Record an observation
+        :param labels: Tuple of label values
+        :param value: Observed value
+        """
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Bucket counts, then the sum and count of all observations
+                counts = self._values[labels] = [0] * (len(self.buckets) + 3)
+            counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        """:return: Dict of label values tuple to a list of the bucket counts, sum and count"""
+        with self._lock:
+            return {labels: list(counts) for labels, counts in self._values.items()}
+
+    def render(self, values=None):
+        """
+        :param values: Values to render, as returned by snapshot(), or None for this process's
+        :return: List of exposition lines
+        """
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        if values is None:
+            values = self.snapshot()
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(self.labelnames + ('le',), labels + (format_value(bound),)), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(self.labelnames, labels), format_value(counts[-2])))
+            lines.append('%s_count%s %d' % (self.name, format_labels(self.labelnames, labels), counts[-1]))
+        return lines
+
+class MetricsStore(object):
+    """Metric values stored in a SQLite database, so /metrics in any process (e.g. gunicorn worker) on the
+    same host reports the totals of all of them. Each process writes its values every flush interval and
+    before rendering. The values of processes that have exited are kept, so the totals never go backwards.
+    """
+
+    def __init__(self, path, interval, timeout=5.0):
+        """
+        :param path: Path of the SQLite database file
+        :param interval: Seconds between writes of this process's values
+        :param timeout: Seconds to wait on a database locked by another process
+        """
+        self.path = path
+        self.interval = interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._process = None
+        self._written = {}
+
+    def _connection(self):
+        """Get the SQLite connection for the current thread, creating the metrics table if needed"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS metrics (process TEXT NOT NULL, name TEXT NOT NULL, labels TEXT NOT NULL, '
+                         'value TEXT NOT NULL, PRIMARY KEY (process, name, labels))')
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Start writing this process's values every flush interval, once per process (a forked worker
+        starts its own)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Process IDs are reused, so each process writes under an ID of its own
+            self._process = uuid.uuid4().hex
+            self._written = {}
+            self._pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's values that changed since the last write"""
+        self.start()
+        rows = []
+        with self._lock:
+            for metric in _metrics:
+                for labels, value in metric.snapshot().items():
+                    key = (metric.name, json.dumps(labels))
+                    if self._written.get(key) != value:
+                        rows.append((key, value))
+            if not rows:
+                return
+            try:
+                conn = self._connection()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.executemany('INSERT OR REPLACE INTO metrics (process, name, labels, value) VALUES (?, ?, ?, ?)',
+                                     [(self._process,) + key + (json.dumps(value),) for key, value in rows])
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+            except sqlite3.Error as e:
+                # Metrics are best effort; the next flush writes them again
+                logger.warning('Metrics store write failed: %s' % e)
+                return
+            self._written.update(rows)
+
+    def read(self):
+        """Read the values of every process, summed
+        :return: Dict of metric name to a dict of label values tuple to the summed values
+        """
+        ret = {}
+        for name, labels, value in self._connection().execute('SELECT name, labels, value FROM metrics'):
+            values = ret.setdefault(name, {})
+            labels = tuple(json.loads(labels))
+            value = json.loads(value)
+            total = values.get(labels)
+            values[labels] = value if total is None else [a + b for a, b in zip(total, value)]
+        return ret
+
+def set_store(path, interval):
+    """Share the metric values of the processes on this host through a SQLite database
+    :param path: Path of the SQLite database file, or None to report only this process's values
+    :param interval: Seconds between writes of each process's values
+    """
+    global _store
+    _store = MetricsStore(path, interval) if path else None
+
+def format_labels(labelnames, labels):
+    if not labelnames:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for name, value in zip(labelnames, labels))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+REMOTE_CALLS = Counter('md_publisher_remote_calls_total', 'Remote calls made to ScienceBase and the mdTranslator.', ('operation', 'endpoint'))
+REMOTE_CALL_ERRORS = Counter('md_publisher_remote_call_errors_total', 'Remote calls that failed or returned an HTTP error.', ('operation', 'endpoint'))
+REMOTE_CALL_BYTES = Counter('md_publisher_remote_call_bytes_total', 'Bytes sent and received by remote calls.', ('operation', 'endpoint', 'direction'))
+REMOTE_CALL_SECONDS = Histogram('md_publisher_remote_call_seconds', 'Remote call latency.', ('operation', 'endpoint'))
+REQUESTS = Counter('md_publisher_requests_total', 'Requests served.', ('endpoint', 'status'))
+REQUEST_SECONDS = Histogram('md_publisher_request_seconds', 'Request latency.', ('endpoint',))
+
+def observe_remote_call(operation, endpoint, seconds, error=False, sent=0, received=0, timings=None):
+    """Record a remote call
+    :param operation: Operation name, e.g. sciencebase.get_item
+    :param endpoint: Endpoint of the request that made the call
+    :param seconds: Latency of the call
+    :param error: Whether the call failed
+    :param sent: Bytes sent
+    :param received: Bytes received
+    :param timings: Server-Timing list of the request, if any
+    """
+    if _store is not None:
+        _store.start()
+    labels = (operation, endpoint)
+    REMOTE_CALLS.inc(labels)
+    if error:
+        REMOTE_CALL_ERRORS.inc(labels)
+    if sent:
+        REMOTE_CALL_BYTES.inc(labels + ('sent',), sent)
+    if received:
+        REMOTE_CALL_BYTES.inc(labels + ('received',), received)
+    REMOTE_CALL_SECONDS.observe(labels, seconds)
+    if timings is not None:
+        # list.append is atomic, so concurrent calls of one request can share the list without a lock
+        timings.append((operation, seconds))
+
+def observe_request(endpoint, status, seconds):
+    """Record a served request
+    :param endpoint: Endpoint name
+    :param status: HTTP status code
+    :param seconds: Latency of the request
+    """
+    if _store is not None:
+        _store.start()
+    REQUESTS.inc((endpoint, str(status)))
+    REQUEST_SECONDS.observe((endpoint,), seconds)
+
+def server_timing(timings, total=None):
+    """Summarize a request's remote calls as a Server-Timing header value. Concurrent calls overlap, so
+    an operation's duration can exceed the total.
+    :param timings: List of (operation, seconds)
+    :param total: Total request seconds, if known
+    :return: Server-Timing header value
+    """
+    durations = {}
+    for operation, seconds in list(timings):
+        duration = durations.setdefault(operation, [0, 0.0])
+        duration[0] += 1
+        duration[1] += seconds
+    ret = ['%s;dur=%.1f;desc="%d calls"' % (operation, seconds * 1000, count) for operation, (count, seconds) in sorted(durations.items())]
+    if total is not None:
+        ret.append('total;dur=%.1f' % (total * 1000))
+    return ', '.join(ret)
+
+def render():
+    """Render all metrics in the Prometheus text exposition format, totalled over the processes sharing
+    the store, if any
+    :return: Metrics text
+    """
+    stored = None
+    if _store is not None:
+        _store.flush()
+        try:
+            stored = _store.read()
+        except sqlite3.Error as e:
+            logger.warning('Metrics store read failed, rendering this process only: %s' % e)
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render(None if stored is None else stored.get(metric.name, {})))
+    return '\n'.join(lines) + '\n'
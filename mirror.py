@@ -0,0 +1,382 @@
+""" mirror.py keeps a local index of the items of a ScienceBase community (ID, parent, ancestors, identifiers,
+browse categories and last update), so md-publisher can answer identifier and ancestry lookups without
+searching ScienceBase """
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dateutil import parser
+
+logger = logging.getLogger(__name__)
+
+# Fields fetched for each mirrored item
+MIRROR_FIELDS = 'parentId,ancestors,identifiers,browseCategories,provenance'
+
+# Seconds before the newest update seen that an incremental refresh reads back to, in case ScienceBase
+# commits updates out of timestamp order
+REFRESH_OVERLAP = 60
+
+class LeaseLost(Exception):
+    """Another process has taken over loading or refreshing the mirror"""
+
+class CommunityMirror(object):
+    """Items under a community folder, stored in a SQLite database so all processes (e.g. gunicorn workers)
+    on the same host share one mirror. The mirror is bulk loaded with a paged search of the community, and
+    refreshed by reading back the most recently updated items. One process at a time loads or refreshes it,
+    holding a lease row in the meta table. Items md-publisher writes or deletes are applied to it directly.
+    Errors reading the database are logged and reported as "not mirrored", so callers fall back to ScienceBase.
+    """
+
+    def __init__(self, path, community_id, timeout=5.0):
+        """
+        :param path: Path of the SQLite database file
+        :param community_id: ID of the community folder to mirror
+        :param timeout: Seconds to wait on a database locked by another process
+        """
+        self.path = path
+        self.community_id = community_id
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        """Get the SQLite connection for the current thread, creating the tables if needed"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS items (id TEXT PRIMARY KEY, parent_id TEXT, ancestors TEXT NOT NULL, '
+                         'browse_categories TEXT, last_updated REAL, generation INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS identifiers (type TEXT NOT NULL, key TEXT NOT NULL, item_id TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS identifiers_type_key ON identifiers (type, key)')
+            conn.execute('CREATE INDEX IF NOT EXISTS identifiers_item_id ON identifiers (item_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def get_meta(self, name, default=None):
+        """Get a mirror property: 'community_ancestors', 'generation', 'loaded', 'refreshed', 'last_updated' or 'lease'
+        :param name: Property name
+        :param default: Value if the property is not set
+        :return: Property value
+        """
+        row = self._connection().execute('SELECT value FROM meta WHERE name = ? ', (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, conn, name, value):
+        conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+
+    def acquire_lease(self, owner, seconds):
+        """Take or renew the lease to load or refresh the mirror, unless another owner holds it
+        :param owner: Unique name of the load or refresh
+        :param seconds: Seconds until the lease expires, if it is not renewed
+        :return: True if the lease is held by the owner
+        """
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                lease = self.get_meta('lease')
+                held = lease is not None and lease['owner'] != owner and lease['expires'] > now
+                if not held:
+                    self._set_meta(conn, 'lease', {'owner': owner, 'expires': now + seconds})
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning('Community mirror lease failed: %s' % e)
+            return False
+        return not held
+
+    def release_lease(self, owner):
+        """Release the lease, if the owner still holds it
+        :param owner: Unique name of the load or refresh
+        """
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                lease = self.get_meta('lease')
+                if lease is not None and lease['owner'] == owner:
+                    conn.execute("DELETE FROM meta WHERE name = 'lease'")
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning('Community mirror lease failed: %s' % e)
+
+    def _renew_lease(self, lease):
+        """Renew the lease between pages of a load or refresh
+        :param lease: Tuple of the owner and lease seconds, or None if the caller holds no lease
+        """
+        if lease is not None and not self.acquire_lease(*lease):
+            raise LeaseLost('Lease on the community mirror of %s lost' % self.community_id)
+
+    def get_refreshed(self):
+        """:return: Time of the last load or refresh, or None if the mirror has never been loaded"""
+        try:
+            return self.get_meta('refreshed')
+        except sqlite3.Error as e:
+            logger.warning('Community mirror read failed: %s' % e)
+            return None
+
+    def load(self, sb, page_size=1000, lease=None):
+        """Load every item in the community, replacing the items loaded before
+        :param sb: sciencebasepy session
+        :param page_size: Items fetched per search request
+        :param lease: Tuple of the owner and seconds of the lease held for the load, renewed after each page
+        :return: Number of items loaded
+        """
+        start = time.time()
+        community_ancestors = sb.get_item(self.community_id, {'fields': 'ancestors'}).get('ancestors', [])
+        conn = self._connection()
+        generation = self.get_meta('generation', 0) + 1
+        count = 0
+        newest = 0
+        items = sb.find_items({'ancestors': self.community_id, 'fields': MIRROR_FIELDS, 'max': page_size})
+        while items and items.get('items'):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for item in items['items']:
+                    newest = max(newest, self._put(conn, item, generation))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            count += len(items['items'])
+            self._renew_lease(lease)
+            items = sb.next(items)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Items not seen by this load have been deleted or moved out of the community. Items written by
+            # md-publisher during the load have no generation and a later update time, and are kept.
+            stale = 'generation < ? OR (generation IS NULL AND last_updated < ?)'
+            conn.execute('DELETE FROM identifiers WHERE item_id IN (SELECT id FROM items WHERE %s)' % stale, (generation, start))
+            conn.execute('DELETE FROM items WHERE %s' % stale, (generation, start))
+            now = time.time()
+            self._set_meta(conn, 'community_ancestors', community_ancestors)
+            self._set_meta(conn, 'generation', generation)
+            self._set_meta(conn, 'loaded', now)
+            self._set_meta(conn, 'refreshed', now)
+            self._set_meta(conn, 'last_updated', newest)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info('Community mirror of %s loaded: %d items in %.1f s' % (self.community_id, count, time.time() - start))
+        return count
+
+    def refresh(self, sb, page_size=100, lease=None):
+        """Apply the items updated since the last load or refresh, reading the community newest first
+        :param sb: sciencebasepy session
+        :param page_size: Items fetched per search request
+        :param lease: Tuple of the owner and seconds of the lease held for the refresh, renewed after each page
+        :return: Number of items updated
+        """
+        start = time.time()
+        conn = self._connection()
+        generation = self.get_meta('generation', 0)
+        last_updated = self.get_meta('last_updated', 0)
+        newest = last_updated
+        count = 0
+        done = False
+        items = sb.find_items({'ancestors': self.community_id, 'fields': MIRROR_FIELDS, 'sort': 'lastUpdated',
+                               'order': 'desc', 'max': page_size})
+        while not done and items and items.get('items'):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for item in items['items']:
+                    if get_last_updated(item) < last_updated - REFRESH_OVERLAP:
+                        done = True
+                        break
+                    newest = max(newest, self._put(conn, item, generation))
+                    count += 1
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            if not done:
+                self._renew_lease(lease)
+                items = sb.next(items)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._set_meta(conn, 'refreshed', time.time())
+            self._set_meta(conn, 'last_updated', newest)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        logger.debug('Community mirror of %s refreshed: %d items in %.3f s' % (self.community_id, count, time.time() - start))
+        return count
+
+    def _put(self, conn, item, generation):
+        """Store an item within a transaction
+        :param conn: SQLite connection
+        :param item: ScienceBase Item JSON with MIRROR_FIELDS
+        :param generation: Load generation, or None for an item written by md-publisher, whose update time is
+        the time it was written
+        :return: Last update time of the item
+        """
+        last_updated = get_last_updated(item) if generation is not None else time.time()
+        conn.execute('INSERT OR REPLACE INTO items (id, parent_id, ancestors, browse_categories, last_updated, generation) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', (item['id'], item.get('parentId'), ','.join(item.get('ancestors', [])),
+                                                   json.dumps(item.get('browseCategories', [])), last_updated, generation))
+        conn.execute('DELETE FROM identifiers WHERE item_id = ?', (item['id'],))
+        conn.executemany('INSERT INTO identifiers (type, key, item_id) VALUES (?, ?, ?)',
+                         [(id_type, key, item['id']) for id_type, key in get_identifier_pairs(item)])
+        return last_updated
+
+    def put_item(self, item):
+        """Apply an item md-publisher has created or updated. Its ancestors are taken from the item if present,
+        or else from its parent. An item that is not under the community is removed.
+        :param item: ScienceBase Item JSON
+        """
+        try:
+            conn = self._connection()
+            ancestors = item.get('ancestors')
+            if ancestors is None:
+                ancestors = self._get_ancestors(conn, item.get('parentId'))
+                if ancestors is not None:
+                    ancestors = [item['parentId']] + ancestors
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                old = self._get_ancestors(conn, item['id'])
+                if ancestors is None or self.community_id not in ancestors:
+                    self._delete(conn, [item['id']])
+                else:
+                    self._put(conn, dict(item, ancestors=ancestors), None)
+                    if old is not None and old != ancestors:
+                        self._move_descendants(conn, item['id'], ancestors)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning('Community mirror update failed: %s' % e)
+
+    def _move_descendants(self, conn, item_id, ancestors):
+        """Rewrite the ancestors of the descendants of an item that has moved
+        :param conn: SQLite connection
+        :param item_id: ID of the item that moved
+        :param ancestors: New ancestors of the item
+        """
+        rows = conn.execute("SELECT id, ancestors FROM items WHERE ',' || ancestors || ',' LIKE ?", ('%,' + item_id + ',%',)).fetchall()
+        for descendant_id, descendant_ancestors in rows:
+            descendant_ancestors = descendant_ancestors.split(',')
+            descendant_ancestors = descendant_ancestors[:descendant_ancestors.index(item_id) + 1] + ancestors
+            conn.execute('UPDATE items SET ancestors = ? WHERE id = ?', (','.join(descendant_ancestors), descendant_id))
+
+    def delete_items(self, item_ids):
+        """Remove items md-publisher has deleted
+        :param item_ids: Item IDs
+        """
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._delete(conn, item_ids)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning('Community mirror update failed: %s' % e)
+
+    def _delete(self, conn, item_ids):
+        conn.executemany('DELETE FROM identifiers WHERE item_id = ?', [(item_id,) for item_id in item_ids])
+        conn.executemany('DELETE FROM items WHERE id = ?', [(item_id,) for item_id in item_ids])
+
+    def get_ancestors(self, item_id):
+        """Get the ancestors of an item, or of the community folder itself
+        :param item_id: Item ID
+        :return: List of ancestor IDs, or None if the item is not mirrored
+        """
+        try:
+            return self._get_ancestors(self._connection(), item_id)
+        except sqlite3.Error as e:
+            logger.warning('Community mirror read failed: %s' % e)
+            return None
+
+    def _get_ancestors(self, conn, item_id):
+        if item_id == self.community_id:
+            return self.get_meta('community_ancestors')
+        row = conn.execute('SELECT ancestors FROM items WHERE id = ?', (item_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0].split(',') if row[0] else []
+
+    def covers(self, folder_id):
+        """Return whether the mirror holds every item under a folder: the community or a folder in it"""
+        return folder_id == self.community_id or self.get_ancestors(folder_id) is not None
+
+    def find_items(self, id_type, key):
+        """Find mirrored items by identifier, matching the identifier type or scheme, as ScienceBase does
+        :param id_type: Identifier type or scheme
+        :param key: Identifier key
+        :return: List of item JSON with id, parentId, ancestors and browseCategories, or None if the mirror
+        could not be read
+        """
+        try:
+            rows = self._connection().execute('SELECT DISTINCT items.id, parent_id, ancestors, browse_categories FROM identifiers '
+                                              'JOIN items ON items.id = identifiers.item_id WHERE type = ? AND key = ?', (id_type, key)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning('Community mirror read failed: %s' % e)
+            return None
+        return [get_item_json(row) for row in rows]
+
+    def find_item_by_id(self, item_id):
+        """Find a mirrored item by ID
+        :param item_id: Item ID
+        :return: List of the item JSON, empty if it is not mirrored, or None if the mirror could not be read
+        """
+        try:
+            row = self._connection().execute('SELECT id, parent_id, ancestors, browse_categories FROM items WHERE id = ?', (item_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning('Community mirror read failed: %s' % e)
+            return None
+        return [get_item_json(row)] if row else []
+
+    def stats(self):
+        """:return: Numbers of items and identifiers, and the load, refresh and newest update times"""
+        conn = self._connection()
+        return {'items': conn.execute('SELECT COUNT(*) FROM items').fetchone()[0],
+                'identifiers': conn.execute('SELECT COUNT(*) FROM identifiers').fetchone()[0],
+                'loaded': self.get_meta('loaded'), 'refreshed': self.get_meta('refreshed'),
+                'last_updated': self.get_meta('last_updated')}
+
+def get_item_json(row):
+    """Get item JSON from an items row"""
+    item_id, parent_id, ancestors, browse_categories = row
+    return {'id': item_id, 'parentId': parent_id, 'ancestors': ancestors.split(',') if ancestors else [],
+            'browseCategories': json.loads(browse_categories) if browse_categories else []}
+
+def get_identifier_pairs(item):
+    """Get the (type, key) pairs an item can be found by, for both the type and scheme of each identifier
+    :param item: ScienceBase Item JSON
+    :return: Set of (type, key)
+    """
+    ret = set()
+    for identifier in item.get('identifiers') or []:
+        if identifier.get('key') is None:
+            continue
+        for name in ('type', 'scheme'):
+            if identifier.get(name):
+                ret.add((identifier[name], str(identifier['key'])))
+    return ret
+
+def get_last_updated(item):
+    """Get the time an item was last updated
+    :param item: ScienceBase Item JSON
+    :return: Seconds since the epoch, or 0 if the item has no last update time
+    """
+    value = (item.get('provenance') or {}).get('lastUpdated')
+    if not value:
+        return 0
+    try:
+        return parser.isoparse(value).timestamp()
+    except ValueError:
+        return 0
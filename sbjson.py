@@ -0,0 +1,419 @@
+""" sbjson.py translates the subset of mdJSON that md-publisher publishes to sbJSON in-process, without
+a round trip to the mdTranslator. Records using mdJSON sections it does not cover raise UnsupportedMdJson,
+and should be translated by the mdTranslator instead.
+"""
+import geometry
+import json
+import re
+
+PROJECT_FACET = 'gov.sciencebase.catalog.item.facet.ProjectFacet'
+BUDGET_FACET = 'gov.sciencebase.catalog.item.facet.BudgetFacet'
+SB_NAMESPACE = 'gov.sciencebase.catalog'
+
+# mdJSON sections with content that is translated here, or that has no sbJSON equivalent
+SUPPORTED_MDJSON = ['schema', 'contact', 'metadata', 'metadataRepository', 'dataDictionary']
+SUPPORTED_METADATA = ['metadataInfo', 'resourceInfo', 'funding', 'associatedResource', 'resourceDistribution', 'additionalDocumentation']
+SUPPORTED_RESOURCE_INFO = ['citation', 'abstract', 'shortAbstract', 'purpose', 'status', 'resourceType', 'pointOfContact',
+                           'keyword', 'extent', 'timePeriod', 'constraint', 'defaultResourceLocale', 'supplementalInfo',
+                           'resourceMaintenance', 'resourceUsage']
+
+# ScienceBase contact types for the mdJSON role codes
+ROLES = {
+    'pointOfContact': 'Point of Contact',
+    'principalInvestigator': 'Principal Investigator',
+    'coPrincipalInvestigator': 'Co-Investigator',
+    'coAuthor': 'Co-Author',
+    'resourceProvider': 'Resource Provider',
+    'rightsHolder': 'Rights Holder',
+    'funder': 'Funding Agency'
+}
+
+# ScienceBase project statuses for the mdJSON progress codes
+PROJECT_STATUSES = {
+    'completed': 'Completed',
+    'onGoing': 'In Progress',
+    'planned': 'Proposed',
+    'proposed': 'Proposed',
+    'underDevelopment': 'In Progress',
+    'accepted': 'Proposed',
+    'funded': 'Approved',
+    'historicalArchive': 'Completed',
+    'obsolete': 'Completed'
+}
+
+class UnsupportedMdJson(Exception):
+    """The mdJSON uses sections this module does not translate"""
+    pass
+
+def translate(md_json):
+    """Translate mdJSON to sbJSON
+    :param md_json: mdJSON
+    :return: sbJSON
+    :raises UnsupportedMdJson: if the mdJSON has content this module does not translate
+    """
+    check_supported(md_json)
+    metadata = md_json['metadata']
+    metadata_info = metadata.get('metadataInfo', {})
+    resource_info = metadata['resourceInfo']
+    citation = resource_info.get('citation', {})
+    contacts = dict((contact.get('contactId'), contact) for contact in md_json.get('contact', []))
+
+    ret = {}
+    metadata_id = metadata_info.get('metadataIdentifier', {})
+    if metadata_id.get('namespace') == SB_NAMESPACE and metadata_id.get('identifier'):
+        ret['id'] = metadata_id['identifier']
+    set_value(ret, 'title', citation.get('title'))
+    set_value(ret, 'alternateTitles', citation.get('alternateTitle'))
+    set_value(ret, 'body', resource_info.get('abstract'))
+    set_value(ret, 'summary', resource_info.get('shortAbstract'))
+    set_value(ret, 'citation', get_citation(citation, contacts))
+    set_value(ret, 'identifiers', get_identifiers(citation, metadata_id))
+    set_value(ret, 'purpose', resource_info.get('purpose'))
+    set_value(ret, 'rights', get_rights(resource_info.get('constraint', [])))
+    set_value(ret, 'materialRequestInstructions', get_material_request(metadata.get('resourceDistribution', [])))
+    set_value(ret, 'parentId', get_parent_id(metadata_info.get('parentMetadata', {})))
+    set_value(ret, 'contacts', get_contacts(resource_info, contacts))
+    set_value(ret, 'webLinks', get_web_links(citation, metadata))
+    set_value(ret, 'browseCategories', get_browse_categories(resource_info.get('resourceType', [])))
+    set_value(ret, 'tags', get_tags(resource_info))
+    set_value(ret, 'dates', get_dates(citation, resource_info.get('timePeriod', {})))
+    set_value(ret, 'spatial', get_spatial(resource_info.get('extent', [])))
+    set_value(ret, 'facets', get_facets(metadata, contacts))
+    return ret
+
+def check_supported(md_json):
+    """Check that all content of the mdJSON is translated by this module
+    :param md_json: mdJSON
+    :raises UnsupportedMdJson: if it is not
+    """
+    if not isinstance(md_json, dict) or not isinstance(md_json.get('metadata', {}).get('resourceInfo'), dict):
+        raise UnsupportedMdJson('resourceInfo is required')
+    for section, value, supported in [
+            ('', md_json, SUPPORTED_MDJSON),
+            ('metadata.', md_json['metadata'], SUPPORTED_METADATA),
+            ('metadata.resourceInfo.', md_json['metadata']['resourceInfo'], SUPPORTED_RESOURCE_INFO)]:
+        unsupported = [section + key for key in value if value[key] and key not in supported]
+        if unsupported:
+            raise UnsupportedMdJson('Unsupported mdJSON: %s' % ', '.join(unsupported))
+
+def set_value(item, key, value):
+    """Set a value in the sbJSON, leaving out empty values as the mdTranslator does"""
+    if value or value is False or value == 0:
+        item[key] = value
+
+def get_citation(citation, contacts):
+    """Get the formatted citation, e.g. "Author Name, 2017-11-03(creation), Title" """
+    parts = []
+    for responsibility in citation.get('responsibleParty', []):
+        if responsibility.get('role') in ['author', 'originator', 'publisher']:
+            for party in responsibility.get('party', []):
+                name = contacts.get(party.get('contactId'), {}).get('name')
+                if name and name not in parts:
+                    parts.append(name)
+    for d in citation.get('date', []):
+        if d.get('date'):
+            parts.append('%s(%s)' % (d['date'][:10], d.get('dateType', '')))
+    if citation.get('title'):
+        parts.append(citation['title'])
+    return ', '.join(parts)
+
+def get_identifiers(citation, metadata_id):
+    """Get the sbJSON identifiers from the citation and metadata identifiers"""
+    ret = []
+    ids = list(citation.get('identifier', []))
+    if metadata_id.get('identifier') and metadata_id.get('namespace') != SB_NAMESPACE:
+        ids.append(metadata_id)
+    for identifier in ids:
+        if not identifier.get('identifier'):
+            continue
+        sb_id = {}
+        set_value(sb_id, 'type', identifier.get('description'))
+        set_value(sb_id, 'scheme', identifier.get('namespace'))
+        sb_id['key'] = identifier['identifier']
+        if sb_id not in ret:
+            ret.append(sb_id)
+    return ret
+
+def get_rights(constraints):
+    """Get the rights statement from the use and legal constraints"""
+    statements = []
+    for constraint in constraints:
+        statements.extend(constraint.get('useLimitation', []))
+        legal = constraint.get('legal', {})
+        statements.extend(legal.get('useConstraint', []))
+        statements.extend(legal.get('otherConstraint', []))
+    return '; '.join([s for s in statements if s]) or None
+
+def get_material_request(distributions):
+    """Get the material request instructions from the distributors' ordering instructions"""
+    instructions = []
+    for distribution in distributions:
+        for distributor in distribution.get('distributor', []):
+            for order_process in distributor.get('orderProcess', []):
+                if order_process.get('orderingInstructions'):
+                    instructions.append(order_process['orderingInstructions'])
+    return '; '.join(instructions) or None
+
+def get_parent_id(parent_metadata):
+    """Get the ScienceBase parent ID from the parent metadata citation"""
+    for identifier in parent_metadata.get('identifier', []):
+        if identifier.get('namespace') == SB_NAMESPACE:
+            return identifier.get('identifier')
+    return None
+
+def get_role(role):
+    """Get the ScienceBase contact type for an mdJSON role, e.g. pointOfContact -> Point of Contact"""
+    if not role or role in ROLES:
+        return ROLES.get(role, role)
+    if ' ' in role or not role[0].islower():
+        # Already a ScienceBase contact type
+        return role
+    words = re.sub(r'([A-Z])', r' \1', role).split()
+    return ' '.join([w.lower() if w.lower() in ['of', 'and'] else w.capitalize() for w in words])
+
+def get_contacts(resource_info, contacts):
+    """Get the sbJSON contacts for the resource points of contact and citation responsible parties"""
+    ret = []
+    responsibilities = resource_info.get('pointOfContact', []) + resource_info.get('citation', {}).get('responsibleParty', [])
+    for responsibility in responsibilities:
+        for party in responsibility.get('party', []):
+            contact = contacts.get(party.get('contactId'))
+            if contact:
+                sb_contact = get_contact(contact, responsibility.get('role'), contacts)
+                if sb_contact not in ret:
+                    ret.append(sb_contact)
+    return ret
+
+def get_contact(contact, role, contacts):
+    """Get the sbJSON contact for an mdJSON contact in the given role"""
+    ret = {}
+    set_value(ret, 'name', contact.get('name'))
+    set_value(ret, 'type', get_role(role))
+    ret['contactType'] = 'organization' if contact.get('isOrganization') else 'person'
+    set_value(ret, 'email', (contact.get('electronicMailAddress') or [None])[0])
+    set_value(ret, 'jobTitle', contact.get('positionName'))
+    set_value(ret, 'hours', '; '.join(contact.get('hoursOfService', [])))
+    organizations = [contacts[org_id]['name'] for org_id in contact.get('memberOfOrganization', []) if org_id in contacts and contacts[org_id].get('name')]
+    ret['organization'] = {'displayText': organizations[0]} if organizations else {}
+
+    location = {'streetAddress': {}, 'mailAddress': {}}
+    for phone in contact.get('phone', []):
+        services = phone.get('service') or ['voice']
+        if 'voice' in services and 'officePhone' not in location:
+            set_value(location, 'officePhone', phone.get('phoneNumber'))
+        if 'fax' in services and 'faxPhone' not in location:
+            set_value(location, 'faxPhone', phone.get('phoneNumber'))
+    for address in contact.get('address', []):
+        sb_address = get_address(address)
+        address_types = address.get('addressType', [])
+        if ('physical' in address_types or not address_types) and not location['streetAddress']:
+            location['streetAddress'] = sb_address
+        if 'mailing' in address_types and not location['mailAddress']:
+            location['mailAddress'] = sb_address
+    ret['primaryLocation'] = location
+    return ret
+
+def get_address(address):
+    """Get an sbJSON address"""
+    ret = {}
+    lines = address.get('deliveryPoint', [])
+    for i, line in enumerate(lines[:2]):
+        set_value(ret, 'line%d' % (i + 1), line)
+    set_value(ret, 'city', address.get('city'))
+    # Accept the common misspelling of administrativeArea
+    set_value(ret, 'state', address.get('administrativeArea', address.get('adminstrativeArea')))
+    set_value(ret, 'zip', address.get('postalCode'))
+    set_value(ret, 'country', address.get('country'))
+    return ret
+
+def get_web_links(citation, metadata):
+    """Get the sbJSON web links for the citation online resources and online distribution options"""
+    ret = []
+    for resource in citation.get('onlineResource', []):
+        if resource.get('uri'):
+            link = {'uri': resource['uri'], 'rel': 'related', 'hidden': False}
+            set_value(link, 'type', resource.get('function'))
+            set_value(link, 'title', resource.get('name') or resource.get('description'))
+            ret.append(link)
+    for distribution in metadata.get('resourceDistribution', []):
+        for distributor in distribution.get('distributor', []):
+            for transfer_option in distributor.get('transferOption', []):
+                for option in transfer_option.get('onlineOption', []):
+                    if option.get('uri'):
+                        link = {'uri': option['uri'], 'rel': 'related', 'type': 'download', 'hidden': False}
+                        set_value(link, 'title', option.get('name') or distribution.get('description'))
+                        ret.append(link)
+    return ret
+
+def get_browse_categories(resource_types):
+    """Get the ScienceBase browse categories for the resource types"""
+    ret = []
+    for resource_type in resource_types:
+        name = resource_type.get('type')
+        if name:
+            category = name[0].upper() + name[1:]
+            if category not in ret:
+                ret.append(category)
+    return ret
+
+def get_tags(resource_info):
+    """Get the sbJSON tags for the resource types, resource status and keywords"""
+    ret = []
+    for resource_type in resource_info.get('resourceType', []):
+        if resource_type.get('type'):
+            ret.append({'type': 'Resource Type', 'name': resource_type['type'][0].upper() + resource_type['type'][1:]})
+    for status in resource_info.get('status', []):
+        ret.append({'type': 'Status', 'name': status})
+    for keywords in resource_info.get('keyword', []):
+        thesaurus = keywords.get('thesaurus', {})
+        scheme = ([r['uri'] for r in thesaurus.get('onlineResource', []) if r.get('uri')] or [thesaurus.get('title')])[0]
+        for keyword in keywords.get('keyword', []):
+            if keyword.get('keyword'):
+                tag = {}
+                set_value(tag, 'type', keywords.get('keywordType'))
+                set_value(tag, 'scheme', scheme)
+                tag['name'] = keyword['keyword']
+                ret.append(tag)
+    unique = []
+    for tag in ret:
+        if tag not in unique:
+            unique.append(tag)
+    return unique
+
+def get_dates(citation, time_period):
+    """Get the sbJSON dates for the citation dates and resource time period"""
+    ret = []
+    for d in citation.get('date', []):
+        if d.get('date'):
+            ret.append({'type': d.get('dateType', ''), 'dateString': d['date'], 'label': d.get('description', '')})
+    for date_type, key in [('Start', 'startDateTime'), ('End', 'endDateTime')]:
+        if time_period.get(key):
+            ret.append({'type': date_type, 'dateString': time_period[key], 'label': time_period.get('description', '')})
+    return ret
+
+def get_spatial(extents):
+    """Get the sbJSON bounding box of all the extents' bounding boxes and geographic elements"""
+    boxes = []
+    for extent in extents:
+        for geographic_extent in extent.get('geographicExtent', []):
+            box = geographic_extent.get('boundingBox')
+            if box and all(k in box for k in ['westLongitude', 'eastLongitude', 'southLatitude', 'northLatitude']):
+                boxes.append(box)
+            for element in geographic_extent.get('geographicElement', []):
+                for west, south, east, north in get_element_boxes(element):
+                    boxes.append({'westLongitude': west, 'southLatitude': south, 'eastLongitude': east, 'northLatitude': north})
+    if not boxes:
+        return None
+    return {'boundingBox': {
+        'minX': min(b['westLongitude'] for b in boxes),
+        'maxX': max(b['eastLongitude'] for b in boxes),
+        'minY': min(b['southLatitude'] for b in boxes),
+        'maxY': max(b['northLatitude'] for b in boxes)}}
+
+def get_element_boxes(element):
+    """Get the bounding boxes of the geometries of a GeoJSON geographic element
+    :param element: GeoJSON geometry, Feature, FeatureCollection or GeometryCollection
+    :return: List of [west, south, east, north]
+    :raises UnsupportedMdJson: for elements that are not GeoJSON, or that span more than 180 degrees of
+    longitude, which the mdTranslator may treat as crossing the antimeridian
+    """
+    element_type = element.get('type') if isinstance(element, dict) else None
+    if element_type == 'Feature':
+        return get_element_boxes(element['geometry']) if element.get('geometry') else []
+    if element_type == 'FeatureCollection':
+        return [box for feature in element.get('features', []) for box in get_element_boxes(feature)]
+    if element_type == 'GeometryCollection':
+        return [box for part in element.get('geometries', []) for box in get_element_boxes(part)]
+    if element_type not in geometry.POSITION_DEPTH or 'coordinates' not in element:
+        raise UnsupportedMdJson('Unsupported geographicElement: %s' % element_type)
+    box = geometry.get_bbox(element['coordinates'], geometry.POSITION_DEPTH[element_type])
+    if box is None:
+        return []
+    if box[2] - box[0] > 180:
+        raise UnsupportedMdJson('geographicElement spans more than 180 degrees of longitude')
+    return [box]
+
+def get_facets(metadata, contacts):
+    """Get the project facet for projects, and the budget facet for funded resources"""
+    ret = []
+    resource_info = metadata['resourceInfo']
+    if 'project' in [t.get('type') for t in resource_info.get('resourceType', [])]:
+        facet = {'className': PROJECT_FACET}
+        statuses = resource_info.get('status', [])
+        if statuses:
+            facet['projectStatus'] = PROJECT_STATUSES.get(statuses[0], statuses[0])
+        if resource_info.get('shortAbstract'):
+            facet['parts'] = [{'type': 'Short Project Description', 'value': resource_info['shortAbstract']}]
+        ret.append(facet)
+    budgets = get_annual_budgets(metadata.get('funding', []), contacts)
+    if budgets:
+        ret.append({'className': BUDGET_FACET, 'annualBudgets': budgets})
+    return ret
+
+def get_fiscal_year(time_period):
+    """Get the federal fiscal year (October to September) of a funding time period"""
+    for name in time_period.get('periodName', []):
+        m = re.match(r'^FY ?(\d{4})$', name)
+        if m:
+            return m.group(1)
+    date = time_period.get('startDateTime') or time_period.get('endDateTime')
+    if not date or not re.match(r'^\d{4}', date):
+        return None
+    year = int(date[:4])
+    if time_period.get('startDateTime') and len(date) >= 7 and int(date[5:7]) >= 10:
+        year += 1
+    return str(year)
+
+def get_annual_budgets(funding, contacts):
+    """Get the sbJSON annual budgets, grouping the funding allocations by fiscal year"""
+    budgets = {}
+    for fund in funding:
+        fiscal_year = get_fiscal_year(fund.get('timePeriod', {}))
+        budget = budgets.setdefault(fiscal_year, {'totalFunds': 0, 'fundingSources': []})
+        for allocation in fund.get('allocation', []):
+            source = {'amount': allocation.get('amount', 0), 'matching': bool(allocation.get('matching', False))}
+            set_value(source, 'source', contacts.get(allocation.get('sourceId'), {}).get('name'))
+            set_value(source, 'recipient', contacts.get(allocation.get('recipientId'), {}).get('name'))
+            budget['fundingSources'].append(source)
+            budget['totalFunds'] += allocation.get('amount', 0)
+    ret = []
+    for fiscal_year in sorted(budgets, key=lambda y: y or ''):
+        annual_budget = {}
+        set_value(annual_budget, 'year', fiscal_year)
+        annual_budget.update(budgets[fiscal_year])
+        ret.append(annual_budget)
+    return ret
+
+def diff(native, remote, path='', ignore=('provenance',)):
+    """Compare native and mdTranslator sbJSON
+    :param native: sbJSON translated by this module
+    :param remote: sbJSON translated by the mdTranslator
+    :param path: Path of the values being compared
+    :param ignore: Top level keys that are expected to differ
+    :return: List of differences, empty if the translations conform
+    """
+    ret = []
+    if isinstance(native, dict) and isinstance(remote, dict):
+        for key in sorted(set(native) | set(remote)):
+            if not path and key in ignore:
+                continue
+            key_path = '%s.%s' % (path, key) if path else key
+            if key not in remote:
+                ret.append('%s: only in native translation' % key_path)
+            elif key not in native:
+                ret.append('%s: only in mdTranslator translation' % key_path)
+            else:
+                ret.extend(diff(native[key], remote[key], key_path, ignore))
+    elif isinstance(native, list) and isinstance(remote, list):
+        if len(native) != len(remote):
+            ret.append('%s: %d native values, %d mdTranslator values' % (path, len(native), len(remote)))
+        elif native != remote:
+            canonical = lambda values: sorted(json.dumps(v, sort_keys=True) for v in values)
+            if canonical(native) == canonical(remote):
+                ret.append('%s: values in a different order' % path)
+            else:
+                for i, (n, r) in enumerate(zip(native, remote)):
+                    ret.extend(diff(n, r, '%s[%d]' % (path, i), ignore))
+    elif native != remote:
+        ret.append('%s: native %s, mdTranslator %s' % (path, json.dumps(native)[:100], json.dumps(remote)[:100]))
+    return ret
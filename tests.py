@@ -78,6 +78,19 @@ class MdPublisher(unittest.TestCase):
         self.assertIsNotNone(response.text)
         self.assertEqual(200, response.status_code)
 
+    def test_batch(self):
+        md_json = None
+        with open('test.json', 'r') as test_json_file:
+            md_json = json.load(test_json_file)
+        md_json['data']['parentid'] = config.LC_MAP_ID
+
+        response = self.SESSION.post(self.MD_PUBLISHER_URL + "/batch", json=[md_json, {'data': {'parentid': config.LC_MAP_ID, 'mdjson': {}}}])
+        self.assertEqual(200, response.status_code)
+        results = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual({'total': 2, 'succeeded': 1, 'failed': 1}, {k: v for k, v in results[-1]['summary'].items() if k != 'seconds'})
+        statuses = {result['index']: result['status'] for result in results[:-1]}
+        self.assertEqual({0: 200, 1: 400}, statuses)
+
     def test_put_not_exist(self):
         md_json = None
         with open('association.json', 'r') as test_json_file:
@@ -174,5 +187,175 @@ class MdPublisher(unittest.TestCase):
             if facet['facetName'] in ["Project", "Budget"]:
                 self.assertTrue('parts' in facet and len(facet['parts']) == 2)
 
+class SbJsonConformance(unittest.TestCase):
+    """
+    Compares the in-process sbJSON translation (sbjson.py) of the test records
+    with the mdTranslator at MDTRANSLATOR_URL in config/config.py. Run with
+    python -m unittest tests.SbJsonConformance
+    """
+
+    def test_conformance(self):
+        import md_publisher
+        import sbjson
+        with open('md_metadata.json', 'r') as test_json_file:
+            md_metadata = json.load(test_json_file)
+        with open('test.json', 'r') as test_json_file:
+            test = json.load(test_json_file)['data']['mdjson']
+
+        for md_json in [md_metadata, test]:
+            with self.subTest(title=md_json['metadata']['resourceInfo']['citation']['title']):
+                remote = md_publisher.translate_json(md_json)
+                self.assertNotIn('error', remote)
+                self.assertEqual([], md_publisher.log_sbjson_differences(md_json, sbjson.translate(md_json), remote))
+
+class SbJsonSpatial(unittest.TestCase):
+    """
+    Checks the in-process sbJSON bounding box of extents. Runs offline:
+    python -m unittest tests.SbJsonSpatial
+    """
+
+    def get_md_json(self, geographic_extent):
+        return {'schema': {'name': 'mdJson', 'version': '2.6.0'}, 'metadata': {'resourceInfo': {
+            'citation': {'title': 'Spatial'}, 'extent': [{'geographicExtent': [geographic_extent]}]}}}
+
+    def test_geographic_element_only(self):
+        import sbjson
+        md_json = self.get_md_json({'geographicElement': [
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [[[-150, 60], [-140, 60], [-140, 65], [-150, 60]]]}},
+            {'type': 'Point', 'coordinates': [-160.5, 58.25]}]})
+        self.assertEqual({'boundingBox': {'minX': -160.5, 'maxX': -140, 'minY': 58.25, 'maxY': 65}}, sbjson.translate(md_json)['spatial'])
+
+    def test_bounding_box_and_geographic_element(self):
+        import sbjson
+        md_json = self.get_md_json({
+            'boundingBox': {'westLongitude': -155, 'eastLongitude': -145, 'southLatitude': 55, 'northLatitude': 62},
+            'geographicElement': [{'type': 'LineString', 'coordinates': [[-150, 60], [-140, 70]]}]})
+        self.assertEqual({'boundingBox': {'minX': -155, 'maxX': -140, 'minY': 55, 'maxY': 70}}, sbjson.translate(md_json)['spatial'])
+
+    def test_antimeridian_falls_back(self):
+        import sbjson
+        md_json = self.get_md_json({'geographicElement': [{'type': 'LineString', 'coordinates': [[179, 50], [-179, 51]]}]})
+        self.assertRaises(sbjson.UnsupportedMdJson, sbjson.translate, md_json)
+
+class ReduceExtents(unittest.TestCase):
+    """
+    Checks that simplified polygons stay valid. Runs offline:
+    python -m unittest tests.ReduceExtents
+    """
+
+    def reduce(self, rings, tolerance=1):
+        import geometry
+        features = [{'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': rings}}]
+        return geometry.reduce_features(features, tolerance=tolerance)[0][0]['geometry']['coordinates']
+
+    def test_hole_stays_inside_shell(self):
+        # The bump at (5, 10.5) is within the tolerance, but dropping it would leave the hole outside the shell
+        shell = [[0, 0], [10, 0], [10, 10], [5.5, 10], [5, 10.5], [4.5, 10], [0, 10], [0, 0]]
+        self.assertNotIn([5, 10.5], self.reduce([shell])[0])
+        for hole in ([[4.9, 10.1], [5.1, 10.1], [5, 10.3], [4.9, 10.1]], [[4.8, 9.8], [5.2, 9.8], [5, 10.3], [4.8, 9.8]]):
+            rings = self.reduce([shell, hole])
+            self.assertIn([5, 10.5], rings[0])
+            self.assertEqual(hole, rings[1])
+
+    def test_ring_does_not_cross_itself(self):
+        import geometry
+        # Douglas-Peucker alone drops [4, 2], and the segment from [4, 0] to [7, 9] then crosses the ring
+        shell = [[4, 0], [4, 2], [7, 9], [9, 6], [4, 1], [7, 6], [7, 4], [9, 2], [4, 0]]
+        ring = self.reduce([shell], 2)[0]
+        self.assertIn([4, 2], ring)
+        segments = list(zip(ring, ring[1:]))
+        for i, (a, b) in enumerate(segments):
+            for c, d in segments[i + 2:]:
+                self.assertFalse(geometry.is_crossing(a, b, c, d))
+
+class UnchangedUpsert(unittest.TestCase):
+    """
+    Checks that republishing unchanged metadata sends nothing to ScienceBase. Runs offline:
+    python -m unittest tests.UnchangedUpsert
+    """
+
+    def setUp(self):
+        import copy
+        import md_publisher
+        self.md_publisher = md_publisher
+        self.md_text = md_publisher.canonical_json({'metadata': {'resourceInfo': {'citation': {'title': 'Unchanged'}}}})
+        self.item = {'title': 'Unchanged', 'body': 'Abstract', 'parentId': 'parent', 'identifiers': [{'type': 'test', 'scheme': 'test', 'key': '1'}]}
+        action, files, data = md_publisher.plan_upsert(copy.deepcopy(self.item), self.md_text, '<iso1/>', '<iso2/>', None)
+        self.assertEqual('upload', action)
+        # The item as ScienceBase returns it, with the fields it manages
+        self.existing = json.loads(data['item'])
+        self.existing.update({'id': 'item', 'link': {'rel': 'self', 'url': 'https://www.sciencebase.gov/catalog/item/item'},
+                              'provenance': {'dateCreated': '2026-01-01T00:00:00Z', 'lastUpdated': '2026-01-01T00:00:00Z'},
+                              'files': [{'name': f[1][0], 'size': len(f[1][1]), 'url': 'https://www.sciencebase.gov/catalog/file/get/item?name=%s' % f[1][0]} for f in files]})
+
+    def test_unchanged_republish(self):
+        import copy
+        item = copy.deepcopy(self.item)
+        item['id'] = 'item'
+        action, files, data = self.md_publisher.plan_upsert(item, self.md_text, '<iso1/>', '<iso2/>', self.existing)
+        self.assertIsNone(action)
+        self.assertEqual([], files)
+
+    def test_unchanged_mdjson(self):
+        import copy
+        # POST /mdjson sends back the whole item fetched from ScienceBase
+        item = copy.deepcopy(self.existing)
+        item['provenance']['lastUpdated'] = '2026-02-01T00:00:00Z'
+        action, files, data = self.md_publisher.plan_upsert(item, self.md_text, '<iso1/>', '<iso2/>', self.existing)
+        self.assertIsNone(action)
+        self.assertEqual([], files)
+
+    def test_edited_on_sciencebase(self):
+        import copy
+        # Republishing puts back what was edited on ScienceBase since the last publish
+        item = copy.deepcopy(self.item)
+        item['id'] = 'item'
+        self.existing['title'] = 'Edited'
+        self.existing['body'] = 'Edited abstract'
+        action, files, data = self.md_publisher.plan_upsert(item, self.md_text, '<iso1/>', '<iso2/>', self.existing)
+        self.assertEqual('update', action)
+
+    def test_file_replaced_on_sciencebase(self):
+        import copy
+        item = copy.deepcopy(self.item)
+        item['id'] = 'item'
+        self.existing['files'][0]['size'] += 1
+        action, files, data = self.md_publisher.plan_upsert(item, self.md_text, '<iso1/>', '<iso2/>', self.existing)
+        self.assertEqual('upload', action)
+        self.assertEqual([self.existing['files'][0]['name']], [f[1][0] for f in files])
+
+    def test_failed_translation_is_not_unchanged(self):
+        import copy
+        # An ISO file that could not be generated is retried on the next publish, even with force_update=false
+        item = copy.deepcopy(self.item)
+        item['id'] = 'item'
+        action, files, data = self.md_publisher.plan_upsert(item, self.md_text, None, '<iso2/>', self.existing)
+        self.assertFalse(self.md_publisher.is_mdjson_unchanged(json.loads(data['item']), None, md_text=self.md_text))
+        self.assertTrue(self.md_publisher.is_mdjson_unchanged(self.existing, None, md_text=self.md_text))
+
+    def test_hash_independent_of_backend(self):
+        import jsoncodec
+        # Numbers the backends format differently still hash identically
+        md_json = {'metadata': {'resourceInfo': {'citation': {'title': 'é'}}, 'values': [1e-7, 1e16, 0.1]}}
+        backend = jsoncodec.get_backend()
+        try:
+            hashes = set()
+            for name in ('orjson', 'json'):
+                try:
+                    jsoncodec.set_backend(name)
+                except ValueError:
+                    continue
+                hashes.add((self.md_publisher.canonical_json(md_json), self.md_publisher.get_item_hash(self.item)))
+            self.assertEqual(1, len(hashes))
+        finally:
+            jsoncodec.set_backend(backend)
+
+    def test_changed_item(self):
+        import copy
+        item = copy.deepcopy(self.existing)
+        item['title'] = 'Changed'
+        action, files, data = self.md_publisher.plan_upsert(item, self.md_text, '<iso1/>', '<iso2/>', self.existing)
+        self.assertEqual('update', action)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file